@@ -1,43 +1,167 @@
 
-import io
+import os
+import re
+import uuid
+import numpy as np
 import pandas as pd
 import streamlit as st
 import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
 from utils_timeseries import (
-    load_excel_to_df, select_range, series_picker, aggregate_df,
+    select_range, series_picker, aggregate_df,
     list_dates, get_day_slice, overlay_by_dates, overlay_by_dates_price, overlay_price_full_year,
     plot_lines, compute_export_offer_def1,
-    simulate_soc_with_charge_periodic_reset, derive_charge_cost_series, simulate_soc_concurrent_price_optimized
+    simulate_soc_with_charge_periodic_reset, derive_charge_cost_series, simulate_soc_concurrent_price_optimized,
+    prepare_soc_inputs, POLICY_PERIODIC, POLICY_PRICE_OPT, POLICY_HORIZON, simulate_soc_horizon_scheduled, downsample_for_plot,
+    day_slot_matrix, add_day_overlay, slot_value_density, grid_report, setup_matplotlib,
+    SLOT, SLOT_MINUTES, slot_of, slots_per_day
 )
+from utils_sweep import SWEEP_PARAMS, SWEEP_METRICS, build_grid, parse_grid_values, run_battery_sweep, sweep_pivot
+from utils_cache import (
+    load_excel_cached, resample_cached, cached_simulation, simulation_key, dataset_key, render_figure, content_hash,
+    FIGURE_DPI
+)
+from utils_export import EXPORT_FORMATS, EXPORT_MIME, export_bytes, export_file_name
+from utils_store import STORE_DIR, ingest_workbooks, open_store_cached, read_manifest
+from utils_portfolio import run_portfolio
+from utils_offer import OFFER_BLOCK_HOURS, block_offer, offer_block_summary, offer_duration_curve
+from utils_scenario import historical_scenarios, stochastic_scenarios, run_scenarios, scenario_summary, scenario_years
+from utils_jobs import submit_job, current_job, release_job
+from batch_runner import RUN_EXPORT_OFFER, RUN_SOC_PERIODIC, RUN_SOC_PRICE_OPT, RUN_SOC_HORIZON
+from utils_profile import (
+    PROFILE_DEFAULT, PROFILE_MEMORY_DEFAULT, begin_run, end_run, instrument, profile_stage, profile_view,
+    configure_fragments, discard_run, stages_frame
+)
+
+# 計測（TOSU_PROFILE=1 またはサイドバー）。無効のときラッパーは何もしない
+instrument(globals(), {"utils_timeseries", "utils_cache", "utils_store", "utils_sweep", "utils_portfolio", "utils_offer",
+                       "utils_scenario"},
+           skip={"render_figure", "setup_matplotlib"})
+PROFILE_HISTORY = 20
+
+
+def _profile_options():
+    if not st.session_state.get("sb_profile", PROFILE_DEFAULT):
+        return None
+    return {"memory": st.session_state.get("sb_profile_mem", PROFILE_MEMORY_DEFAULT),
+            "session": id(st.session_state), "on_record": _keep_profile_record}
+
+
+def _keep_profile_record(record):
+    runs = st.session_state.setdefault("profile_runs", [])
+    runs.append(record)
+    del runs[:-PROFILE_HISTORY]
+
+
+configure_fragments(_profile_options)
+_opts = _profile_options()
+if _opts:
+    begin_run("full", memory=_opts["memory"], session=_opts["session"])
+else:
+    discard_run()
+
+setup_matplotlib()
 
 st.set_page_config(page_title="鳥栖PO1期 可視化ツール", layout="wide")
 st.title("鳥栖PO1期 可視化ツール（kW/価格/オーバレイ/単独/供出可能量①/SOC充電/コスト）")
 
+DATA_SOURCES = ["Excelアップロード", "ローカルストア"]
+SLOT_LABELS = {"自動": None, **{f"{m}分": pd.Timedelta(minutes=m) for m in SLOT_MINUTES}}
+
+
+def slot_text(df):
+    """コマの長さの表示（例: 30分）"""
+    return f"{slot_of(df) / pd.Timedelta(minutes=1):g}分"
+
+
+def slot_axis_text(df):
+    """日内スロット番号の説明（例: 0=0:00 … 47=23:30）"""
+    n = slots_per_day(df)
+    return f"0=0:00 … {n - 1}={(pd.Timestamp(0) + (n - 1) * slot_of(df)):%H:%M}"
+
+
+def day_end(date_val, df):
+    """終了日の最終スロットの開始時刻"""
+    return pd.Timestamp(date_val) + pd.Timedelta(days=1) - slot_of(df)
+
+
+def settlement_frame(df):
+    """サイドバーで指定したときは30分の精算コマに集計する（30分より細かいデータのみ）"""
+    if st.session_state.get("sb_resample") and slot_of(df) < SLOT:
+        return resample_cached(df, SLOT)
+    return df
+
+
 with st.sidebar:
     st.header("データ入力")
-    up = st.file_uploader("Excel（.xlsx）をアップロード", type=["xlsx"], key="sb_uploader")
-    sheet_name = st.text_input("シート名（未入力なら先頭シート）", value="", key="sb_sheet")
+    source = st.radio("データソース", DATA_SOURCES, horizontal=True, key="sb_source")
+    if source == DATA_SOURCES[0]:
+        up = st.file_uploader("Excel（.xlsx）をアップロード", type=["xlsx"], key="sb_uploader")
+        sheet_name = st.text_input("シート名（未入力なら先頭シート）", value="", key="sb_sheet")
+    else:
+        store_dir = st.text_input("ストアのフォルダ", value=STORE_DIR, key="sb_store_dir")
+        ups = st.file_uploader("ストアに取り込むExcel（複数可）", type=["xlsx"], accept_multiple_files=True,
+                               key="sb_ingest_files")
+        all_sheets = st.checkbox("全シートを取り込む", value=False, key="sb_ingest_all")
+        if st.button("取り込み", disabled=not ups, key="sb_ingest_btn"):
+            try:
+                with st.spinner("取り込み中..."):
+                    report = ingest_workbooks(ups, store_dir, sheets="*" if all_sheets else None)
+                st.dataframe(report, hide_index=True)
+            except Exception as e:
+                st.error(f"取り込みエラー: {e}")
+        manifest = read_manifest(store_dir)
+        st.caption(f"取り込み済み: {len(manifest['sources'])} ソース / "
+                   f"{sum(p['rows'] for p in manifest['parts'])} 行")
+    slot_sel = SLOT_LABELS[st.selectbox("データの刻み", list(SLOT_LABELS), index=0, key="sb_slot",
+                                        help="「自動」は開始日時の間隔から推定します")]
+    st.checkbox("30分の精算コマに集計", value=False, key="sb_resample",
+                help="1分・5分・15分のデータを30分ごとに集計します（使用電力量は合計、kW・価格は平均）")
     st.divider()
     st.subheader("共通パラメータ")
     P_pcs_common = st.number_input("PCS定格（kW）", min_value=1, value=1000, step=10, key="sb_pcs")
+    st.divider()
+    profile_on = st.toggle("処理時間を計測", value=PROFILE_DEFAULT, key="sb_profile",
+                           help="関数・図・ダウンロードごとの時間を画面下部とログに出します")
+    if profile_on:
+        st.checkbox("メモリも計測（遅くなります）", value=PROFILE_MEMORY_DEFAULT, key="sb_profile_mem")
 
-if up is None:
-    st.info("左のサイドバーからExcelファイルをアップロードしてください。")
-    st.stop()
-
-try:
-    df = load_excel_to_df(up, sheet_name)
-except Exception as e:
-    st.error(f"読み込みエラー: {e}")
-    st.stop()
+if source == DATA_SOURCES[0]:
+    if up is None:
+        st.info("左のサイドバーからExcelファイルをアップロードしてください。")
+        st.stop()
+    try:
+        df = settlement_frame(load_excel_cached(up, sheet_name, slot=slot_sel))
+    except Exception as e:
+        st.error(f"読み込みエラー: {e}")
+        st.stop()
+else:
+    try:
+        df = settlement_frame(open_store_cached(store_dir, slot=slot_sel))
+    except Exception as e:
+        st.error(f"ストアの読み込みエラー: {e}")
+        st.stop()
+    if df.empty:
+        st.info("ストアにデータがありません。サイドバーからExcelを取り込んでください。")
+        st.stop()
 
 st.success("データの読み込みに成功しました。")
 has_price = "JEPXスポットプライス" in df.columns and df["JEPXスポットプライス"].notna().any()
 
 min_t, max_t = df.index.min(), df.index.max()
-st.caption(f"データ期間: {min_t} 〜 {max_t}（JEPX価格列: {'あり' if has_price else 'なし'}）")
+st.caption(f"データ期間: {min_t} 〜 {max_t}（{slot_text(df)}刻み、JEPX価格列: {'あり' if has_price else 'なし'}）")
+report = grid_report(df)
+if report.get("duplicates") or report.get("missing_slots") or report.get("off_grid"):
+    msgs = []
+    if report.get("duplicates"):
+        msgs.append(f"重複した開始日時 {report['duplicates']} 行（先頭行を採用）")
+    if report.get("missing_slots"):
+        msgs.append(f"欠損スロット {report['missing_slots']} コマ（空欄として補完）")
+    if report.get("off_grid"):
+        msgs.append(f"{slot_text(df)}境界に乗らない時刻 {report['off_grid']} 行（補完なし）")
+    st.warning("時刻の格子チェック: " + " / ".join(msgs))
 
-tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = st.tabs([
+VIEW_LABELS = [
     "1) 基本プロット（kW + 価格）",
     "2) 集計（kW/価格）",
     "4) オーバレイ（kW/価格）",
@@ -46,12 +170,131 @@ tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = st.tabs([
     "7) 価格：1年分オーバレイ",
     "8) SOCシミュレーション（充電コマ考慮・期間指定）",
     "9) 充電コスト（集計）",
-    "10) 予備",
-])
+    "10) 電池サイズ スイープ",
+    "11) ポートフォリオ（複数サイト）",
+]
+# st.tabs は非表示タブも毎回実行するので、選択中の画面だけを描画する。
+# 各画面は st.fragment なので、画面内のウィジェット操作ではその画面だけが再実行される。
+view = st.radio("表示する画面", VIEW_LABELS, horizontal=True, key="view")
+
+
+def _keep_widget_state():
+    # 描画されなかった画面のウィジェット値は実行終了時に破棄されるため、
+    # 再代入して画面切替後も入力値を保持する（ボタン/ダウンロード/アップロードは対象外）
+    for k in list(st.session_state.keys()):
+        if re.match(r"t\d+_", k) and not re.search(r"_(btn|dl\w*|files)$", k):
+            st.session_state[k] = st.session_state[k]
+
+
+_keep_widget_state()
+
+PLOT_WIDTH_IN = 12  # 時系列の図の幅（figsize の横）
+PLOT_WIDTH_PX = PLOT_WIDTH_IN * FIGURE_DPI  # render_figure で画像にしたときの横幅 [px]
+DOWNSAMPLE_METHODS = {"min/max（ピーク保持）": "minmax", "LTTB（形状優先）": "lttb"}
+SOC_POLICY_LABELS = {
+    "0:00から連続充電（従来）": POLICY_PERIODIC,
+    "当日最安コマ優先（同時供出）": POLICY_PRICE_OPT,
+    "計画区間内の最安コマ優先（複数日）": POLICY_HORIZON,
+}
+SOC_SIMULATORS = {
+    POLICY_PERIODIC: simulate_soc_with_charge_periodic_reset,
+    POLICY_PRICE_OPT: simulate_soc_concurrent_price_optimized,
+    POLICY_HORIZON: simulate_soc_horizon_scheduled,
+}
+
+
+JOB_POLL_S = 0.25
+
+
+def job_slot(name):
+    # ジョブの枠はセッションごと（st.session_state はセッション間で同じオブジェクトなのでIDを持たせる）
+    return st.session_state.setdefault("job_session", uuid.uuid4().hex), name
+
+
+def wait_for_job(job, label):
+    # 終わるまで進捗を出して待つ。待っている間に入力が変わると画面が再実行され（進捗の更新で中断される）、
+    # 新しい条件で投入したジョブが前のジョブを取り消す
+    if not job.wait(JOB_POLL_S / 5):
+        bar = st.progress(job.progress, text=f"{label}を計算中...")
+        with profile_stage(f"job:{job.slot[1]}"):
+            while not job.wait(JOB_POLL_S):
+                bar.progress(job.progress, text=f"{label}を計算中...（{job.progress:.0%}）")
+        bar.empty()
+    return job.result()
+
+
+def run_job(name, label, signature, fn, *args, **kwargs):
+    # 重い処理はバックグラウンドのジョブで実行して待つ（同じ条件なら実行中・完了済みのジョブを使う）
+    return wait_for_job(submit_job(job_slot(name), signature, fn, *args, label=label, **kwargs), label)
+
+
+def simulate(name, fn, df, **params):
+    # cached_simulation をジョブで実行する（計算済みなら待たずに返る）
+    return run_job(name, "SOCシミュレーション", simulation_key(fn, df, **params), cached_simulation, fn, df, **params)
+
+
+def collect_job(name, label, signature):
+    # ボタンで投入したジョブの結果を受け取る（無い・条件が変わって取り消したときは None）
+    job = current_job(job_slot(name), signature)
+    if job is None:
+        return None
+    try:
+        return wait_for_job(job, label)
+    finally:
+        # 終わったら結果（または例外）は呼び出し側が持つ。待っている途中で画面が再実行されたときは残す
+        if job.done():
+            release_job(job)
+
+
+def show_figure(name, build, *key_parts):
+    # 同じデータ・表示条件の図は再描画せず、キャッシュ済みの画像を表示する
+    with profile_stage(f"figure:{name}"):
+        st.image(render_figure(name, build, *key_parts), use_column_width=True)
+
+
+def export_download(label, frame, base_name, key, index=True, index_label=None):
+    # 書き出しは「作成」を押したときだけ行う（再実行のたびに全データを変換しない）。
+    # 作成済みのデータはセッションに1つだけ持ち、表示中のデータと条件が同じ間だけダウンロードを出す
+    c1, c2, c3 = st.columns([1, 1, 2])
+    with c1:
+        fmt = st.selectbox(f"{label}の形式", EXPORT_FORMATS, key=f"{key}_fmt", label_visibility="collapsed")
+    ready = st.session_state.get("export_ready")
+    with c2:
+        if st.button(f"{label}を作成", key=f"{key}_btn"):
+            submit_job(job_slot(f"export:{key}"), (fmt, content_hash(frame)), export_bytes, frame, fmt,
+                       index=index, index_label=index_label, label=label)
+    if current_job(job_slot(f"export:{key}")) is not None:
+        sig = (fmt, content_hash(frame))
+        with c3, profile_stage(f"download:{key}"):
+            data = collect_job(f"export:{key}", f"{label}の書き出し", sig)
+        if data is not None:
+            ready = st.session_state["export_ready"] = {"key": key, "sig": sig, "data": data}
+    if ready is None or ready["key"] != key:
+        return
+    if ready["sig"] != (fmt, content_hash(frame)):
+        # 条件が変わったら古いデータは捨てる
+        del st.session_state["export_ready"]
+        return
+    with c3:
+        st.download_button(f"{label}をダウンロード（{len(ready['data']) / 2 ** 20:.1f} MB）", data=ready["data"],
+                           file_name=export_file_name(base_name, fmt), mime=EXPORT_MIME[fmt], key=f"{key}_dl")
+
+
+def downsample_controls(key_prefix):
+    # 長期間のコマ単位のデータは描画幅に合わせて間引く（期間を狭めると自動的に生データに戻る）
+    c1, c2 = st.columns([1, 3])
+    with c1:
+        raw = st.checkbox("生データ表示（間引きなし）", value=False, key=f"{key_prefix}_raw")
+    with c2:
+        label = st.radio("間引き方式", list(DOWNSAMPLE_METHODS), horizontal=True, disabled=raw, key=f"{key_prefix}_ds")
+    return None if raw else DOWNSAMPLE_METHODS[label]
+
 
 # --- Tab1 ---
-with tab1:
-    st.subheader("基本プロット（30分）")
+@st.fragment
+@profile_view("t1")
+def render_basic_plot(df, has_price, min_t, max_t, P_pcs_common):
+    st.subheader(f"基本プロット（{slot_text(df)}）")
     c1, c2, c3, c4 = st.columns(4)
     with c1:
         series = st.selectbox("系列（出力）", ["both", "ロス後", "ロス前"], index=0, key="t1_series")
@@ -66,45 +309,55 @@ with tab1:
             default=(["出力(kW)", "JEPXスポットプライス"] if has_price else ["出力(kW)"]),
             key="t1_outputs"
         )
+    ds_method = downsample_controls("t1")
     dfr = select_range(df, pd.Timestamp(start), pd.Timestamp(end) + pd.Timedelta(days=1))
-    fig, ax = plt.subplots(figsize=(12,6))
-
-    # 出力
-    if "出力(kW)" in outputs:
-        plot_df = series_picker(dfr, series=series, use_kw=True)
-        for col in plot_df.columns:
-            ax.plot(plot_df.index, plot_df[col], label=col)
-        ax.set_ylabel("平均出力 (kW)")
-
-    # 価格
-    if "JEPXスポットプライス" in outputs and has_price:
-        if "出力(kW)" in outputs:
-            ax2 = ax.twinx()
-            ax2.plot(dfr.index, dfr["JEPXスポットプライス"], label="価格")
-            ax2.set_ylabel("JEPXスポットプライス (円/kWh)")
-        else:
-            ax.plot(dfr.index, dfr["JEPXスポットプライス"], label="価格")
-            ax.set_ylabel("JEPXスポットプライス (円/kWh)")
-
-    ax.set_xlabel("時刻")
-    title_parts = []
-    if "出力(kW)" in outputs: title_parts.append("出力")
-    if "JEPXスポットプライス" in outputs: title_parts.append("価格")
-    ax.set_title(" / ".join(title_parts) if title_parts else "表示なし")
-
-    # 凡例（twinx 対応）
-    handles, labels = ax.get_legend_handles_labels()
-    if "JEPXスポットプライス" in outputs and "出力(kW)" in outputs:
-        h2, l2 = ax2.get_legend_handles_labels()
-        handles += h2; labels += l2
-    if handles:
-        ax.legend(handles, labels, loc="upper left")
-
-    ax.grid(True)
-    st.pyplot(fig)
+    show_kw = "出力(kW)" in outputs
+    show_price = "JEPXスポットプライス" in outputs and has_price
+    kw_series = downsample_for_plot(series_picker(dfr, series=series, use_kw=True), PLOT_WIDTH_PX, ds_method) if show_kw else {}
+    price = downsample_for_plot(dfr["JEPXスポットプライス"], PLOT_WIDTH_PX, ds_method)["JEPXスポットプライス"] if show_price else None
+
+    def build():
+        fig, ax = plt.subplots(figsize=(PLOT_WIDTH_IN, 6))
+
+        # 出力
+        if show_kw:
+            for col, ser in kw_series.items():
+                ax.plot(ser.index, ser.values, label=col)
+            ax.set_ylabel("平均出力 (kW)")
+
+        # 価格
+        if show_price:
+            if show_kw:
+                ax2 = ax.twinx()
+                ax2.plot(price.index, price.values, label="価格")
+                ax2.set_ylabel("JEPXスポットプライス (円/kWh)")
+            else:
+                ax.plot(price.index, price.values, label="価格")
+                ax.set_ylabel("JEPXスポットプライス (円/kWh)")
+
+        ax.set_xlabel("時刻")
+        title_parts = []
+        if "出力(kW)" in outputs: title_parts.append("出力")
+        if "JEPXスポットプライス" in outputs: title_parts.append("価格")
+        ax.set_title(" / ".join(title_parts) if title_parts else "表示なし")
+
+        # 凡例（twinx 対応）
+        handles, labels = ax.get_legend_handles_labels()
+        if show_price and show_kw:
+            h2, l2 = ax2.get_legend_handles_labels()
+            handles += h2; labels += l2
+        if handles:
+            ax.legend(handles, labels, loc="upper left")
+
+        ax.grid(True)
+        return fig
+
+    show_figure("t1", build, outputs, kw_series, price)
 
 # --- Tab2 ---
-with tab2:
+@st.fragment
+@profile_view("t2")
+def render_aggregate(df, has_price, min_t, max_t, P_pcs_common):
     st.subheader("集計（kW/価格）")
     c1, c2, c3, c4, c5 = st.columns(5)
     with c1:
@@ -122,21 +375,27 @@ with tab2:
     plot_df2 = series_picker(dfr2, series=series2, use_kw=True)
     agg_code = "D" if agg.startswith("日") else "M"
     plot_df2 = aggregate_df(plot_df2, aggregate=agg_code, how=how)
-    fig2, ax = plt.subplots(figsize=(12,6))
-    for col in plot_df2.columns:
-        ax.plot(plot_df2.index, plot_df2[col], label=col)
-    ax.set_xlabel("日付" if agg_code=="D" else "年月")
-    ax.set_ylabel(f"{how} kW（{'日平均' if agg_code=='D' else '月平均'}）")
-    title2 = f"kW {('日' if agg_code=='D' else '月')}集計（{how}）"
-    if show_price2:
-        price_series = aggregate_df(dfr2[["JEPXスポットプライス"]], aggregate=agg_code, how="mean")
-        ax2 = ax.twinx(); ax2.plot(price_series.index, price_series["JEPXスポットプライス"])
-        ax2.set_ylabel("JEPXスポットプライス 平均 (円/kWh)"); title2 += " + 価格(平均)"
-    ax.set_title(title2); ax.legend(loc="upper left"); ax.grid(True)
-    st.pyplot(fig2)
+    price_series = aggregate_df(dfr2[["JEPXスポットプライス"]], aggregate=agg_code, how="mean") if show_price2 else None
+
+    def build():
+        fig2, ax = plt.subplots(figsize=(12,6))
+        for col in plot_df2.columns:
+            ax.plot(plot_df2.index, plot_df2[col], label=col)
+        ax.set_xlabel("日付" if agg_code=="D" else "年月")
+        ax.set_ylabel(f"{how} kW（{'日平均' if agg_code=='D' else '月平均'}）")
+        title2 = f"kW {('日' if agg_code=='D' else '月')}集計（{how}）"
+        if show_price2:
+            ax2 = ax.twinx(); ax2.plot(price_series.index, price_series["JEPXスポットプライス"])
+            ax2.set_ylabel("JEPXスポットプライス 平均 (円/kWh)"); title2 += " + 価格(平均)"
+        ax.set_title(title2); ax.legend(loc="upper left"); ax.grid(True)
+        return fig2
+
+    show_figure("t2", build, plot_df2, price_series, how, agg_code)
 
 # --- Tab3 ---
-with tab3:
+@st.fragment
+@profile_view("t3")
+def render_overlay(df, has_price, min_t, max_t, P_pcs_common):
     st.subheader("オーバレイ（kW/価格）")
     catalog = list_dates(df)
     target = st.radio("対象", ["出力(kW)", "JEPXスポットプライス"], horizontal=True, key="t4_target")
@@ -154,7 +413,11 @@ with tab3:
         md = st.text_input("月日（MM-DD）", value="08-15", key="t4_md")
         years = st.multiselect("対象年", sorted(catalog["year"].unique().tolist()), default=sorted(catalog["year"].unique().tolist()), key="t4_years")
         dates = [f"{y}-{md}" for y in years]
+    request4 = (target, which if target == "出力(kW)" else None, tuple(dates), dataset_key(df))
     if st.button("プロット", type="primary", key="t4_btn"):
+        st.session_state["t4_plotted"] = request4
+    # 「作成」などで再実行されても、条件が変わるまではプロットとダウンロードを表示し続ける
+    if st.session_state.get("t4_plotted") == request4:
         if target == "出力(kW)":
             mat = overlay_by_dates(df, dates, which=which); ylabel = "平均出力 (kW)"; title = f"日曲線オーバレイ（{which}）"
         else:
@@ -162,20 +425,27 @@ with tab3:
         if mat.empty:
             st.warning("該当するデータがありません。")
         else:
-            fig3, ax = plt.subplots(figsize=(12,6))
-            for col in mat.columns:
-                ax.plot(range(48), mat[col], label=col)
-            ax.set_xlabel("時刻（30分刻み、0=0:00 … 47=23:30）"); ax.set_ylabel(ylabel); ax.set_title(title); ax.legend(); ax.grid(True)
-            st.pyplot(fig3)
-            st.download_button("CSVをダウンロード", data=mat.to_csv(index_label="slot(30min)").encode("utf-8-sig"),
-                               file_name=("overlay_kw.csv" if target=="出力(kW)" else "overlay_jepx.csv"), mime="text/csv", key="t4_dl")
+            def build():
+                fig3, ax = plt.subplots(figsize=(12,6))
+                for col in mat.columns:
+                    ax.plot(range(len(mat)), mat[col], label=col)
+                ax.set_xlabel(f"時刻（{slot_text(df)}刻み、{slot_axis_text(df)}）"); ax.set_ylabel(ylabel); ax.set_title(title); ax.legend(); ax.grid(True)
+                return fig3
+
+            show_figure("t3", build, mat, ylabel, title)
+            export_download("オーバレイ", mat, "overlay_kw" if target=="出力(kW)" else "overlay_jepx", key="t4_exp",
+                            index_label=f"slot({slot_text(df)})")
 
 # --- Tab4 ---
-with tab4:
+@st.fragment
+@profile_view("t4")
+def render_single(df, has_price, min_t, max_t, P_pcs_common):
     st.subheader("単独表示（kW/価格・範囲指定）")
     c1, c2, c3, c4, c5 = st.columns(5)
     with c1:
-        agg5 = st.selectbox("粒度", ["30分(raw)", "日平均(D)", "月平均(M)"], index=0, key="t5_agg")
+        # 選択肢は固定し、表示だけコマの長さに合わせる（刻みを変えても選択が残るように）
+        agg5 = st.selectbox("粒度", ["raw", "日平均(D)", "月平均(M)"], index=0, key="t5_agg",
+                            format_func=lambda o: f"{slot_text(df)}(raw)" if o == "raw" else o)
     with c2:
         series5 = st.selectbox("系列（kW）", ["both", "ロス後", "ロス前"], index=0, key="t5_series")
     with c3:
@@ -184,20 +454,32 @@ with tab4:
         end5 = st.date_input("終了日", value=max_t.date(), key="t5_end")
     with c5:
         show_price5 = st.checkbox("JEPX価格も表示（右軸）", value=has_price, disabled=not has_price, key="t5_price")
+    agg_code5 = None if agg5 == "raw" else ("D" if agg5.startswith("日") else "M")
+    ds_method5 = downsample_controls("t5") if agg_code5 is None else None
     dfr5 = select_range(df, pd.Timestamp(start5), pd.Timestamp(end5) + pd.Timedelta(days=1))
     plot_df5 = series_picker(dfr5, series=series5, use_kw=True)
-    agg_code5 = None if agg5.startswith("30") else ("D" if agg5.startswith("日") else "M")
     plot_df5 = aggregate_df(plot_df5, aggregate=agg_code5, how="mean")
-    fig5, ax = plt.subplots(figsize=(12,6))
-    for col in plot_df5.columns: ax.plot(plot_df5.index, plot_df5[col], label=col)
-    ax.set_xlabel("時刻" if agg_code5 is None else ("日付" if agg_code5=="D" else "年月")); ax.set_ylabel("平均出力 (kW)"); title5 = "単独表示（kW）"
+    kw_series5 = downsample_for_plot(plot_df5, PLOT_WIDTH_PX, ds_method5)
+    price_plot = None
     if show_price5:
         price_plot = aggregate_df(dfr5[["JEPXスポットプライス"]], aggregate=agg_code5, how="mean")
-        ax2 = ax.twinx(); ax2.plot(price_plot.index, price_plot["JEPXスポットプライス"]); ax2.set_ylabel("JEPXスポットプライス (円/kWh)"); title5 += " + 価格"
-    ax.set_title(title5); ax.legend(loc="upper left"); ax.grid(True); st.pyplot(fig5)
+        price_plot = downsample_for_plot(price_plot, PLOT_WIDTH_PX, ds_method5)["JEPXスポットプライス"]
+
+    def build():
+        fig5, ax = plt.subplots(figsize=(PLOT_WIDTH_IN, 6))
+        for col, ser in kw_series5.items(): ax.plot(ser.index, ser.values, label=col)
+        ax.set_xlabel("時刻" if agg_code5 is None else ("日付" if agg_code5=="D" else "年月")); ax.set_ylabel("平均出力 (kW)"); title5 = "単独表示（kW）"
+        if show_price5:
+            ax2 = ax.twinx(); ax2.plot(price_plot.index, price_plot.values); ax2.set_ylabel("JEPXスポットプライス (円/kWh)"); title5 += " + 価格"
+        ax.set_title(title5); ax.legend(loc="upper left"); ax.grid(True)
+        return fig5
+
+    show_figure("t4", build, kw_series5, price_plot, agg_code5)
 
 # --- Tab5: Export offer def1 ---
-with tab5:
+@st.fragment
+@profile_view("t5")
+def render_export_offer(df, has_price, min_t, max_t, P_pcs_common):
     st.subheader("供出可能量（定義①：1000-(L-G)）")
     c1, c2, c3 = st.columns(3)
     with c1:
@@ -218,33 +500,103 @@ with tab5:
                                             load_col=(None if load_col=="自動" else load_col),
                                             gen_col=(None if gen_col=="自動" else gen_col))
     min_val = offer.min(); min_ts = offer.idxmin()
-    fig6, ax = plt.subplots(figsize=(12,6))
-    ax.plot(offer.index, offer.values, label="供出可能量(①)"); ax.axhline(min_val, linestyle="--", label=f"最小値 {min_val:.1f} kW")
-    x_pos = offer.index[int(len(offer)*0.6)]; ax.text(x_pos, float(min_val), f"最小値 {min_val:.1f} kW @ {min_ts}", bbox=dict(facecolor="white", alpha=0.7))
-    ax.set_xlabel("時刻"); ax.set_ylabel("供出可能量 (kW)"); ax.set_title("一次調整力 供出可能量（定義①）— 推移と最小値"); ax.grid(True); ax.legend(); st.pyplot(fig6)
+
+    def build():
+        fig6, ax = plt.subplots(figsize=(12,6))
+        ax.plot(offer.index, offer.values, label="供出可能量(①)"); ax.axhline(min_val, linestyle="--", label=f"最小値 {min_val:.1f} kW")
+        x_pos = offer.index[int(len(offer)*0.6)]; ax.text(x_pos, float(min_val), f"最小値 {min_val:.1f} kW @ {min_ts}", bbox=dict(facecolor="white", alpha=0.7))
+        ax.set_xlabel("時刻"); ax.set_ylabel("供出可能量 (kW)"); ax.set_title("一次調整力 供出可能量（定義①）— 推移と最小値"); ax.grid(True); ax.legend()
+        return fig6
+
+    show_figure("t5", build, offer)
     out_df = pd.DataFrame({"供出可能量kW(①=PCS-(L-G))": offer, "需要kW(L)": L, "自家発kW(G)": G})
-    st.download_button("CSVをダウンロード", data=out_df.to_csv().encode("utf-8-sig"), file_name="export_offer_def1.csv", mime="text/csv", key="t6_dl")
+    export_download("供出可能量", out_df, "export_offer_def1", key="t6_exp")
+
+    st.markdown("#### ブロック別の保証量（複数設定）")
+    st.caption("0:00起点の固定ブロックごとに、ブロック内で保証できる供出可能量（最小値）と下側パーセンタイルを求めます。"
+               "PCS定格・逆潮上限はカンマ区切り、または 開始:終了:刻み で複数指定できます（逆潮上限の空欄=無制限）。")
+    b1, b2, b3, b4 = st.columns(4)
+    with b1:
+        block_h = st.selectbox("ブロック長（時間）", OFFER_BLOCK_HOURS, index=OFFER_BLOCK_HOURS.index(3), key="t6_block_h")
+    with b2:
+        pct = st.number_input("パーセンタイル（%）", min_value=0.0, max_value=100.0, value=10.0, step=5.0, key="t6_block_pct")
+    with b3:
+        pcs_text = st.text_input("PCS定格（kW）", value=f"{P_pcs_common:g}", key="t6_block_pcs")
+    with b4:
+        exp_text = st.text_input("逆潮上限（kW）", value=P_exp_max.strip(), key="t6_block_exp")
+    try:
+        pcs_vals = parse_grid_values(pcs_text) or [float(P_pcs_common)]
+        exp_vals = parse_grid_values(exp_text) or None
+    except ValueError as e:
+        st.error(f"設定値の指定が正しくありません: {e}")
+        return
+    blocks = block_offer(dfr6, pcs_vals, exp_vals, block_hours=block_h, percentiles=(pct,),
+                         load_col=(None if load_col=="自動" else load_col),
+                         gen_col=(None if gen_col=="自動" else gen_col))
+    summary6 = offer_block_summary(blocks)
+    curve6 = offer_duration_curve(blocks)
+
+    def build_blocks():
+        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5), gridspec_kw={"width_ratios": [2, 1]})
+        ax1.step(blocks["blocks"], blocks["min"][:, 0], where="post", label="ブロック最小値")
+        ax1.step(blocks["blocks"], blocks[f"p{pct:g}"][:, 0], where="post", alpha=0.6, label=f"{pct:g}パーセンタイル")
+        ax1.set_title(f"{curve6.columns[0]}：{block_h}時間ブロック"); ax1.set_ylabel("供出可能量 (kW)")
+        ax1.grid(True); ax1.legend()
+        for col in curve6.columns[:12]:
+            ax2.plot(curve6.index, curve6[col], label=col)
+        ax2.set_title("保証量の持続曲線"); ax2.set_xlabel("保証できる時間数 (h)"); ax2.set_ylabel("供出可能量 (kW)")
+        ax2.grid(True); ax2.legend(fontsize=7)
+        return fig
+
+    show_figure("t5_blocks", build_blocks, blocks["blocks"], blocks["min"][:, 0], blocks[f"p{pct:g}"][:, 0], curve6.iloc[:, :12])
+    st.dataframe(summary6, use_container_width=True, hide_index=True)
+    export_download("ブロック別の要約", summary6, "export_offer_blocks_summary", key="t6_block_exp1", index=False)
 
 # --- Tab6: Price full-year overlay ---
-with tab6:
-    st.subheader("JEPXスポットプライス：1年分オーバレイ（各日×48スロット）")
-    ymax = st.number_input("縦軸上限（円/kWh）", min_value=10, value=40, step=5, key="t6_ymax")
+def price_year_matrices(df):
     mat = overlay_price_full_year(df)
+    return mat, (None if mat.empty else day_slot_matrix(df, "JEPXスポットプライス")[1])
+
+
+@st.fragment
+@profile_view("t6")
+def render_price_year(df, has_price, min_t, max_t, P_pcs_common):
+    n_slots = slots_per_day(df)
+    st.subheader(f"JEPXスポットプライス：1年分オーバレイ（各日×{n_slots}スロット）")
+    c1, c2 = st.columns(2)
+    with c1:
+        ymax = st.number_input("縦軸上限（円/kWh）", min_value=10, value=40, step=5, key="t6_ymax")
+    with c2:
+        mode7 = st.radio("表示方法", ["ライン（全日重ね描き）", "密度ヒートマップ"], horizontal=True, key="t6_mode")
+    mat, day_mat = run_job("t6_overlay", "1年分オーバレイ", dataset_key(df), price_year_matrices, df)
     if mat.empty:
         st.warning("価格列が見つからないか、データがありません。")
     else:
-        fig7, ax = plt.subplots(figsize=(12,6))
-        for col in mat.columns:
-            ax.plot(range(48), mat[col], alpha=0.2, linewidth=0.7)
-        ax.set_xlabel("時刻スロット (0=0:00, ..., 47=23:30)"); ax.set_ylabel("JEPXスポットプライス (円/kWh)")
-        ax.set_title("JEPXスポットプライス 日曲線オーバレイ（全日）"); ax.grid(True); ax.set_xlim(0,47); ax.set_ylim(0, ymax)
-        ax.set_xticks(range(0, 48, 4))
-        st.pyplot(fig7)
-        st.download_button("CSVをダウンロード（48×日数）", data=mat.to_csv(index_label="slot(30min)").encode("utf-8-sig"),
-                           file_name="jepx_overlay_full_year.csv", mime="text/csv", key="t6_dl2")
+        def build():
+            fig7, ax = plt.subplots(figsize=(12,6))
+            if mode7 == "密度ヒートマップ":
+                # 日数によらず (価格ビン × スロット数) の画像1枚を描くだけ
+                counts, _ = slot_value_density(day_mat, 0.0, float(ymax), bins=100)
+                im = ax.imshow(np.where(counts > 0, counts, np.nan), origin="lower", aspect="auto", cmap="magma",
+                               extent=(-0.5, n_slots - 0.5, 0, ymax), norm=LogNorm(vmin=1))
+                fig7.colorbar(im, ax=ax, label="日数")
+                title7 = "JEPXスポットプライス 分布（スロット×価格）"
+            else:
+                add_day_overlay(ax, day_mat, alpha=0.2, linewidth=0.7)
+                title7 = "JEPXスポットプライス 日曲線オーバレイ（全日）"
+            ax.set_xlabel(f"時刻スロット ({slot_axis_text(df)})"); ax.set_ylabel("JEPXスポットプライス (円/kWh)")
+            ax.set_title(title7); ax.grid(True); ax.set_xlim(0, n_slots - 1); ax.set_ylim(0, ymax)
+            ax.set_xticks(range(0, n_slots, max(n_slots // 12, 1)))
+            return fig7
+
+        show_figure("t6", build, day_mat, mode7, ymax)
+        export_download(f"{n_slots}×日数の行列", mat, "jepx_overlay_full_year", key="t6_exp2",
+                        index_label=f"slot({slot_text(df)})")
 
 # --- Tab7: SOC simulation with charge and period selection ---
-with tab7:
+@st.fragment
+@profile_view("t7")
+def render_soc(df, has_price, min_t, max_t, P_pcs_common):
     st.subheader("SOCシミュレーション（充電コマ考慮・期間指定）")
     st.caption("充電中も負荷供出を継続し、(供出kW + 充電kW) ≤ PCS。充電日は当日最安コマから割当るオプションを追加。")
     c1, c2, c3, c4, c5 = st.columns(5)
@@ -266,46 +618,45 @@ with tab7:
     with c8:
         P_pcs_for_soc = st.number_input("PCS定格（kW）", min_value=1, value=1000, step=10, key="t7_pcs")
     load_col7 = st.selectbox("需要列（自動推定可）", ["自動", "需要計画量(ロス前)", "需要計画量", "需要kW"], index=0, key="t7_load")
-    policy = st.radio("充電スケジュール", ["0:00から連続充電（従来）", "当日最安コマ優先（同時供出）"], horizontal=True, key="t7_policy")
+    policy = SOC_POLICY_LABELS[st.radio("充電スケジュール", list(SOC_POLICY_LABELS), horizontal=True, key="t7_policy")]
     gen_col7 = st.selectbox("自家発列（無ければなし）", ["自動", "自家発出力", "PV出力", "太陽光出力", "発電kW"], index=0, key="t7_gen")
-    if policy == "当日最安コマ優先（同時供出）":
-        soc_df = simulate_soc_concurrent_price_optimized(
-            df,
-            P_pcs=P_pcs_for_soc, P_chg=P_chg, E_nom=E_nom,
-            start=pd.Timestamp(start_soc), end=pd.Timestamp(end_soc) + pd.Timedelta(days=1) - pd.Timedelta(minutes=30),
-            soc_init_pct=soc_init_pct, soc_floor_pct=soc_floor_pct, reset_every_days=reset_days,
-            load_col=(None if load_col7=="自動" else load_col7),
-            gen_col=(None if gen_col7=="自動" else gen_col7)
-        )
-    else:
-        soc_df = simulate_soc_with_charge_periodic_reset(
-            df,
-            P_pcs=P_pcs_for_soc, P_chg=P_chg, E_nom=E_nom,
-            start=pd.Timestamp(start_soc), end=pd.Timestamp(end_soc) + pd.Timedelta(days=1) - pd.Timedelta(minutes=30),
-            soc_init_pct=soc_init_pct, soc_floor_pct=soc_floor_pct, reset_every_days=reset_days,
-            load_col=(None if load_col7=="自動" else load_col7),
-            gen_col=(None if gen_col7=="自動" else gen_col7)
-        )
+    extra7 = {}
+    if policy == POLICY_HORIZON:
+        horizon7 = st.number_input("計画区間（日、0なら充電間隔）", min_value=0, value=0, step=1, key="t7_horizon")
+        extra7["horizon_days"] = int(horizon7) or None
+    soc_df = simulate(
+        "t7_sim", SOC_SIMULATORS[policy], df,
+        P_pcs=P_pcs_for_soc, P_chg=P_chg, E_nom=E_nom,
+        start=pd.Timestamp(start_soc), end=day_end(end_soc, df),
+        soc_init_pct=soc_init_pct, soc_floor_pct=soc_floor_pct, reset_every_days=reset_days,
+        load_col=(None if load_col7=="自動" else load_col7),
+        gen_col=(None if gen_col7=="自動" else gen_col7), **extra7
+    )
     if soc_df.empty:
         st.warning("SOCシミュレーションに必要なデータが不足しています。")
     else:
-        fig8, ax = plt.subplots(figsize=(12,6))
-        ax.plot(soc_df.index, soc_df["SOC_%"], drawstyle="steps-post", label="SOC（%）")
-        chg_idx = soc_df.index[soc_df["charging"]]
-        if len(chg_idx) > 0:
-            ax.scatter(chg_idx, soc_df.loc[chg_idx, "SOC_%"], s=20, label="充電スロット")
-        ax.axhline(soc_floor_pct, linestyle="--", label=f"下限 {soc_floor_pct:.1f}%")
-        ax.axhline(soc_init_pct, linestyle="--", label=f"初期 {soc_init_pct:.1f}%")
-        ax.set_xlabel("時刻"); ax.set_ylabel("SOC (%)"); ax.set_title("SOCの推移（充電コマ考慮）")
-        ax.grid(True)
-        handles, labels = ax.get_legend_handles_labels()
-        uniq = dict(zip(labels, handles))
-        ax.legend(uniq.values(), uniq.keys())
-        st.pyplot(fig8)
-        st.download_button("CSVをダウンロード（SOC/充電コマ）", data=soc_df.to_csv().encode("utf-8-sig"),
-                           file_name="soc_with_charge_and_period.csv", mime="text/csv", key="t7_dl")
+        def build():
+            fig8, ax = plt.subplots(figsize=(12,6))
+            ax.plot(soc_df.index, soc_df["SOC_%"], drawstyle="steps-post", label="SOC（%）")
+            chg_idx = soc_df.index[soc_df["charging"]]
+            if len(chg_idx) > 0:
+                ax.scatter(chg_idx, soc_df.loc[chg_idx, "SOC_%"], s=20, label="充電スロット")
+            ax.axhline(soc_floor_pct, linestyle="--", label=f"下限 {soc_floor_pct:.1f}%")
+            ax.axhline(soc_init_pct, linestyle="--", label=f"初期 {soc_init_pct:.1f}%")
+            ax.set_xlabel("時刻"); ax.set_ylabel("SOC (%)"); ax.set_title("SOCの推移（充電コマ考慮）")
+            ax.grid(True)
+            handles, labels = ax.get_legend_handles_labels()
+            uniq = dict(zip(labels, handles))
+            ax.legend(uniq.values(), uniq.keys())
+            return fig8
+
+        show_figure("t7", build, soc_df, soc_floor_pct, soc_init_pct)
+        export_download("SOC/充電コマ", soc_df, "soc_with_charge_and_period", key="t7_exp")
+
 # --- Tab8: Charging cost summary ---
-with tab8:
+@st.fragment
+@profile_view("t8")
+def render_charge_cost(df, has_price, min_t, max_t, P_pcs_common):
     st.subheader("充電コスト（集計）")
     st.caption("充電は買電扱い：各スロットの充電量[kWh] × JEPX価格[円/kWh] を加算して表示（期間指定、月別）")
     c1, c2 = st.columns(2)
@@ -330,41 +681,315 @@ with tab8:
     dfr8 = select_range(df, pd.Timestamp(start_cost), pd.Timestamp(end_cost) + pd.Timedelta(days=1))
     soc_df8 = pd.DataFrame()
 
-    policy8 = st.radio("充電スケジュール", ["0:00から連続充電（従来）", "当日最安コマ優先（同時供出）"], horizontal=True, key="t8_policy")
-    if policy8 == "当日最安コマ優先（同時供出）":
-        soc_df8 = simulate_soc_concurrent_price_optimized(
-            dfr8, P_pcs=P_pcs8, P_chg=P_chg8, E_nom=E_nom8,
-            start=pd.Timestamp(start_cost), end=pd.Timestamp(end_cost) + pd.Timedelta(days=1) - pd.Timedelta(minutes=30),
-            soc_init_pct=soc_init_pct8, soc_floor_pct=soc_floor_pct8, reset_every_days=reset_days8
-        )
-    else:
-        soc_df8 = simulate_soc_with_charge_periodic_reset(
-            dfr8, P_pcs=P_pcs8, P_chg=P_chg8, E_nom=E_nom8,
-            start=pd.Timestamp(start_cost), end=pd.Timestamp(end_cost) + pd.Timedelta(days=1) - pd.Timedelta(minutes=30),
-            soc_init_pct=soc_init_pct8, soc_floor_pct=soc_floor_pct8, reset_every_days=reset_days8
-        )
+    policy8 = SOC_POLICY_LABELS[st.radio("充電スケジュール", list(SOC_POLICY_LABELS), horizontal=True, key="t8_policy")]
+    extra8 = {}
+    if policy8 == POLICY_HORIZON:
+        horizon8 = st.number_input("計画区間（日、0なら充電間隔）", min_value=0, value=0, step=1, key="t8_horizon")
+        extra8["horizon_days"] = int(horizon8) or None
+    # 期間トリムはシミュレータ側で行うので、Tab7 と同じ df を渡して結果キャッシュを共有する
+    soc_df8 = simulate(
+        "t8_sim", SOC_SIMULATORS[policy8], df, P_pcs=P_pcs8, P_chg=P_chg8, E_nom=E_nom8,
+        start=pd.Timestamp(start_cost), end=day_end(end_cost, df),
+        soc_init_pct=soc_init_pct8, soc_floor_pct=soc_floor_pct8, reset_every_days=reset_days8, **extra8
+    )
     if soc_df8.empty:
         st.warning("SOCシミュレーション対象期間にデータがありません。")
     else:
         charge_kWh, price_series, cost, cum_cost = derive_charge_cost_series(soc_df8, dfr8)
-        figc, ax = plt.subplots(figsize=(12,6))
-        ax.plot(cum_cost.index, cum_cost.values, label="累計コスト", color="orange")
-        ax.set_xlabel("時刻"); ax.set_ylabel("累計コスト (円)"); ax.set_title("累計充電コスト（選択期間）")
-        ax.grid(True); ax.legend()
-        st.pyplot(figc)
+        def build():
+            figc, ax = plt.subplots(figsize=(12,6))
+            ax.plot(cum_cost.index, cum_cost.values, label="累計コスト", color="orange")
+            ax.set_xlabel("時刻"); ax.set_ylabel("累計コスト (円)"); ax.set_title("累計充電コスト（選択期間）")
+            ax.grid(True); ax.legend()
+            return figc
+
+        show_figure("t8_cum", build, cum_cost)
         monthly = cost.resample("MS").sum().rename("充電コスト(月計)")
         month_labels = monthly.index.strftime("%Y-%m")
-        figm, axm = plt.subplots(figsize=(10,5))
-        axm.bar(month_labels, monthly.values)
-        axm.set_ylabel("コスト (円)"); axm.set_title("月別 充電コスト")
-        axm.tick_params(axis="x", rotation=45); axm.grid(True, axis="y", alpha=0.3)
-        st.pyplot(figm)
-        st.download_button("月別コストCSV", data=monthly.to_csv().encode("utf-8-sig"),
-                           file_name="monthly_charge_cost.csv", mime="text/csv", key="t8_dl1")
+
+        def build_monthly():
+            figm, axm = plt.subplots(figsize=(10,5))
+            axm.bar(month_labels, monthly.values)
+            axm.set_ylabel("コスト (円)"); axm.set_title("月別 充電コスト")
+            axm.tick_params(axis="x", rotation=45); axm.grid(True, axis="y", alpha=0.3)
+            return figm
+
+        show_figure("t8_monthly", build_monthly, monthly)
+        export_download("月別コスト", monthly, "monthly_charge_cost", key="t8_exp1")
         per_slot = pd.DataFrame({"charge_kWh": charge_kWh, "price_yen_per_kWh": price_series, "cost_yen": cost, "cum_cost_yen": cum_cost})
-        st.download_button("スロット別コストCSV", data=per_slot.to_csv().encode("utf-8-sig"),
-                           file_name="slot_charge_cost.csv", mime="text/csv", key="t8_dl2")
+        export_download("スロット別コスト", per_slot, "slot_charge_cost", key="t8_exp2")
+
+    st.markdown("#### シナリオ分析（充電コストの分布・下限SOC到達の確率）")
+    st.caption("上の期間・電池条件・充電スケジュールで、価格や需要を入れ替えた複数のシナリオをまとめて計算します。")
+    kind8 = st.radio("シナリオ", ["過去の価格年", "乱数（需要・自家発の変動）"], horizontal=True, key="t8_scn_kind")
+    start8, end8 = pd.Timestamp(start_cost), day_end(end_cost, df)
+    if kind8 == "過去の価格年":
+        years8 = scenario_years(df)
+        c1, c2 = st.columns([3, 1])
+        with c1:
+            sel_years8 = st.multiselect("使う年（同じ月日・時刻の値を当てはめる）", years8, default=years8, key="t8_scn_years")
+        with c2:
+            vary_load8 = st.checkbox("需要(L-G)も入れ替える", value=False, key="t8_scn_load")
+        make8 = historical_scenarios
+        scn_args8 = dict(start=start8, end=end8, years=sel_years8, vary=("price", "load") if vary_load8 else ("price",))
+    else:
+        c1, c2, c3, c4, c5 = st.columns(5)
+        with c1:
+            n_scn8 = st.number_input("シナリオ数", min_value=2, max_value=1000, value=50, step=10, key="t8_scn_n")
+        with c2:
+            seed8 = st.number_input("乱数シード", min_value=0, value=0, step=1, key="t8_scn_seed")
+        with c3:
+            load_sd8 = st.number_input("需要の日変動（%）", min_value=0.0, value=5.0, step=1.0, key="t8_scn_load_sd")
+        with c4:
+            gen_sd8 = st.number_input("自家発の日変動（%）", min_value=0.0, value=20.0, step=1.0, key="t8_scn_gen_sd")
+        with c5:
+            price_sd8 = st.number_input("価格の変動（%）", min_value=0.0, value=0.0, step=1.0, key="t8_scn_price_sd")
+        make8 = stochastic_scenarios
+        scn_args8 = dict(n_scenarios=int(n_scn8), seed=int(seed8), start=start8, end=end8,
+                         load_daily_sigma=load_sd8 / 100.0, gen_sigma=gen_sd8 / 100.0, price_sigma=price_sd8 / 100.0)
+    soc_args8 = dict(P_pcs=P_pcs8, P_chg=P_chg8, E_nom=E_nom8, soc_init_pct=soc_init_pct8,
+                     soc_floor_pct=soc_floor_pct8, reset_every_days=reset_days8, **extra8)
+
+    def scenario_job8(progress):
+        return run_scenarios(make8(df, **scn_args8), policy8, progress=progress, **soc_args8)["metrics"]
+
+    sig8 = content_hash(dataset_key(df), kind8, scn_args8, policy8, soc_args8)
+    if st.button("シナリオ計算", key="t8_scn_btn"):
+        submit_job(job_slot("t8_scn"), sig8, scenario_job8, label="シナリオ")
+    try:
+        metrics8 = collect_job("t8_scn", "シナリオ", sig8)
+    except ValueError as e:
+        st.error(f"シナリオを作れません: {e}")
+        metrics8 = None
+    if metrics8 is not None:
+        st.session_state["t8_scn_result"] = metrics8
+    metrics8 = st.session_state.get("t8_scn_result")
+    if metrics8 is not None and not metrics8.empty:
+        summary8 = scenario_summary(metrics8)
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("シナリオ数", f"{summary8['scenarios']}")
+        c2.metric("コスト平均（円）", f"{summary8['cost_mean']:,.0f}")
+        c3.metric("コスト 5〜95%（円）", f"{summary8['cost_p5']:,.0f}〜{summary8['cost_p95']:,.0f}")
+        c4.metric("下限SOC到達の確率", f"{summary8['floor_hit_probability']:.0%}")
+
+        def build_scn():
+            figs, axs = plt.subplots(figsize=(10, 4))
+            axs.hist(metrics8["total_charge_cost"], bins=min(max(len(metrics8) // 3, 5), 50), color="orange")
+            for q in ("cost_p5", "cost_p50", "cost_p95"):
+                axs.axvline(summary8[q], color="gray", linestyle="--", linewidth=0.8)
+            axs.set_xlabel("充電コスト (円)"); axs.set_ylabel("シナリオ数"); axs.set_title("シナリオ別 充電コストの分布")
+            axs.grid(True, alpha=0.3)
+            return figs
+
+        show_figure("t8_scn", build_scn, metrics8)
+        st.dataframe(metrics8, use_container_width=True)
+        export_download("シナリオ別の結果", metrics8, "charge_cost_scenarios", key="t8_scn_exp", index=False)
+
+# --- Tab9: Battery sizing sweep ---
+@st.fragment
+@profile_view("t9")
+def render_sweep(df, has_price, min_t, max_t, P_pcs_common):
+    st.subheader("電池サイズ スイープ（SOC/充電コスト）")
+    st.caption("値はカンマ区切り、または 開始:終了:刻み（例 1000:4000:500）。全組合せ×充電スケジュールを並列実行します。")
+    c1, c2, c3, c4, c5 = st.columns(5)
+    with c1:
+        g_enom = st.text_input("電池容量（kWh）", value="1000:4000:500", key="t9_enom")
+    with c2:
+        g_pchg = st.text_input("充電出力（kW）", value="500,1000", key="t9_pchg")
+    with c3:
+        g_pcs = st.text_input("PCS定格（kW）", value=str(P_pcs_common), key="t9_pcs")
+    with c4:
+        g_reset = st.text_input("充電間隔（日）", value="1,2,4", key="t9_reset")
+    with c5:
+        g_floor = st.text_input("下限SOC（%）", value="10", key="t9_floor")
+    c6, c7, c8, c9 = st.columns(4)
+    with c6:
+        start9 = st.date_input("開始日", value=min_t.date(), key="t9_start")
+    with c7:
+        end9 = st.date_input("終了日", value=max_t.date(), key="t9_end")
+    with c8:
+        soc_init9 = st.number_input("初期SOC（%）", min_value=1.0, max_value=100.0, value=90.0, step=1.0, key="t9_soc_init")
+    with c9:
+        workers9 = st.number_input("並列数", min_value=1, value=os.cpu_count() or 1, step=1, key="t9_workers")
+    policy_labels9 = SOC_POLICY_LABELS
+    policies9 = st.multiselect("充電スケジュール", list(policy_labels9), default=list(policy_labels9), key="t9_policies")
+    # 実行中に条件を変えるとそのスイープは取り消す
+    sig9 = content_hash(dataset_key(df), g_enom, g_pchg, g_pcs, g_reset, g_floor, start9, end9, soc_init9, workers9, policies9)
+    if st.button("スイープ実行", type="primary", key="t9_btn"):
+        try:
+            grid9 = build_grid(
+                E_nom=parse_grid_values(g_enom), P_chg=parse_grid_values(g_pchg), P_pcs=parse_grid_values(g_pcs),
+                reset_every_days=parse_grid_values(g_reset, int), soc_floor_pct=parse_grid_values(g_floor),
+            )
+        except ValueError as e:
+            st.error(f"パラメータの指定が不正です: {e}")
+            grid9 = []
+        if grid9 and policies9:
+            def sweep_job9(progress):
+                inputs9 = prepare_soc_inputs(df, pd.Timestamp(start9), day_end(end9, df))
+                return run_battery_sweep(inputs9, grid9, policies=[policy_labels9[p] for p in policies9],
+                                         soc_init_pct=soc_init9, max_workers=int(workers9), progress=progress)
+
+            submit_job(job_slot("t9_sweep"), sig9, sweep_job9, label=f"{len(grid9) * len(policies9)} 通りのスイープ")
+    done9 = collect_job("t9_sweep", "スイープ", sig9)
+    if done9 is not None:
+        st.session_state["t9_result"] = done9
+    result9 = st.session_state.get("t9_result")
+    if result9 is not None and not result9.empty:
+        policy_names9 = {v: k for k, v in policy_labels9.items()}
+        c1, c2, c3, c4 = st.columns(4)
+        with c1:
+            metric9 = st.selectbox("指標", SWEEP_METRICS, index=0, key="t9_metric")
+        with c2:
+            x9 = st.selectbox("横軸", SWEEP_PARAMS, index=0, key="t9_x")
+        with c3:
+            y9 = st.selectbox("縦軸", [p for p in SWEEP_PARAMS if p != x9], index=0, key="t9_y")
+        with c4:
+            pol9 = st.selectbox("スケジュール", sorted(result9["policy"].unique()), format_func=lambda p: policy_names9.get(p, p), key="t9_pol")
+        fixed9 = {"policy": pol9}
+        others9 = [p for p in SWEEP_PARAMS if p not in (x9, y9) and result9[p].nunique() > 1]
+        if others9:
+            cols9 = st.columns(len(others9))
+            for col, p in zip(cols9, others9):
+                with col:
+                    fixed9[p] = st.selectbox(f"{p}（固定）", sorted(result9[p].unique()), key=f"t9_fix_{p}")
+        piv9 = sweep_pivot(result9, x9, y9, metric9, fixed9)
+        def build():
+            fig9, ax = plt.subplots(figsize=(12, 6))
+            im = ax.imshow(piv9.values, aspect="auto", cmap="viridis")
+            ax.set_xticks(range(len(piv9.columns))); ax.set_xticklabels([f"{v:g}" for v in piv9.columns])
+            ax.set_yticks(range(len(piv9.index))); ax.set_yticklabels([f"{v:g}" for v in piv9.index])
+            for (i, j), v in np.ndenumerate(piv9.values):
+                if np.isfinite(v):
+                    ax.text(j, i, f"{v:,.0f}" if abs(v) >= 100 else f"{v:.1f}", ha="center", va="center", color="white", fontsize=8)
+            ax.set_xlabel(x9); ax.set_ylabel(y9); ax.set_title(f"{metric9}（{policy_names9.get(pol9, pol9)}）")
+            fig9.colorbar(im, ax=ax)
+            return fig9
+
+        show_figure("t9", build, piv9, x9, y9, metric9, pol9)
+        st.dataframe(result9, use_container_width=True)
+        export_download("スイープ結果", result9, "battery_sweep", key="t9_exp", index=False)
+
+# --- Tab10: Portfolio (multi-site) ---
+@st.fragment
+@profile_view("t10")
+def render_portfolio(df, has_price, min_t, max_t, P_pcs_common):
+    st.subheader("ポートフォリオ（複数サイト）")
+    st.caption("サイトごとに供出可能量①・SOC・充電コストを並列計算し、フリート全体で集計します。サイト名はファイル名です。")
+    files10 = st.file_uploader("サイトのExcel（複数可）", type=["xlsx"], accept_multiple_files=True, key="t10_files")
+    include_current10 = st.checkbox("現在読み込んでいるデータも含める", value=True, key="t10_current")
+    c1, c2, c3, c4 = st.columns(4)
+    with c1:
+        P_pcs10 = st.number_input("PCS定格（kW）", min_value=1, value=int(P_pcs_common), step=10, key="t10_pcs")
+    with c2:
+        E_nom10 = st.number_input("電池容量（kWh）", min_value=100, value=2000, step=100, key="t10_enom")
+    with c3:
+        P_chg10 = st.number_input("充電出力（kW）", min_value=1, value=1000, step=10, key="t10_pchg")
+    with c4:
+        workers10 = st.number_input("並列数", min_value=1, value=os.cpu_count() or 1, step=1, key="t10_workers")
+    c5, c6, c7, c8 = st.columns(4)
+    with c5:
+        soc_init10 = st.number_input("初期SOC（%）", min_value=1.0, max_value=100.0, value=90.0, step=1.0, key="t10_soc_init")
+    with c6:
+        soc_floor10 = st.number_input("下限SOC（%）", min_value=0.0, max_value=90.0, value=10.0, step=1.0, key="t10_soc_floor")
+    with c7:
+        reset10 = st.number_input("充電間隔（日）", min_value=1, value=4, step=1, key="t10_reset_days")
+    with c8:
+        P_exp10 = st.text_input("供出上限（kW、空欄で上限なし）", value="", key="t10_pexp")
+    run_labels10 = {"供出可能量①": RUN_EXPORT_OFFER, "SOC: 0:00から連続充電": RUN_SOC_PERIODIC,
+                    "SOC: 当日最安コマ優先": RUN_SOC_PRICE_OPT, "SOC: 計画区間内の最安コマ優先": RUN_SOC_HORIZON}
+    runs10 = st.multiselect("計算する項目", list(run_labels10), default=list(run_labels10), key="t10_runs")
+
+    if st.button("ポートフォリオ実行", type="primary", key="t10_btn"):
+        sites10 = {}
+        if include_current10:
+            sites10["現在のデータ"] = df
+        for f in files10 or []:
+            try:
+                sites10[os.path.splitext(f.name)[0]] = settlement_frame(
+                    load_excel_cached(f, slot=SLOT_LABELS[st.session_state.get("sb_slot", "自動")]))
+            except Exception as e:
+                st.error(f"{f.name} の読み込みエラー: {e}")
+        try:
+            P_exp_max10 = float(P_exp10) if P_exp10.strip() else None
+        except ValueError:
+            P_exp_max10 = None
+        if sites10 and runs10:
+            params10 = dict(P_pcs=P_pcs10, P_exp_max=P_exp_max10, E_nom=E_nom10, P_chg=P_chg10,
+                            soc_init_pct=soc_init10, soc_floor_pct=soc_floor10, reset_every_days=int(reset10))
+            with st.spinner(f"{len(sites10)} サイトを計算中..."):
+                st.session_state["t10_result"] = run_portfolio(
+                    sites10, params10, runs=[run_labels10[r] for r in runs10], max_workers=int(workers10)
+                )
+    result10 = st.session_state.get("t10_result")
+    if result10 is None:
+        return
+    summary10, fleet10 = result10["summary"], result10["fleet"]
+    if "error" in summary10.columns:
+        for _, r in summary10[summary10["error"].notna()].iterrows():
+            st.error(f"{r['site']}: {r['error']}")
+    run_names10 = {v: k for k, v in run_labels10.items()}
+    st.markdown("**フリート合計**")
+    for _, r in fleet10.iterrows():
+        cols = st.columns(4)
+        cols[0].metric("項目", run_names10.get(r["run"], r["run"]), f"{r['sites']} サイト", delta_color="off")
+        if r["run"] == RUN_EXPORT_OFFER:
+            cols[1].metric("供出可能量 合計（kWh）", f"{r['offer_kWh']:,.0f}")
+            cols[2].metric("合計の最小値（kW）", f"{r['fleet_offer_min_kW']:,.1f}")
+            cols[3].metric("最小の時刻", str(r["fleet_offer_min_at"]))
+        else:
+            cols[1].metric("充電コスト合計（円）", f"{r['total_charge_cost']:,.0f}")
+            cols[2].metric("充電量合計（kWh）", f"{r['charge_kWh']:,.0f}")
+            cols[3].metric("最小SOC（%）", f"{r['worst_min_soc_pct']:.1f}", str(r["worst_site"]), delta_color="off")
+
+    offer10 = result10["offer"]
+    if not offer10.empty:
+        offer_ds10 = downsample_for_plot(offer10, PLOT_WIDTH_PX)
+
+        def build_offer():
+            fig, ax = plt.subplots(figsize=(PLOT_WIDTH_IN, 5))
+            for col, ser in offer_ds10.items():
+                ax.plot(ser.index, ser.values, label=col, linewidth=2.0 if col == "合計" else 0.8)
+            ax.set_xlabel("時刻"); ax.set_ylabel("供出可能量 (kW)"); ax.set_title("供出可能量①（サイト別・合計）")
+            ax.grid(True); ax.legend()
+            return fig
+
+        show_figure("t10_offer", build_offer, offer_ds10)
+    soc10 = result10["soc"]
+    if soc10:
+        run10 = st.selectbox("SOCを表示する項目", list(soc10), format_func=lambda r: run_names10.get(r, r), key="t10_soc_run")
+        soc_ds10 = downsample_for_plot(soc10[run10], PLOT_WIDTH_PX)
+
+        def build_soc():
+            fig, ax = plt.subplots(figsize=(PLOT_WIDTH_IN, 5))
+            for col, ser in soc_ds10.items():
+                ax.plot(ser.index, ser.values, label=col, linewidth=2.0 if col == "最小" else 0.8)
+            ax.set_xlabel("時刻"); ax.set_ylabel("SOC (%)"); ax.set_title(f"SOC（サイト別・最小） {run_names10.get(run10, run10)}")
+            ax.grid(True); ax.legend()
+            return fig
+
+        show_figure("t10_soc", build_soc, soc_ds10, run10)
+    st.dataframe(summary10, use_container_width=True)
+    export_download("サイト別集計", summary10, "portfolio_summary", key="t10_exp", index=False)
+
+
+VIEWS = dict(zip(VIEW_LABELS, [
+    render_basic_plot, render_aggregate, render_overlay, render_single, render_export_offer,
+    render_price_year, render_soc, render_charge_cost, render_sweep, render_portfolio,
+]))
+VIEWS[view](df, has_price, min_t, max_t, P_pcs_common)
 
-# --- Tab9: placeholder ---
-with tab9:
-    st.write("予備タブ")
+# --- 計測結果 ---
+record = end_run()
+if record is not None:
+    _keep_profile_record(record)
+if st.session_state.get("profile_runs"):
+    with st.expander("処理時間の内訳（計測）", expanded=False):
+        runs = st.session_state["profile_runs"]
+        last = runs[-1]
+        st.caption(f"直近の実行: {last['kind']}（{last['tab'] or '-'}）{last['total_s']:.3f} 秒"
+                   + (f" / 最大RSS {last['max_rss_mb']} MB" if last.get("max_rss_mb") else ""))
+        st.dataframe(stages_frame(last), hide_index=True, use_container_width=True)
+        st.caption("実行履歴（フラグメントだけの再実行は次の画面全体の実行時に反映されます）")
+        st.dataframe(pd.DataFrame([{k: r[k] for k in ("started", "kind", "tab", "total_s", "max_rss_mb")} for r in runs[::-1]]),
+                     hide_index=True, use_container_width=True)
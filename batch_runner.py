@@ -0,0 +1,210 @@
+
+"""
+ヘッドレスのバッチ実行（Streamlit / matplotlib は読み込まない）。
+
+    python batch_runner.py config.json [-o 出力フォルダ] [--formats parquet,csv]
+
+設定ファイル（JSON、PyYAML があれば YAML も可）の例:
+
+    {
+      "output_dir": "batch_out",
+      "formats": ["parquet"],
+      "runs": ["export_offer", "soc_periodic", "soc_price_opt", "soc_horizon"],
+      "defaults": {"P_pcs": 1000, "E_nom": 2000, "P_chg": 1000},
+      "sites": [
+        {"name": "tosu", "workbook": "data/tosu.xlsx", "sheet": null, "start": "2024-04-01", "end": "2025-03-31"},
+        {"name": "store", "store": "data_store"},
+        {"name": "meter_1min", "workbook": "data/meter.xlsx", "resample_minutes": 30}
+      ]
+    }
+
+出力: <output_dir>/<site>/<run>.<形式>（スロット別の時系列）と
+      <output_dir>/summary.json / summary.csv（サイト×実行ごとの集計）
+コマの長さ（1分・5分・15分・30分）はデータの開始日時から推定する。
+resample_minutes を指定すると、そのコマ（30なら精算コマ）に集計してから計算する。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils_timeseries import (
+    select_range, slot_of, slot_hours, compute_export_offer_def1, derive_charge_cost_series,
+    simulate_soc_with_charge_periodic_reset, simulate_soc_concurrent_price_optimized, simulate_soc_horizon_scheduled
+)
+from utils_cache import load_excel_cached, resample_cached, CACHE_DIR
+
+RUN_EXPORT_OFFER = "export_offer"
+RUN_SOC_PERIODIC = "soc_periodic"
+RUN_SOC_PRICE_OPT = "soc_price_opt"
+RUN_SOC_HORIZON = "soc_horizon"
+RUNS = (RUN_EXPORT_OFFER, RUN_SOC_PERIODIC, RUN_SOC_PRICE_OPT, RUN_SOC_HORIZON)
+OUTPUT_FORMATS = ("parquet", "csv")
+
+# サイト設定で上書きできるパラメータ（既定値は画面の初期値と同じ）
+SITE_DEFAULTS = {
+    "P_pcs": 1000.0, "P_exp_max": None, "P_chg": 1000.0, "E_nom": 2000.0,
+    "soc_init_pct": 90.0, "soc_floor_pct": 10.0, "reset_every_days": 4, "horizon_days": None,
+    "load_col": None, "gen_col": None, "start": None, "end": None,
+}
+_SOC_FUNCS = {
+    RUN_SOC_PERIODIC: simulate_soc_with_charge_periodic_reset,
+    RUN_SOC_PRICE_OPT: simulate_soc_concurrent_price_optimized,
+    RUN_SOC_HORIZON: simulate_soc_horizon_scheduled,
+}
+
+
+def load_config(path):
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if path.lower().endswith((".yml", ".yaml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("YAMLの設定ファイルには PyYAML が必要です（pip install pyyaml）。JSONなら不要です。")
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+
+def load_site_frame(site, cache_dir=CACHE_DIR):
+    """サイト設定の workbook（+sheet）または store からデータを読む（resample_minutes があれば集計する）"""
+    if site.get("store"):
+        from utils_store import open_store_cached
+        df = open_store_cached(site["store"])
+    elif site.get("workbook"):
+        df = load_excel_cached(site["workbook"], site.get("sheet"), cache_dir=cache_dir)
+    else:
+        raise ValueError(f"サイト {site.get('name')} に workbook または store を指定してください。")
+    if site.get("resample_minutes"):
+        df = resample_cached(df, pd.Timedelta(minutes=float(site["resample_minutes"])))
+    return df
+
+
+def _period_end(end, slot=pd.Timedelta(minutes=30)):
+    # 終了日だけ指定されたら、その日の最終スロットまでを含める（画面と同じ扱い）
+    if end is None:
+        return None
+    end = pd.Timestamp(end)
+    return end + pd.Timedelta(days=1) - slot if end == end.normalize() else end
+
+
+def run_site(df, params, runs=RUNS):
+    """
+    1サイト分の実行。params は SITE_DEFAULTS のキーで指定する。
+    戻り値: ({実行名: スロット別DataFrame}, [集計行 dict])
+    """
+    p = {**SITE_DEFAULTS, **{k: v for k, v in params.items() if k in SITE_DEFAULTS}}
+    start, end = p["start"], _period_end(p["end"], slot_of(df))
+    dfr = select_range(df, start, end)
+    frames, rows = {}, []
+    for run in runs:
+        t0 = time.perf_counter()
+        if run == RUN_EXPORT_OFFER:
+            offer, L, G = compute_export_offer_def1(dfr, P_pcs=p["P_pcs"], P_exp_max=p["P_exp_max"],
+                                                    load_col=p["load_col"], gen_col=p["gen_col"])
+            out = pd.DataFrame({"offer_kW": offer, "load_kW": L, "gen_kW": G})
+            row = {
+                "offer_min_kW": float(offer.min()) if len(offer) else np.nan,
+                "offer_min_at": str(offer.idxmin()) if offer.notna().any() else None,
+                "offer_mean_kW": float(offer.mean()) if len(offer) else np.nan,
+                "offer_kWh": float((offer * slot_hours(df)).sum()),
+            }
+        elif run in _SOC_FUNCS:
+            extra = {"horizon_days": p["horizon_days"]} if run == RUN_SOC_HORIZON else {}
+            soc = _SOC_FUNCS[run](
+                df, P_pcs=p["P_pcs"], P_chg=p["P_chg"], E_nom=p["E_nom"], start=start, end=end,
+                soc_init_pct=p["soc_init_pct"], soc_floor_pct=p["soc_floor_pct"],
+                reset_every_days=int(p["reset_every_days"]), load_col=p["load_col"], gen_col=p["gen_col"], **extra
+            )
+            if soc.empty:
+                out = soc
+                row = {"total_charge_cost": 0.0, "charge_kWh": 0.0, "min_soc_pct": np.nan, "charge_slots": 0}
+            else:
+                charge_kWh, price, cost, cum_cost = derive_charge_cost_series(soc, dfr)
+                out = soc[["SOC_kWh", "SOC_%", "charging"]].assign(
+                    charge_kWh=charge_kWh, price_yen_per_kWh=price, cost_yen=cost, cum_cost_yen=cum_cost
+                )
+                row = {
+                    "total_charge_cost": float(cost.sum()),
+                    "charge_kWh": float(charge_kWh.sum()),
+                    "min_soc_pct": float(soc["SOC_%"].min()),
+                    "charge_slots": int(soc["charging"].sum()),
+                }
+        else:
+            raise ValueError(f"未対応の実行です: {run}（{', '.join(RUNS)}）")
+        frames[run] = out
+        rows.append({"run": run, "rows": len(out), **row, "seconds": round(time.perf_counter() - t0, 4)})
+    return frames, rows
+
+
+def write_frames(out_dir, frames, formats=("parquet",)):
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for run, frame in frames.items():
+        for fmt in formats:
+            path = os.path.join(out_dir, f"{run}.{fmt}")
+            if fmt == "parquet":
+                frame.to_parquet(path)
+            elif fmt == "csv":
+                frame.to_csv(path, encoding="utf-8-sig")
+            else:
+                raise ValueError(f"未対応の出力形式です: {fmt}（{', '.join(OUTPUT_FORMATS)}）")
+            paths.append(path)
+    return paths
+
+
+def run_batch(config, output_dir=None, formats=None, log=print):
+    """
+    設定（dict）の全サイトを実行して出力を書き出す。
+    1サイトの失敗で全体は止めず、集計の error 列に記録する。戻り値: 集計 DataFrame
+    """
+    output_dir = output_dir or config.get("output_dir", "batch_out")
+    formats = list(formats or config.get("formats", ["parquet"]))
+    runs = list(config.get("runs", RUNS))
+    defaults = config.get("defaults", {})
+    rows = []
+    for i, site in enumerate(config.get("sites", [])):
+        name = str(site.get("name") or f"site{i + 1}")
+        try:
+            df = load_site_frame(site, cache_dir=config.get("cache_dir", CACHE_DIR))
+            frames, site_rows = run_site(df, {**defaults, **site}, runs)
+            write_frames(os.path.join(output_dir, name), frames, formats)
+            rows.extend({"site": name, **r} for r in site_rows)
+            if log:
+                log(f"[{name}] {len(df)} 行, {', '.join(runs)} 完了")
+        except Exception as e:
+            rows.append({"site": name, "error": f"{type(e).__name__}: {e}"})
+            if log:
+                log(f"[{name}] 失敗: {e}")
+    summary = pd.DataFrame(rows)
+    for c in ("rows", "charge_slots"):
+        # 失敗行があっても件数は整数のまま出す
+        if c in summary.columns:
+            summary[c] = summary[c].astype("Int64")
+    os.makedirs(output_dir, exist_ok=True)
+    summary.to_csv(os.path.join(output_dir, "summary.csv"), index=False, encoding="utf-8-sig")
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary.astype(object).where(summary.notna(), None).to_dict(orient="records"),
+                  f, ensure_ascii=False, indent=1)
+    return summary
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="供出可能量・SOC・充電コストのバッチ実行")
+    ap.add_argument("config", help="設定ファイル（.json / .yaml）")
+    ap.add_argument("-o", "--output-dir", default=None, help="出力フォルダ（設定の output_dir を上書き）")
+    ap.add_argument("--formats", default=None, help="時系列の出力形式（カンマ区切り: parquet,csv）")
+    args = ap.parse_args(argv)
+    config = load_config(args.config)
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()] if args.formats else None
+    summary = run_batch(config, output_dir=args.output_dir, formats=formats)
+    failed = int(summary["error"].notna().sum()) if "error" in summary.columns else 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
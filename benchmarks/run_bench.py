@@ -0,0 +1,187 @@
+
+"""
+主要関数のベンチマーク（合成データ、データ量別）。
+
+    python -m benchmarks.run_bench                       # 1年・3年
+    python -m benchmarks.run_bench --years 1,5,10 --excel-years 1
+    python -m benchmarks.run_bench --save benchmarks/baseline.json
+    python -m benchmarks.run_bench --compare benchmarks/baseline.json --tolerance 1.3
+    python -m benchmarks.run_bench --years 1 --excel-years "" --slot-minutes 1   # 1分値（30分への集計も測る）
+
+時間は repeat 回の中央値（準備処理は含めない）。ピークメモリは tracemalloc で別に1回測る。
+--compare では中央値が tolerance 倍を超えた項目を表示し、終了コード1を返す。
+ベースラインはマシンに依存するので、比較は同じマシンで保存したものと行うこと。
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import make_frame, write_workbook
+import utils_kernels
+from utils_timeseries import (
+    SLOT, load_excel_to_df, select_range, resample_to_slot, overlay_by_dates, overlay_price_full_year,
+    compute_export_offer_def1, derive_charge_cost_series,
+    simulate_soc_with_charge_periodic_reset, simulate_soc_concurrent_price_optimized, simulate_soc_horizon_scheduled,
+)
+
+SOC_PARAMS = dict(P_pcs=1000.0, P_chg=1000.0, E_nom=2000.0, soc_init_pct=90.0, soc_floor_pct=10.0, reset_every_days=4)
+
+
+def _fresh(df):
+    # 日×スロット行列などdfごとのメモを効かせない（初回表示のコストを測る）
+    return df.copy()
+
+
+def _extend_week(df, fn):
+    # 最後の1週間を除いた期間を計算しておき、期間を1週間延ばしたときの再計算を測る
+    end = df.index[-1] - pd.Timedelta(days=7)
+    fn(df, end=end, **SOC_PARAMS)
+    return (df,)
+
+
+def bench_cases(df, years, workbook=None, slot_minutes=30):
+    """(名前, 準備関数, 計測関数) のリスト。準備関数の戻り値が計測関数の引数になる。"""
+    rng = np.random.default_rng(0)
+    days = pd.DatetimeIndex(pd.unique(df.index.normalize()))
+    starts = days[rng.integers(0, max(len(days) - 31, 1), 100)]
+    pick = days[rng.integers(0, len(days), 30)]
+    soc = simulate_soc_concurrent_price_optimized(df, resume=False, **SOC_PARAMS)
+    cases = []
+    if workbook:
+        cases.append(("load_excel_to_df", lambda: (workbook,), lambda p: load_excel_to_df(p)))
+    cases += [
+        ("select_range x100", lambda: (df,),
+         lambda d: [select_range(d, s, s + pd.Timedelta(days=30)) for s in starts]),
+        ("overlay_by_dates(30日)", lambda: (_fresh(df),), lambda d: overlay_by_dates(d, pick)),
+        ("overlay_price_full_year", lambda: (_fresh(df),), overlay_price_full_year),
+        ("compute_export_offer_def1", lambda: (df,), lambda d: compute_export_offer_def1(d, P_pcs=1000.0)),
+        ("soc_periodic_reset", lambda: (_fresh(df),),
+         lambda d: simulate_soc_with_charge_periodic_reset(d, resume=False, **SOC_PARAMS)),
+        ("soc_price_optimized", lambda: (_fresh(df),),
+         lambda d: simulate_soc_concurrent_price_optimized(d, resume=False, **SOC_PARAMS)),
+        ("soc_horizon", lambda: (_fresh(df),), lambda d: simulate_soc_horizon_scheduled(d, resume=False, **SOC_PARAMS)),
+        ("soc_price_optimized(+7日)", lambda: _extend_week(_fresh(df), simulate_soc_concurrent_price_optimized),
+         lambda d: simulate_soc_concurrent_price_optimized(d, **SOC_PARAMS)),
+        ("soc_horizon(+7日)", lambda: _extend_week(_fresh(df), simulate_soc_horizon_scheduled),
+         lambda d: simulate_soc_horizon_scheduled(d, **SOC_PARAMS)),
+        ("derive_charge_cost_series", lambda: (soc, df), derive_charge_cost_series),
+    ]
+    if pd.Timedelta(minutes=slot_minutes) < SLOT:
+        cases.append(("resample_to_slot(30分)", lambda: (df,), lambda d: resample_to_slot(d, SLOT)))
+    # 30分以外のコマは別の項目として記録する（同じベースラインで比べられるように）
+    tag = f"@{years}y" if slot_minutes == 30 else f"@{years}y/{slot_minutes:g}min"
+    return [(f"{name}{tag}", setup, fn) for name, setup, fn in cases]
+
+
+def _time(setup, fn, repeat):
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        gc.collect()
+        t0 = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def _peak_mb(setup, fn):
+    args = setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def run(years_list=(1, 3), excel_years=(1,), repeat=5, memory=True, log=print, slot_minutes=30):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for years in years_list:
+            df = make_frame(years=years, gap_rate=0.001, gap_blocks=2, seed=years, slot_minutes=slot_minutes)
+            workbook = None
+            if years in excel_years:
+                workbook = write_workbook(os.path.join(tmp, f"synthetic_{years}y.xlsx"), years=years,
+                                          gap_rate=0.001, gap_blocks=2, seed=years, slot_minutes=slot_minutes)
+            for name, setup, fn in bench_cases(df, years, workbook, slot_minutes):
+                fn(*setup())  # JIT・import などの初回コストを除く
+                n = 1 if name.startswith("load_excel_to_df") else repeat
+                times = _time(setup, fn, n)
+                row = {"median_s": statistics.median(times), "min_s": min(times), "repeat": n, "rows": len(df)}
+                if memory:
+                    row["peak_mb"] = _peak_mb(setup, fn)
+                results[name] = row
+                if log:
+                    mem = f"{row['peak_mb']:8.1f} MB" if memory else ""
+                    log(f"{name:40s} {row['median_s'] * 1000:10.2f} ms {mem}")
+    return results
+
+
+def environment():
+    return {
+        "python": platform.python_version(), "platform": platform.platform(),
+        "numpy": np.__version__, "pandas": pd.__version__, "numba": utils_kernels.HAS_NUMBA,
+        "cpu_count": os.cpu_count(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results, baseline, tolerance=1.3):
+    """ベースラインと比較した表（ratio = 今回 / ベースライン の中央値）"""
+    rows = []
+    for name, row in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = row["median_s"] / base["median_s"] if base["median_s"] > 0 else np.nan
+        rows.append({"case": name, "baseline_ms": base["median_s"] * 1000, "now_ms": row["median_s"] * 1000,
+                     "ratio": ratio, "regressed": bool(ratio > tolerance)})
+    return pd.DataFrame(rows, columns=["case", "baseline_ms", "now_ms", "ratio", "regressed"])
+
+
+def _int_list(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="合成データによるベンチマーク")
+    ap.add_argument("--years", default="1,3", help="データ量（年、カンマ区切り）")
+    ap.add_argument("--excel-years", default="1", help="Excel読み込みも測るデータ量（書き出しに時間がかかる）")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--slot-minutes", type=float, default=30, help="合成データのコマの長さ（分、1/5/15/30）")
+    ap.add_argument("--no-memory", action="store_true", help="ピークメモリを測らない")
+    ap.add_argument("--save", default=None, help="結果をJSONに保存（ベースライン）")
+    ap.add_argument("--compare", default=None, help="比較するベースラインJSON")
+    ap.add_argument("--tolerance", type=float, default=1.3, help="この倍率を超えたら劣化とみなす")
+    args = ap.parse_args(argv)
+
+    results = run(_int_list(args.years), _int_list(args.excel_years), args.repeat, not args.no_memory,
+                  slot_minutes=args.slot_minutes)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(), "results": results}, f, ensure_ascii=False, indent=1)
+        print(f"保存しました: {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        table = compare(results, baseline["results"], args.tolerance)
+        with pd.option_context("display.width", 200, "display.float_format", "{:.2f}".format):
+            print(table.to_string(index=False))
+        if table["regressed"].any():
+            print(f"劣化: {', '.join(table.loc[table['regressed'], 'case'])}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
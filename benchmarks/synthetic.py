@@ -0,0 +1,100 @@
+
+"""
+ベンチマーク用の合成データ（既定は30分値。slot_minutes で 1/5/15分値も作れる）。列構成は load_excel_to_df が読むExcelと同じ。
+
+    from benchmarks.synthetic import make_raw, make_frame, write_workbook
+    df = make_frame(years=3, gap_rate=0.002, gap_blocks=2)
+    write_workbook("synthetic_1y.xlsx", years=1)
+"""
+import numpy as np
+import pandas as pd
+
+from utils_timeseries import _finalize_frame
+
+SLOTS_PER_DAY = 48
+
+
+def _load_shape(idx, rng, base_kw, peak_kw):
+    # 平日の朝夕ピーク・週末の低下・夏冬の空調需要
+    hour = idx.hour + idx.minute / 60.0
+    doy = idx.dayofyear.to_numpy()
+    daily = (0.55 + 0.35 * np.exp(-((hour - 10.0) / 3.0) ** 2) + 0.45 * np.exp(-((hour - 18.5) / 2.5) ** 2))
+    weekend = np.where(idx.dayofweek >= 5, 0.75, 1.0)
+    season = 1.0 + 0.20 * np.cos(2 * np.pi * (doy - 15) / 365.25) ** 2
+    noise = rng.normal(1.0, 0.05, len(idx))
+    return base_kw + (peak_kw - base_kw) * np.asarray(daily) * weekend * season * noise / 1.6
+
+
+def _pv_shape(idx, rng, pv_kw, per_day=SLOTS_PER_DAY):
+    # 季節で日の長さが変わるベル形 × 日ごとの雲量
+    hour = idx.hour + idx.minute / 60.0
+    doy = idx.dayofyear.to_numpy()
+    half_day = 6.0 + 1.5 * np.sin(2 * np.pi * (doy - 80) / 365.25)
+    x = (np.asarray(hour) - 12.0) / half_day
+    bell = np.clip(np.cos(np.clip(x, -1, 1) * np.pi / 2), 0, None) * (np.abs(x) < 1)
+    n_days = len(idx) // per_day + 1
+    cloud = np.repeat(rng.beta(4, 2, n_days), per_day)[: len(idx)]
+    return pv_kw * bell * cloud
+
+
+def _price_shape(idx, rng, price_base, pv):
+    # 夕方ピーク・昼の太陽光による下落・冬夏の上昇・ときどきスパイク
+    hour = idx.hour + idx.minute / 60.0
+    doy = idx.dayofyear.to_numpy()
+    daily = 1.0 + 0.35 * np.exp(-((np.asarray(hour) - 18.0) / 2.0) ** 2) - 0.25 * pv / max(pv.max(), 1.0)
+    season = 1.0 + 0.25 * np.cos(2 * np.pi * (doy - 20) / 365.25) ** 2
+    spikes = rng.gamma(1.5, 1.0, len(idx)) * (rng.random(len(idx)) < 0.01) * price_base
+    return np.round(np.clip(price_base * daily * season + rng.normal(0, 0.8, len(idx)) + spikes, 0.01, None), 2)
+
+
+def make_raw(years=1, start="2024-01-01", seed=0, gap_rate=0.0, gap_blocks=0, dup_rate=0.0,
+             base_kw=300.0, peak_kw=900.0, pv_kw=400.0, price_base=11.0, extra_columns=0, slot_minutes=30):
+    """
+    Excelのシートと同じ形の DataFrame（開始日時/終了日時が列）。slot_minutes: コマの長さ（分）。
+    gap_rate: ランダムに抜くスロットの割合、gap_blocks: 1〜3日の連続欠損の数、
+    dup_rate: 重複させる行の割合、extra_columns: 読まれない余分な列の数（列射影の効果測定用）
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(start)
+    end = start + pd.DateOffset(years=years)
+    slot = pd.Timedelta(minutes=slot_minutes)
+    per_day = int(pd.Timedelta(days=1) // slot)
+    idx = pd.date_range(start, end, freq=slot, inclusive="left")
+    load = _load_shape(idx, rng, base_kw, peak_kw)
+    pv = _pv_shape(idx, rng, pv_kw, per_day)
+    kwh = np.round(np.clip(load - 0.5 * pv, 0, None) * (slot_minutes / 60.0), 3)
+    raw = pd.DataFrame({
+        "開始日時": idx,
+        "終了日時": idx + slot,
+        "使用電力量(ロス後)": kwh,
+        "使用電力量(ロス前)": np.round(kwh * 1.02, 3),
+        "JEPXスポットプライス": _price_shape(idx, rng, price_base, pv),
+        "需要計画量": np.round(load * rng.normal(1.0, 0.03, len(idx)), 1),
+        "PV出力": np.round(pv, 1),
+    })
+    for k in range(extra_columns):
+        raw[f"予備{k + 1}"] = np.round(rng.normal(0, 1, len(idx)), 3)
+
+    keep = np.ones(len(raw), dtype=bool)
+    if gap_rate:
+        keep &= rng.random(len(raw)) >= gap_rate
+    for _ in range(int(gap_blocks)):
+        a = int(rng.integers(0, max(len(raw) - 1, 1)))
+        keep[a: a + int(rng.integers(1, 4)) * per_day] = False
+    raw = raw[keep]
+    if dup_rate:
+        dups = raw.sample(frac=dup_rate, random_state=seed)
+        raw = pd.concat([raw, dups]).sort_values("開始日時", kind="stable")
+    return raw.reset_index(drop=True)
+
+
+def make_frame(**kw):
+    """load_excel_to_df と同じ後処理をした DataFrame（Excelを経由しない）"""
+    raw = make_raw(**kw)
+    cols = [c for c in raw.columns if not c.startswith("予備")]
+    return _finalize_frame(raw[cols].copy())
+
+
+def write_workbook(path, sheet_name="Sheet1", **kw):
+    make_raw(**kw).to_excel(path, sheet_name=sheet_name, index=False)
+    return path
@@ -0,0 +1,46 @@
+"""バックグラウンドジョブの取り消しと再利用"""
+import threading
+import time
+
+import pytest
+
+from utils_jobs import JobCancelled, submit_job, current_job, cancel_slot, release_job
+
+
+def _slow(n, progress, started=None):
+    for i in range(n):
+        if started is not None:
+            started.set()
+        progress((i + 1) / n)
+        time.sleep(0.01)
+    return n
+
+
+def test_cancel_stops_at_next_progress_report():
+    started = threading.Event()
+    job = submit_job(("test", "cancel"), "sig", _slow, 1000, started=started)
+    assert started.wait(5)
+    assert cancel_slot(("test", "cancel"))
+    assert job.wait(5)
+    with pytest.raises(JobCancelled):
+        job.result()
+    assert job.progress < 0.5
+
+
+def test_changed_signature_cancels_previous_job():
+    started = threading.Event()
+    old = submit_job(("test", "resubmit"), "a", _slow, 1000, started=started)
+    assert started.wait(5)
+    new = submit_job(("test", "resubmit"), "b", _slow, 3)
+    assert old.cancelled and new is not old
+    assert new.wait(5) and new.result() == 3
+    assert current_job(("test", "resubmit"), "b") is new
+    release_job(new)
+    assert current_job(("test", "resubmit")) is None
+
+
+def test_same_signature_reuses_job():
+    a = submit_job(("test", "reuse"), "s", _slow, 3)
+    b = submit_job(("test", "reuse"), "s", _slow, 3)
+    assert a is b and a.wait(5) and a.result() == 3
+    release_job(a)
@@ -0,0 +1,120 @@
+"""
+SOCシミュレーションと供出可能量の結果が基準値とビット単位で一致するか。
+基準値（reference/soc_reference.json）は合成データ（1年・30分値・欠損なし）で、
+高速化前の実装（pandas の行ループ版、計画区間は追加時の版）の出力と一致することを確かめてから保存したもの。
+基準値を作り直すとき（仕様を変えたときだけ）:
+
+    python tests/test_soc_reference.py --update
+"""
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference", "soc_reference.json")
+SIMULATORS = ["simulate_soc_with_charge_periodic_reset", "simulate_soc_concurrent_price_optimized",
+              "simulate_soc_horizon_scheduled"]
+PARAMS = [
+    dict(P_pcs=1000.0, P_chg=1000.0, E_nom=2000.0, soc_init_pct=90.0, soc_floor_pct=10.0, reset_every_days=4),
+    dict(P_pcs=800.0, P_chg=500.0, E_nom=3000.0, soc_init_pct=80.0, soc_floor_pct=20.0, reset_every_days=3),
+]
+SAMPLES = 16
+
+
+def _digest(values):
+    return hashlib.sha256(np.ascontiguousarray(values).tobytes()).hexdigest()
+
+
+def _frame():
+    from benchmarks.synthetic import make_frame
+    return make_frame(years=1, seed=1)
+
+
+def _input_digest(df):
+    cols = sorted(df.columns)
+    return _digest(np.concatenate([df.index.asi8.astype(np.float64)]
+                                  + [df[c].to_numpy(dtype=np.float64, na_value=np.nan) for c in cols]))
+
+
+def _fingerprint(values):
+    values = np.asarray(values)
+    pos = np.linspace(0, len(values) - 1, SAMPLES).astype(int)
+    return {"n": int(len(values)), "sha256": _digest(values),
+            "samples": [float(v) for v in values[pos].astype(np.float64)]}
+
+
+def compute(df):
+    import utils_timeseries as T
+    out = {}
+    for i, params in enumerate(PARAMS):
+        for name in SIMULATORS:
+            soc = getattr(T, name)(df, resume=False, **params)
+            cost = T.derive_charge_cost_series(soc, df)[2]
+            out[f"{name}[{i}]"] = {"SOC_kWh": _fingerprint(soc["SOC_kWh"].to_numpy(dtype=np.float64)),
+                                   "charging": _fingerprint(soc["charging"].to_numpy(dtype=bool)),
+                                   "cost_yen": _fingerprint(cost.to_numpy(dtype=np.float64))}
+    offer = T.compute_export_offer_def1(df, P_pcs=1000.0, P_exp_max=600.0)[0]
+    out["compute_export_offer_def1"] = {"offer_kW": _fingerprint(offer.to_numpy(dtype=np.float64))}
+    return out
+
+
+@pytest.fixture(scope="module")
+def reference():
+    with open(REFERENCE, encoding="utf-8") as f:
+        ref = json.load(f)
+    df = _frame()
+    if _input_digest(df) != ref["input_sha256"]:
+        # 合成データ自体が違う（数学ライブラリの違いなど）ときは比べられない
+        pytest.skip("合成データが基準値を作った環境と一致しません")
+    return ref, df
+
+
+@pytest.fixture(scope="module")
+def outputs(reference):
+    return compute(reference[1])
+
+
+def _assert_same(got, want, label):
+    assert got["n"] == want["n"], label
+    if got["sha256"] != want["sha256"]:
+        diff = np.max(np.abs(np.asarray(got["samples"]) - np.asarray(want["samples"])))
+        pytest.fail(f"{label} が基準値と一致しません（抜き出した値の最大差 {diff:g}）")
+
+
+@pytest.mark.parametrize("case", [f"{n}[{i}]" for i in range(len(PARAMS)) for n in SIMULATORS]
+                         + ["compute_export_offer_def1"])
+def test_matches_reference(reference, outputs, case):
+    for col, want in reference[0]["outputs"][case].items():
+        _assert_same(outputs[case][col], want, f"{case}.{col}")
+
+
+def test_python_fallback_matches_reference(reference):
+    # numba があるときは、純Pythonのループ（TOSU_DISABLE_NUMBA=1 の別プロセス）も同じ基準値と一致するか
+    import utils_kernels
+    if not utils_kernels.HAS_NUMBA:
+        pytest.skip("numba が入っていないので test_matches_reference が純Pythonのループを確かめている")
+    env = {**os.environ, "TOSU_DISABLE_NUMBA": "1"}
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--print"], env=env, capture_output=True,
+                          text=True, check=True)
+    got = json.loads(proc.stdout)
+    for case, cols in reference[0]["outputs"].items():
+        for col, want in cols.items():
+            _assert_same(got[case][col], want, f"{case}.{col}（純Python）")
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    frame = _frame()
+    if "--print" in sys.argv:
+        print(json.dumps(compute(frame)))
+        sys.exit(0)
+    if "--update" not in sys.argv:
+        sys.exit("基準値を作り直すときは --update を付けてください。")
+    with open(REFERENCE, "w", encoding="utf-8") as f:
+        json.dump({"input_sha256": _input_digest(frame), "params": PARAMS, "outputs": compute(frame)}, f,
+                  ensure_ascii=False, indent=1)
+    print(f"保存しました: {REFERENCE}")
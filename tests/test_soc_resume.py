@@ -0,0 +1,53 @@
+"""期間の延長・データの追記からの再開（チェックポイント）と、区切り実行が最初から通して計算した結果と一致するか"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils_timeseries as T
+from benchmarks.synthetic import make_frame
+
+PARAMS = dict(P_pcs=1000.0, P_chg=1000.0, E_nom=2000.0, soc_init_pct=90.0, soc_floor_pct=10.0, reset_every_days=4)
+SIMULATORS = [T.simulate_soc_with_charge_periodic_reset, T.simulate_soc_concurrent_price_optimized,
+              T.simulate_soc_horizon_scheduled]
+
+
+@pytest.fixture(scope="module")
+def frame():
+    return make_frame(years=1, gap_rate=0.001, gap_blocks=2, seed=5)
+
+
+def _with_lineage(df, lineage):
+    T.frame_memo(df)["dataset_lineage"] = lineage
+    return df
+
+
+@pytest.mark.parametrize("fn", SIMULATORS, ids=lambda f: f.__name__)
+def test_extend_period_matches_full(frame, fn):
+    df = _with_lineage(frame.copy(), "resume-extend")
+    fn(df, end=df.index[-1] - pd.Timedelta(days=10), **PARAMS)
+    resumed = fn(df, **PARAMS)
+    full = fn(df, resume=False, **PARAMS)
+    pd.testing.assert_frame_equal(resumed, full, check_exact=True)
+
+
+@pytest.mark.parametrize("fn", SIMULATORS, ids=lambda f: f.__name__)
+def test_appended_data_matches_full(frame, fn):
+    # 同じ系列の更新版（末尾に追記したデータ）は変わっていない日までを再利用する
+    head = _with_lineage(frame.iloc[:-48 * 20].copy(), "resume-append")
+    fn(head, **PARAMS)
+    grown = _with_lineage(frame.copy(), "resume-append")
+    resumed = fn(grown, **PARAMS)
+    full = fn(grown, resume=False, **PARAMS)
+    pd.testing.assert_frame_equal(resumed, full, check_exact=True)
+
+
+@pytest.mark.parametrize("policy", T.SOC_POLICIES)
+def test_chunked_matches_single_run(frame, policy):
+    inputs = T.prepare_soc_inputs(frame)
+    single = T.run_soc_policy(inputs, policy, horizon_days=7, **PARAMS)
+    reports = []
+    chunked = T.run_soc_policy_chunked(inputs, policy, progress=reports.append, chunk_days=30, horizon_days=7,
+                                       **PARAMS)
+    for k in ("SOC_kWh", "charging", "charge_kWh"):
+        assert np.array_equal(single[k], chunked[k]), k
+    assert reports and reports[-1] == pytest.approx(1.0)
@@ -0,0 +1,15 @@
+import pytest
+
+from utils_sweep import parse_grid_values
+
+
+def test_parse_grid_values_ranges_and_lists():
+    assert parse_grid_values("1000:2000:500, 1500、3000") == [1000.0, 1500.0, 2000.0, 3000.0]
+    assert parse_grid_values("7, 3:5:1", int) == [3, 4, 5, 7]
+    assert parse_grid_values("7.0", int) == [7]
+
+
+@pytest.mark.parametrize("text", ["7.5", "1:4:1.5", "2, 3.25"])
+def test_parse_grid_values_rejects_non_integers(text):
+    with pytest.raises(ValueError, match="整数"):
+        parse_grid_values(text, int)
@@ -0,0 +1,292 @@
+
+import io
+import os
+import hashlib
+import inspect
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import numpy as np
+
+from utils_timeseries import load_excel_to_df, frame_memo, slot_of, resample_to_slot
+
+# ローダの出力仕様を変えたら上げる（古いParquetキャッシュを無効化）
+CACHE_VERSION = 6
+
+CACHE_DIR = os.environ.get(
+    "TOSU_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tosu_visualization")
+)
+CACHE_MAX_MB = float(os.environ.get("TOSU_CACHE_MAX_MB", "512"))
+# 図を画像にするときの解像度（間引きの描画幅 [px] もこれから求める）
+FIGURE_DPI = 200
+SIM_CACHE_MAX_MB = float(os.environ.get("TOSU_SIM_CACHE_MAX_MB", "256"))
+FIG_CACHE_MAX_MB = float(os.environ.get("TOSU_FIG_CACHE_MAX_MB", "128"))
+
+
+class LRUCache:
+    """プロセス共通のLRU（バイト数上限）。全セッションで共有するためロック付き。"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self._data = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, nbytes):
+        nbytes = int(nbytes)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._nbytes -= old[1]
+            if nbytes > self.max_bytes:
+                return
+            self._data[key] = (value, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes and self._data:
+                _, (_, n) = self._data.popitem(last=False)
+                self._nbytes -= n
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._nbytes = 0
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._data)
+
+
+_FRAME_CACHE = LRUCache(CACHE_MAX_MB * 1024 ** 2)
+_SIM_CACHE = LRUCache(SIM_CACHE_MAX_MB * 1024 ** 2)
+_FIG_CACHE = LRUCache(FIG_CACHE_MAX_MB * 1024 ** 2)
+
+
+def _read_bytes(file):
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as f:
+            return f.read()
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    pos = file.tell()
+    file.seek(0)
+    data = file.read()
+    file.seek(pos)
+    return data
+
+
+def file_digest(file):
+    """ファイル内容のハッシュ（アップロード/パス/ファイルオブジェクト共通）"""
+    return hashlib.blake2b(_read_bytes(file), digest_size=16).hexdigest()
+
+
+def frame_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def _sidecar_path(cache_dir, digest, sheet_name):
+    sheet_tag = hashlib.blake2b(sheet_name.encode("utf-8"), digest_size=8).hexdigest()
+    return os.path.join(cache_dir, f"v{CACHE_VERSION}_{digest}_{sheet_tag}.parquet")
+
+
+def _read_sidecar(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_parquet(path)
+    except Exception:
+        # 壊れた/読めないキャッシュは捨てて再パース
+        return None
+
+
+def _write_sidecar(path, df):
+    # ディスク側は失敗しても致命的ではない（pyarrow未導入・型の非互換など）
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_parquet(tmp)
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.remove(tmp)
+        except Exception:
+            pass
+
+
+def load_excel_cached(file, sheet_name=None, digest=None, cache_dir=CACHE_DIR, slot=None):
+    """
+    load_excel_to_df のキャッシュ版。キーは (内容ハッシュ, シート名, コマの長さ, 系列)。
+    系列（ファイル名:シート）はSOCのチェックポイントを引き継ぐ単位なので、同じ内容でも名前が違えば別のdfにする
+    （共有されたdfの系列を書き換えない。ディスクのParquetは内容ハッシュ単位で共有する）。
+    slot: コマの長さ（None なら開始日時の間隔から推定）
+    メモリLRU → ディスクParquet → Excelパース の順に探す。
+    返すDataFrameはセッション間で共有されるので、呼び出し側で破壊的変更をしないこと。
+    """
+    sheet = "" if sheet_name is None else str(sheet_name).strip()
+    digest = digest or file_digest(file)
+    slot_tag = "" if slot is None else f"@{int(pd.Timedelta(slot).total_seconds())}s"
+    # 同じファイル名・シートの更新版（追記）は SOC のチェックポイントを引き継げる
+    lineage = f"{getattr(file, 'name', file)}:{sheet}{slot_tag}"
+    key = (CACHE_VERSION, digest, sheet, slot_tag, lineage)
+    df = _FRAME_CACHE.get(key)
+    if df is not None:
+        return df
+    path = _sidecar_path(cache_dir, digest, sheet + slot_tag) if cache_dir else None
+    df = _read_sidecar(path) if path else None
+    if df is None:
+        if hasattr(file, "seek"):
+            file.seek(0)
+        df = load_excel_to_df(file, sheet, slot=slot)
+        if path:
+            _write_sidecar(path, df)
+    frame_memo(df)["dataset_key"] = f"{digest}:{sheet}{slot_tag}"
+    frame_memo(df)["dataset_lineage"] = lineage
+    _FRAME_CACHE.put(key, df, frame_nbytes(df))
+    return df
+
+
+def cached_frame(key, load):
+    """任意の読み込み関数 load() の結果をメモリLRUに載せる（キーは呼び出し側で版を含めること）"""
+    key = (CACHE_VERSION,) + tuple(key)
+    df = _FRAME_CACHE.get(key)
+    if df is None:
+        df = load()
+        _FRAME_CACHE.put(key, df, frame_nbytes(df))
+    return df
+
+
+def resample_cached(df, slot, min_coverage=1.0):
+    """
+    resample_to_slot のキャッシュ版（キーは元データの dataset_key とコマの長さ）。
+    コマの長さが元と同じなら df をそのまま返す。
+    """
+    slot = pd.Timedelta(slot)
+    if slot == slot_of(df):
+        return df
+    lineage = frame_memo(df).get("dataset_lineage")
+    tag = f"@{int(slot.total_seconds())}s/{float(min_coverage):g}"
+    # 系列もキーに含める（系列ごとに別のdfにし、共有されたdfの系列を書き換えない）
+    out = cached_frame(("resample", dataset_key(df), tag, lineage), lambda: resample_to_slot(df, slot, min_coverage))
+    memo = frame_memo(out)
+    memo["dataset_key"] = f"{dataset_key(df)}{tag}"
+    if lineage is not None:
+        memo["dataset_lineage"] = f"{lineage}{tag}"
+    return out
+
+
+def clear_frame_cache():
+    _FRAME_CACHE.clear()
+
+
+def _update_hash(h, obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+        names = list(obj.columns) if isinstance(obj, pd.DataFrame) else [obj.name]
+        h.update(repr(names).encode("utf-8"))
+    elif isinstance(obj, pd.Index):
+        h.update(pd.util.hash_pandas_object(obj).to_numpy().tobytes())
+    elif isinstance(obj, np.ndarray):
+        h.update(f"{obj.dtype}{obj.shape}".encode("utf-8"))
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        for k in sorted(obj, key=repr):
+            h.update(repr(k).encode("utf-8"))
+            _update_hash(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f"seq{len(obj)}".encode("utf-8"))
+        for v in obj:
+            _update_hash(h, v)
+    else:
+        h.update(repr(_freeze(obj)).encode("utf-8"))
+
+
+def content_hash(*parts):
+    """DataFrame/Series/ndarray/スカラー/入れ子のdict・listの内容ハッシュ"""
+    h = hashlib.blake2b(digest_size=16)
+    for p in parts:
+        _update_hash(h, p)
+    return h.hexdigest()
+
+
+def dataset_key(df):
+    """
+    データセットの識別子。load_excel_cached で読んだdfは内容ハッシュ、
+    それ以外（スライス等）はDataFrameの内容から求める（dfごとに1回）。
+    """
+    memo = frame_memo(df)
+    key = memo.get("dataset_key")
+    if key is None:
+        key = memo["dataset_key"] = content_hash(df)
+    return key
+
+
+def _freeze(value):
+    # キャッシュキー用に値を正規化（1000 と 1000.0、日付型の違いを同一視）
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    if isinstance(value, (pd.Timestamp, np.datetime64)) or hasattr(value, "isoformat"):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return repr(value)
+
+
+def simulation_key(fn, df, **params):
+    """cached_simulation のキー（データセット, 関数, 全パラメータ）。バックグラウンドのジョブの条件にも使う"""
+    # 省略された引数も既定値で埋めて、明示/省略の違いでキーが分かれないようにする
+    bound = inspect.signature(fn).bind(df, **params)
+    bound.apply_defaults()
+    full = {k: v for k, v in bound.arguments.items() if v is not df and k != "progress"}
+    return (dataset_key(df), fn.__module__, fn.__qualname__, _freeze(full))
+
+
+def cached_simulation(fn, df, progress=None, **params):
+    """
+    シミュレーション結果のメモ化（LRU）。キーは simulation_key。
+    Tab7/Tab8 など別の画面から同じ条件で呼ばれても1回しか計算しない。
+    返すDataFrameは共有されるので破壊的変更をしないこと。
+    progress: 計算するときに fn へ渡す進捗の報告先（キーには含めない）
+    """
+    key = simulation_key(fn, df, **params)
+    out = _SIM_CACHE.get(key)
+    if out is None:
+        out = fn(df, **params) if progress is None else fn(df, progress=progress, **params)
+        _SIM_CACHE.put(key, out, frame_nbytes(out))
+    return out
+
+
+def render_figure(name, build, *key_parts, fmt="png", dpi=FIGURE_DPI):
+    """
+    build() が返す matplotlib Figure を画像バイト列にする（LRUキャッシュ）。
+    key_parts にはプロットするデータと表示パラメータをすべて渡す。同じ内容なら再描画しない。
+    Figure は描画後すぐ閉じるので、長時間のセッションでもメモリが増えない。
+    """
+    key = (name, fmt, dpi, content_hash(*key_parts))
+    img = _FIG_CACHE.get(key)
+    if img is None:
+        import matplotlib.pyplot as plt
+        fig = build()
+        try:
+            buf = io.BytesIO()
+            fig.savefig(buf, format=fmt, dpi=dpi, bbox_inches="tight")
+        finally:
+            plt.close(fig)
+        img = buf.getvalue()
+        _FIG_CACHE.put(key, img, len(img))
+    return img
@@ -0,0 +1,57 @@
+
+"""
+ダウンロード用の書き出し（押されたときだけ作る）。
+CSVは行を分けて書き、DataFrame全体の文字列を一度に作らない。
+"""
+import gzip
+import io
+
+EXPORT_CSV = "CSV"
+EXPORT_CSV_GZ = "CSV（gzip圧縮）"
+EXPORT_PARQUET = "Parquet"
+EXPORT_FORMATS = [EXPORT_CSV, EXPORT_CSV_GZ, EXPORT_PARQUET]
+EXPORT_EXTENSIONS = {EXPORT_CSV: ".csv", EXPORT_CSV_GZ: ".csv.gz", EXPORT_PARQUET: ".parquet"}
+EXPORT_MIME = {EXPORT_CSV: "text/csv", EXPORT_CSV_GZ: "application/gzip", EXPORT_PARQUET: "application/octet-stream"}
+CSV_CHUNK_ROWS = 50_000
+
+
+def export_file_name(base_name, fmt):
+    return base_name + EXPORT_EXTENSIONS[fmt]
+
+
+def write_csv(frame, raw, index=True, index_label=None, chunk_rows=CSV_CHUNK_ROWS, progress=None):
+    """
+    frame を UTF-8（BOM付き、Excelで開ける）のCSVとしてバイナリストリーム raw に書く。
+    progress: 行の塊を書くたびに済んだ割合で呼ぶ（例外を投げると止まる）
+    """
+    text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+    try:
+        n = max(len(frame), 1)
+        for start in range(0, n, chunk_rows):
+            frame.iloc[start:start + chunk_rows].to_csv(text, header=start == 0, index=index, index_label=index_label)
+            if progress is not None:
+                progress(min(start + chunk_rows, n) / n)
+        text.flush()
+    finally:
+        # raw は呼び出し側が閉じる
+        text.detach()
+
+
+def export_bytes(frame, fmt=EXPORT_CSV, index=True, index_label=None, chunk_rows=CSV_CHUNK_ROWS, progress=None):
+    """frame を fmt（EXPORT_FORMATS）のバイト列にする。progress はCSVのときだけ途中経過を受け取る"""
+    buf = io.BytesIO()
+    if fmt == EXPORT_CSV:
+        write_csv(frame, buf, index, index_label, chunk_rows, progress)
+    elif fmt == EXPORT_CSV_GZ:
+        # mtime=0 で同じ内容なら同じバイト列にする
+        with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=6, mtime=0) as gz:
+            write_csv(frame, gz, index, index_label, chunk_rows, progress)
+    elif fmt == EXPORT_PARQUET:
+        out = frame
+        if index and index_label:
+            out = frame.rename_axis(index_label)
+        # Parquetの列名は文字列に限る（0..47スロットの行列など）
+        out.rename(columns=str).to_parquet(buf, index=index)
+    else:
+        raise ValueError(f"未対応の出力形式です: {fmt}（{', '.join(EXPORT_FORMATS)}）")
+    return buf.getvalue()
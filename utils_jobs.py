@@ -0,0 +1,177 @@
+
+"""
+重い処理（SOCシミュレーション・スイープ・シナリオ・書き出しなど）のバックグラウンド実行。
+ジョブはIDを付けてスレッドプールに投入し、進捗（0〜1）を記録する。
+同じ枠（セッション × 画面上の場所）に別の条件のジョブを投入すると前のジョブを取り消す。
+待ち中なら実行せず、実行中なら次の進捗報告で止まる（処理側が progress を呼ぶ区切りが取り消しの単位）。
+"""
+import inspect
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+JOB_WORKERS = int(os.environ.get("TOSU_JOB_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+JOB_SLOTS_MAX = 64
+
+_SLOTS = OrderedDict()
+_JOBS = {}
+_LOCK = threading.Lock()
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """取り消されたジョブが進捗を報告したときに投げる（処理を途中で止める）"""
+
+
+class Job:
+    """1つのバックグラウンド処理。signature はジョブの条件（同じ枠で条件が変わったら取り消す）"""
+
+    def __init__(self, slot, signature, label=""):
+        self.id = uuid.uuid4().hex[:12]
+        self.slot = slot
+        self.signature = signature
+        self.label = label
+        self.progress = 0.0
+        self.message = ""
+        self.submitted = time.time()
+        self.future = None
+        self._cancel = threading.Event()
+
+    def report(self, fraction, message=None):
+        """処理側から呼ぶ進捗の報告。取り消されていれば JobCancelled を投げる"""
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+        self.progress = min(max(float(fraction), 0.0), 1.0)
+        if message is not None:
+            self.message = message
+
+    def cancel(self):
+        self._cancel.set()
+        self.future.cancel()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def done(self):
+        return self.future.done()
+
+    def wait(self, timeout=None):
+        """終わるまで（最大 timeout 秒）待つ。戻り値: 終わったか"""
+        wait([self.future], timeout)
+        return self.future.done()
+
+    def result(self):
+        """結果（処理の例外はそのまま投げる）"""
+        return self.future.result()
+
+
+def _executor():
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="tosu-job")
+        return _EXECUTOR
+
+
+def _accepts_progress(fn):
+    try:
+        return "progress" in inspect.signature(fn).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _run(job, fn, args, kwargs):
+    if job.cancelled:
+        raise JobCancelled(job.id)
+    if _accepts_progress(fn):
+        kwargs = {**kwargs, "progress": job.report}
+    out = fn(*args, **kwargs)
+    job.progress = 1.0
+    return out
+
+
+def _forget(job):
+    # 呼び出し側で _LOCK を持つこと
+    _JOBS.pop(job.id, None)
+    if _SLOTS.get(job.slot) is job:
+        del _SLOTS[job.slot]
+
+
+def submit_job(slot, signature, fn, *args, label="", **kwargs):
+    """
+    fn(*args, **kwargs) をバックグラウンドで実行する。fn に progress 引数があれば Job.report を渡す。
+    同じ枠に同じ条件のジョブがあれば（実行中・完了済みとも）それを返し、条件が違えば前のジョブを取り消す。
+    例外で終わったジョブは返さず、投入し直す。
+    """
+    executor = _executor()
+    with _LOCK:
+        old = _SLOTS.get(slot)
+        if (old is not None and old.signature == signature and not old.cancelled
+                and not (old.future.done() and old.future.exception() is not None)):
+            _SLOTS.move_to_end(slot)
+            return old
+        if old is not None:
+            old.cancel()
+            _forget(old)
+        job = Job(slot, signature, label)
+        _SLOTS[slot] = job
+        _JOBS[job.id] = job
+        # 古い枠（閉じたセッションなど）は終わったものから捨てる
+        for stale in [j for j in _SLOTS.values() if j is not job and j.future.done()]:
+            if len(_SLOTS) <= JOB_SLOTS_MAX:
+                break
+            _forget(stale)
+        job.future = executor.submit(_run, job, fn, args, kwargs)
+    return job
+
+
+def find_job(job_id):
+    """ジョブIDからジョブを探す（無ければ None）"""
+    with _LOCK:
+        return _JOBS.get(job_id)
+
+
+def current_job(slot, signature=None):
+    """
+    枠の現在のジョブ。signature を指定すると、条件が違うジョブは取り消して None を返す
+    （ボタンで始めたジョブの結果を、入力が変わっていない間だけ受け取る）。
+    """
+    with _LOCK:
+        job = _SLOTS.get(slot)
+        if job is None or signature is None or job.signature == signature:
+            return job
+        job.cancel()
+        _forget(job)
+        return None
+
+
+def release_job(job):
+    """結果を受け取ったジョブを枠から外す（完了済みの結果をプロセスに持ち続けない）"""
+    with _LOCK:
+        _forget(job)
+
+
+def cancel_slot(slot):
+    """枠のジョブを取り消す。戻り値: 取り消したか"""
+    with _LOCK:
+        job = _SLOTS.get(slot)
+        if job is None:
+            return False
+        job.cancel()
+        _forget(job)
+        return True
+
+
+def job_status():
+    """全ジョブの状態（ID・枠・進捗・経過秒）"""
+    with _LOCK:
+        jobs = list(_JOBS.values())
+    now = time.time()
+    return [{"id": j.id, "slot": j.slot, "label": j.label, "progress": j.progress,
+             "running": not j.future.done(), "cancelled": j.cancelled,
+             "elapsed_s": round(now - j.submitted, 1)} for j in jobs]
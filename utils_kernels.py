@@ -0,0 +1,393 @@
+
+"""
+SOCシミュレーションの配列カーネル。
+Numbaがあれば JIT コンパイル、無ければ同じループを純Python（list化した配列）で回す。
+min/max は元のPython実装と同じ比較順で書いてあり、結果はビット単位で一致する。
+"""
+import os
+
+import numpy as np
+
+try:
+    if os.environ.get("TOSU_DISABLE_NUMBA"):
+        raise ImportError
+    from numba import njit
+except ImportError:
+    njit = None
+
+HAS_NUMBA = njit is not None
+
+
+def _jit(fn):
+    return njit(cache=True, nogil=True)(fn) if HAS_NUMBA else fn
+
+
+def _periodic_reset_loop(use_kWh, reset_flag, E_init, E_floor, add_max, E_start, charging_start, deficit_start,
+                         day_start, soc_out, chg_out, st_E, st_chg, st_def):
+    E = E_start
+    charging = charging_start
+    deficit = deficit_start
+    d = 0
+    n_days = len(day_start) - 1
+    for i in range(len(use_kWh)):
+        if d < n_days and i == day_start[d]:
+            # 日の先頭の状態（チェックポイント）
+            st_E[d] = E
+            st_chg[d] = charging
+            st_def[d] = deficit
+            d += 1
+        if reset_flag[i]:
+            r = E_init - E
+            deficit = r if r > 0.0 else 0.0
+            charging = deficit > 0.0
+        if charging:
+            add = deficit if deficit < add_max else add_max
+            x = E + add
+            E = x if x < E_init else E_init
+            deficit -= add
+            if deficit <= 1e-9 or E >= E_init - 1e-9:
+                charging = False
+            chg_out[i] = True
+        else:
+            x = E - use_kWh[i]
+            E = x if x > E_floor else E_floor
+            chg_out[i] = False
+        soc_out[i] = E
+    st_E[n_days] = E
+    st_chg[n_days] = charging
+    st_def[n_days] = deficit
+
+
+_periodic_reset_jit = _jit(_periodic_reset_loop)
+
+
+def periodic_reset_soc(use_kWh, reset_flag, E_init, E_floor, add_max, day_start=None, state=None):
+    """
+    0:00起点の連続充電ポリシー。
+    use_kWh: 各スロットの放電量[kWh]、reset_flag: 充電判定を行うスロット、add_max: 1スロットの最大充電量[kWh]
+    day_start: 各日の先頭行（末尾に総行数）、state: 開始時の (E, charging, deficit)。None なら (E_init, False, 0)
+    戻り値: (SOC_kWh, charging, 日の先頭ごとの (E, charging, deficit)[日数+1])
+    """
+    use_kWh = np.ascontiguousarray(use_kWh, dtype=np.float64)
+    reset_flag = np.ascontiguousarray(reset_flag, dtype=np.bool_)
+    n = len(use_kWh)
+    day_start = np.ascontiguousarray([0, n] if day_start is None else day_start, dtype=np.int64)
+    E0, chg0, def0 = state if state is not None else (E_init, False, 0.0)
+    args = (float(E_init), float(E_floor), float(add_max), float(E0), bool(chg0), float(def0))
+    k = len(day_start)
+    if HAS_NUMBA:
+        soc = np.empty(n, dtype=np.float64)
+        chg = np.empty(n, dtype=np.bool_)
+        st = (np.empty(k, dtype=np.float64), np.empty(k, dtype=np.bool_), np.empty(k, dtype=np.float64))
+        _periodic_reset_jit(use_kWh, reset_flag, *args, day_start, soc, chg, *st)
+        return soc, chg, st
+    soc = [0.0] * n
+    chg = [False] * n
+    st = ([0.0] * k, [False] * k, [0.0] * k)
+    _periodic_reset_loop(use_kWh.tolist(), reset_flag.tolist(), *args, day_start.tolist(), soc, chg, *st)
+    return (np.array(soc, dtype=np.float64), np.array(chg, dtype=np.bool_),
+            (np.array(st[0], dtype=np.float64), np.array(st[1], dtype=np.bool_), np.array(st[2], dtype=np.float64)))
+
+
+def _price_optimized_loop(sup_kW, cap_kWh, day_start, is_charge_day, order, width,
+                          slot_h, E_init, E_floor, E_start, soc_out, add_out):
+    E_curr = E_start
+    for d in range(len(day_start) - 1):
+        s = day_start[d]
+        e = day_start[d + 1]
+        charge_day = is_charge_day[d]
+
+        # 充電ゼロで当日終端までSOCを推定 → 目標SOCまでの必要量R
+        E_tmp = E_curr
+        for i in range(s, e):
+            x = E_tmp - sup_kW[i] * slot_h
+            E_tmp = x if x > E_floor else E_floor
+        R = 0.0
+        if charge_day:
+            r = E_init - E_tmp
+            R = r if r > 0.0 else 0.0
+
+        # 価格の安い順に割当（order は日ごとの安定ソート済み位置、幅widthでパディング）
+        for i in range(s, e):
+            add_out[i] = 0.0
+        if charge_day and R > 0:
+            remaining = R
+            for k in range(width):
+                j = order[d * width + k]
+                if j >= e - s:
+                    continue
+                cap = cap_kWh[s + j]
+                if cap <= 0 or remaining <= 0:
+                    continue
+                add = remaining if remaining < cap else cap
+                add_out[s + j] = add
+                remaining -= add
+
+        # 時間順にSOC更新（放電 → 割当分の充電、SOC上限で頭打ち）
+        for i in range(s, e):
+            x = E_curr - sup_kW[i] * slot_h
+            E_curr = x if x > E_floor else E_floor
+            add = add_out[i] if charge_day else 0.0
+            m = E_init - E_curr
+            m = m if m > 0.0 else 0.0
+            add = m if m < add else add
+            E_curr += add
+            soc_out[i] = E_curr
+            add_out[i] = add
+
+
+_price_optimized_jit = _jit(_price_optimized_loop)
+
+
+def price_optimized_soc(sup_kW, cap_kWh, day_start, is_charge_day, order, slot_h, E_init, E_floor, E_start=None):
+    """
+    充電日に当日最安コマから割当てるポリシー（同時供出）。
+    day_start: 各日の先頭行（末尾に総行数）、order: (日数 × 幅) の日内価格昇順位置
+    E_start: 開始時のSOC[kWh]（None なら E_init）
+    戻り値: (SOC_kWh, charge_kWh)
+    """
+    sup_kW = np.ascontiguousarray(sup_kW, dtype=np.float64)
+    cap_kWh = np.ascontiguousarray(cap_kWh, dtype=np.float64)
+    day_start = np.ascontiguousarray(day_start, dtype=np.int64)
+    is_charge_day = np.ascontiguousarray(is_charge_day, dtype=np.bool_)
+    width = order.shape[1] if order.ndim == 2 else 0
+    order = np.ascontiguousarray(order, dtype=np.int64).ravel()
+    n = len(sup_kW)
+    args = (float(slot_h), float(E_init), float(E_floor), float(E_init if E_start is None else E_start))
+    if HAS_NUMBA:
+        soc = np.empty(n, dtype=np.float64)
+        add = np.empty(n, dtype=np.float64)
+        _price_optimized_jit(sup_kW, cap_kWh, day_start, is_charge_day, order, width, *args, soc, add)
+        return soc, add
+    soc = [0.0] * n
+    add = [0.0] * n
+    _price_optimized_loop(sup_kW.tolist(), cap_kWh.tolist(), day_start.tolist(), is_charge_day.tolist(),
+                          order.tolist(), width, *args, soc, add)
+    return np.array(soc, dtype=np.float64), np.array(add, dtype=np.float64)
+
+
+# --- 複数日ホライズンのスケジューラ用：区間加算・区間最小のセグメント木と最小ヒープ ---
+
+@_jit
+def _seg_apply(tree, lazy, p, v, size):
+    tree[p] += v
+    if p < size:
+        lazy[p] += v
+
+
+@_jit
+def _seg_build(tree, lazy, p):
+    while p > 1:
+        p >>= 1
+        a = tree[2 * p]
+        b = tree[2 * p + 1]
+        tree[p] = (a if a < b else b) + lazy[p]
+
+
+@_jit
+def _seg_push(tree, lazy, p, h, size):
+    s = h
+    while s > 0:
+        i = p >> s
+        if lazy[i] != 0.0:
+            _seg_apply(tree, lazy, 2 * i, lazy[i], size)
+            _seg_apply(tree, lazy, 2 * i + 1, lazy[i], size)
+            lazy[i] = 0.0
+        s -= 1
+
+
+@_jit
+def _seg_add(tree, lazy, l, r, v, size):
+    # [l, r) に v を加算
+    l += size
+    r += size
+    l0 = l
+    r0 = r
+    while l < r:
+        if l & 1:
+            _seg_apply(tree, lazy, l, v, size)
+            l += 1
+        if r & 1:
+            r -= 1
+            _seg_apply(tree, lazy, r, v, size)
+        l >>= 1
+        r >>= 1
+    _seg_build(tree, lazy, l0)
+    _seg_build(tree, lazy, r0 - 1)
+
+
+@_jit
+def _seg_min(tree, lazy, l, r, size, h):
+    # [l, r) の最小値
+    l += size
+    r += size
+    _seg_push(tree, lazy, l, h, size)
+    _seg_push(tree, lazy, r - 1, h, size)
+    res = np.inf
+    while l < r:
+        if l & 1:
+            res = tree[l] if tree[l] < res else res
+            l += 1
+        if r & 1:
+            r -= 1
+            res = tree[r] if tree[r] < res else res
+        l >>= 1
+        r >>= 1
+    return res
+
+
+@_jit
+def _heap_less(hp, hi, a, b):
+    # 価格が同じなら早いコマを先に
+    return hp[a] < hp[b] or (hp[a] == hp[b] and hi[a] < hi[b])
+
+
+@_jit
+def _heap_push(hp, hi, n, p, i):
+    k = n
+    hp[k] = p
+    hi[k] = i
+    while k > 0:
+        parent = (k - 1) >> 1
+        if not _heap_less(hp, hi, k, parent):
+            break
+        hp[k], hp[parent] = hp[parent], hp[k]
+        hi[k], hi[parent] = hi[parent], hi[k]
+        k = parent
+    return n + 1
+
+
+@_jit
+def _heap_pop(hp, hi, n):
+    # 先頭を取り除く（先頭の値は呼び出し側で hp[0], hi[0] を先に読むこと）
+    n -= 1
+    hp[0] = hp[n]
+    hi[0] = hi[n]
+    k = 0
+    while True:
+        c = 2 * k + 1
+        if c >= n:
+            break
+        if c + 1 < n and _heap_less(hp, hi, c + 1, c):
+            c += 1
+        if not _heap_less(hp, hi, c, k):
+            break
+        hp[k], hp[c] = hp[c], hp[k]
+        hi[k], hi[c] = hi[c], hi[k]
+        k = c
+    return n
+
+
+def _horizon_loop(use_kWh, cap_kWh, price, win_start, E_init, E_floor, E_start, soc_out, add_out,
+                  lower, room, rem, tree, lazy, hp, hi, size, h):
+    E_curr = E_start
+    for w in range(len(win_start) - 1):
+        s = win_start[w]
+        e = win_start[w + 1]
+        m = e - s
+        E0 = E_curr
+
+        # 累積充電量 X_t の下限（下限SOC・区間末で初期SOC）と上限（初期SOCで頭打ち）
+        D = 0.0
+        for k in range(m):
+            D += use_kWh[s + k]
+            lower[k] = D - (E0 - E_floor)
+            room[k] = D + (E_init - E0)
+        t_end = D - (E0 - E_init)
+        if t_end > lower[m - 1]:
+            lower[m - 1] = t_end
+        for k in range(m - 2, -1, -1):
+            if room[k + 1] < room[k]:
+                room[k] = room[k + 1]
+
+        # セグメント木の葉 = 上限までの余裕（充電するとそのコマ以降の余裕が減る）
+        for k in range(2 * size):
+            tree[k] = np.inf
+            lazy[k] = 0.0
+        for k in range(m):
+            tree[size + k] = room[k]
+        for k in range(size - 1, 0, -1):
+            a = tree[2 * k]
+            b = tree[2 * k + 1]
+            tree[k] = a if a < b else b
+
+        # 時間順に、不足が出たらそれまでのコマのうち最安から割り当てる
+        n_heap = 0
+        X = 0.0
+        need = 0.0
+        for t in range(m):
+            add_out[s + t] = 0.0
+            rem[t] = cap_kWh[s + t]
+            if rem[t] > 0.0:
+                p = price[s + t]
+                n_heap = _heap_push(hp, hi, n_heap, p if p == p else np.inf, t)
+            if lower[t] > need:
+                need = lower[t]
+            delta = need - X
+            while delta > 1e-9 and n_heap > 0:
+                i = hi[0]
+                r = _seg_min(tree, lazy, i, t + 1, size, h)
+                if r <= 1e-9:
+                    # 余裕は減る一方なので、このコマはもう使えない
+                    n_heap = _heap_pop(hp, hi, n_heap)
+                    continue
+                a = delta
+                if rem[i] < a:
+                    a = rem[i]
+                if r < a:
+                    a = r
+                add_out[s + i] += a
+                rem[i] -= a
+                X += a
+                delta -= a
+                _seg_add(tree, lazy, i, m, -a, size)
+                if rem[i] <= 1e-9:
+                    n_heap = _heap_pop(hp, hi, n_heap)
+            if delta > 1e-9:
+                # 割り当てきれない不足は下限SOCで頭打ち（その分は以降の計算から外す）
+                X += delta
+                _seg_add(tree, lazy, t, m, -delta, size)
+
+        # 割当てた充電量で時間順にSOC更新（コマ内は充放電を相殺）
+        for i in range(s, e):
+            x = E_curr + add_out[i] - use_kWh[i]
+            x = x if x > E_floor else E_floor
+            E_curr = x if x < E_init else E_init
+            soc_out[i] = E_curr
+
+
+_horizon_jit = _jit(_horizon_loop)
+
+
+def horizon_scheduled_soc(use_kWh, cap_kWh, price, win_start, E_init, E_floor, E_start=None):
+    """
+    複数日の計画区間ごとに、区間内の最安コマから充電を割り当てるポリシー。
+    下限SOCを割らないこと・区間末に初期SOCへ戻すことを満たす最小コストの割当を
+    ヒープによる貪欲法で求める（上限SOCはセグメント木で判定、O(n log n)）。
+    win_start: 各区間の先頭行（末尾に総行数）、E_start: 開始時のSOC[kWh]（None なら E_init）
+    戻り値: (SOC_kWh, charge_kWh)
+    """
+    use_kWh = np.ascontiguousarray(use_kWh, dtype=np.float64)
+    cap_kWh = np.ascontiguousarray(cap_kWh, dtype=np.float64)
+    price = np.ascontiguousarray(price, dtype=np.float64)
+    win_start = np.ascontiguousarray(win_start, dtype=np.int64)
+    n = len(use_kWh)
+    m_max = int(np.diff(win_start).max()) if len(win_start) > 1 else 0
+    size = 1
+    while size < max(m_max, 1):
+        size *= 2
+    h = size.bit_length()
+    args = (float(E_init), float(E_floor), float(E_init if E_start is None else E_start))
+    if HAS_NUMBA:
+        soc = np.empty(n, dtype=np.float64)
+        add = np.empty(n, dtype=np.float64)
+        _horizon_jit(use_kWh, cap_kWh, price, win_start, *args, soc, add,
+                     np.empty(m_max), np.empty(m_max), np.empty(m_max), np.empty(2 * size), np.empty(2 * size),
+                     np.empty(m_max), np.empty(m_max, dtype=np.int64), size, h)
+        return soc, add
+    soc = [0.0] * n
+    add = [0.0] * n
+    _horizon_loop(use_kWh.tolist(), cap_kWh.tolist(), price.tolist(), win_start.tolist(), *args, soc, add,
+                  [0.0] * m_max, [0.0] * m_max, [0.0] * m_max, [0.0] * (2 * size), [0.0] * (2 * size),
+                  [0.0] * m_max, [0] * m_max, size, h)
+    return np.array(soc, dtype=np.float64), np.array(add, dtype=np.float64)
@@ -0,0 +1,161 @@
+
+"""
+供出可能量（定義①）のブロック・移動窓の集計。複数の PCS定格 × 逆潮上限 をまとめて計算する。
+
+供出可能量 clip(P_pcs - (L-G), 0, P_exp_max) は L-G について単調減少なので、
+ブロック内の最小値・順位統計は L-G の最大値・順位統計から設定ごとに1回の演算で求まる。
+L-G の集計は設定によらず1回だけ行う。
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from utils_timeseries import slot_of, pick_load_series, pick_generation_series, time_grid
+
+OFFER_BLOCK_HOURS = [1, 2, 3, 4, 6, 12, 24]
+
+
+def offer_settings(P_pcs, P_exp_max=None):
+    """P_pcs と P_exp_max（スカラーかリスト、None=無制限）の全組合せ。戻り値: DataFrame(P_pcs, P_exp_max)"""
+    pcs = np.atleast_1d(np.asarray(P_pcs, dtype=float))
+    exp = [None] if P_exp_max is None else list(np.atleast_1d(np.asarray(P_exp_max, dtype=object)))
+    rows = [(float(p), np.nan if x is None else float(x)) for p, x in itertools.product(pcs, exp)]
+    return pd.DataFrame(rows, columns=["P_pcs", "P_exp_max"])
+
+
+def _offer(net, settings):
+    # (… × 設定) の供出可能量。net が NaN のコマは NaN のまま
+    P = settings["P_pcs"].to_numpy(dtype=float)
+    X = np.nan_to_num(settings["P_exp_max"].to_numpy(dtype=float), nan=np.inf)
+    return np.clip(P - net[..., None], 0.0, X)
+
+
+def net_load(df, load_col=None, gen_col=None):
+    """L-G [kW]（ndarray）"""
+    L = pick_load_series(df, preferred=load_col)
+    G = pick_generation_series(df, preferred=gen_col)
+    return (L - G).to_numpy(dtype=float, na_value=np.nan)
+
+
+def _block_ids(df, block_slots):
+    # 0:00 起点の固定ブロック（日 × 1日のブロック数 + 日内のブロック番号）
+    grid = time_grid(df)
+    step = slot_of(df)
+    slot = np.asarray((grid.index - grid.index.normalize()) // step, dtype=np.int64)
+    per_day = -(-int(pd.Timedelta(days=1) / step) // block_slots)
+    return grid.day_code * per_day + slot // block_slots, grid.days, per_day
+
+
+def block_offer(df, P_pcs, P_exp_max=None, block_hours=3, percentiles=(10,), load_col=None, gen_col=None):
+    """
+    固定ブロック（0:00起点、block_hours 時間）ごとの供出可能量の統計を、全設定まとめて求める。
+    欠損コマは除いて集計し、有効なコマが無いブロックは NaN。
+    戻り値: dict(settings, blocks[ブロック開始時刻], slots[有効コマ数], min[ブロック × 設定], p<q>[同])
+    p<q> はブロック内の q パーセンタイル（補間しない順位統計。下から q% の位置の実在するコマの値）
+    """
+    settings = offer_settings(P_pcs, P_exp_max)
+    step = slot_of(df)
+    block_slots = max(int(pd.Timedelta(hours=block_hours) / step), 1)
+    net = net_load(df, load_col, gen_col)
+    out = {"settings": settings, "block_hours": float(block_hours)}
+    if len(net) == 0:
+        empty = np.zeros((0, len(settings)))
+        out.update(blocks=pd.DatetimeIndex([]), slots=np.zeros(0, dtype=np.int64), min=empty)
+        out.update({f"p{q:g}": empty for q in percentiles})
+        return out
+
+    ids, days, per_day = _block_ids(df, block_slots)
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    valid = ~np.isnan(net)
+    counts = np.add.reduceat(valid.astype(np.int64), starts)
+    # fmax は NaN を無視する（全て NaN のブロックだけ NaN）
+    net_max = np.fmax.reduceat(net, starts)
+    block_id = ids[starts]
+    out["blocks"] = (days[block_id // per_day]
+                     + pd.to_timedelta((block_id % per_day) * block_slots * step.value, unit="ns"))
+    out["slots"] = counts
+    out["min"] = _offer(net_max, settings)
+
+    if percentiles:
+        # ブロック内で L-G を昇順に並べる（NaN は各ブロックの末尾）
+        order = np.lexsort((net, ids))
+        sorted_net = net[order]
+        for q in percentiles:
+            # 供出可能量の下から q% = L-G の上から q%（単調減少なので順位が入れ替わる）
+            k = np.floor(float(q) / 100.0 * (counts - 1)).astype(np.int64)
+            pos = starts + np.maximum(counts - 1 - k, 0)
+            vals = np.where(counts > 0, sorted_net[np.minimum(pos, len(net) - 1)], np.nan)
+            out[f"p{q:g}"] = _offer(vals, settings)
+    return out
+
+
+def offer_block_summary(result):
+    """
+    設定ごとの要約。min_kW: 全ブロックの保証量の最小値、mean_block_min_kW: ブロック最小値の平均、
+    hours_at_cap: 保証量が逆潮上限に達するブロックの時間数、hours_zero: 保証量が0のブロックの時間数
+    """
+    s = result["settings"].copy()
+    m = result["min"]
+    h = result["block_hours"]
+    ok = ~np.isnan(m)
+    any_ok = ok.any(axis=0)
+    filled = np.where(ok, m, np.inf)
+    arg = np.argmin(filled, axis=0)
+    s["min_kW"] = np.where(any_ok, filled[arg, np.arange(m.shape[1])], np.nan)
+    s["min_at"] = [result["blocks"][i] if a else pd.NaT for i, a in zip(arg, any_ok)]
+    with np.errstate(invalid="ignore"):
+        s["mean_block_min_kW"] = np.nanmean(np.where(ok, m, np.nan), axis=0) if len(m) else np.nan
+    cap = s["P_exp_max"].to_numpy(dtype=float)
+    s["hours_at_cap"] = np.where(np.isnan(cap), np.nan, (ok & (m >= cap - 1e-9)).sum(axis=0) * h)
+    s["hours_zero"] = (ok & (m <= 0.0)).sum(axis=0) * h
+    s["blocks"] = ok.sum(axis=0)
+    return s
+
+
+def offer_duration_curve(result):
+    """
+    ブロック保証量の持続曲線（設定ごとに降順）。index は「この量以上を保証できる時間数」。
+    戻り値: DataFrame(時間 × 設定)
+    """
+    m = result["min"]
+    h = result["block_hours"]
+    curve = -np.sort(-np.where(np.isnan(m), -np.inf, m), axis=0)
+    curve[np.isinf(curve)] = np.nan
+    cols = [f"PCS{p:g}/上限{'なし' if np.isnan(x) else f'{x:g}'}"
+            for p, x in result["settings"][["P_pcs", "P_exp_max"]].to_numpy()]
+    return pd.DataFrame(curve, index=pd.Index((np.arange(len(m)) + 1) * h, name="hours"), columns=cols)
+
+
+def sliding_max(values, window):
+    """
+    長さ window の移動最大（NaN は無視）。van Herk / Gil-Werman 法で窓の長さによらず O(n)。
+    戻り値の i 番目は values[i:i+window] の最大（長さ n-window+1）
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    window = int(window)
+    if window <= 1 or n == 0:
+        return values.copy()
+    if window > n:
+        return np.zeros(0)
+    k = -(-n // window)
+    pad = np.full(k * window, np.nan)
+    pad[:n] = values
+    blocks = pad.reshape(k, window)
+    prefix = np.fmax.accumulate(blocks, axis=1).ravel()
+    suffix = np.fmax.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    i = np.arange(n - window + 1)
+    return np.fmax(suffix[i], prefix[i + window - 1])
+
+
+def rolling_offer_min(df, P_pcs, P_exp_max=None, window_hours=3, load_col=None, gen_col=None):
+    """
+    任意の時刻から window_hours 時間続けて保証できる供出可能量（移動最小）。全設定まとめて計算する。
+    戻り値: (settings, 窓の開始時刻 DatetimeIndex, ndarray[窓 × 設定])
+    """
+    settings = offer_settings(P_pcs, P_exp_max)
+    w = max(int(pd.Timedelta(hours=window_hours) / slot_of(df)), 1)
+    net = net_load(df, load_col, gen_col)
+    net_max = sliding_max(net, w)
+    return settings, df.index[:len(net_max)], _offer(net_max, settings)
@@ -0,0 +1,83 @@
+
+"""
+複数サイトのポートフォリオ実行。
+サイトごとの処理は batch_runner.run_site と同じで、サイト単位でプロセスプールに並列投入する。
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from batch_runner import RUNS, RUN_EXPORT_OFFER, run_site
+
+
+def _run_site_task(task):
+    name, df, params, runs = task
+    try:
+        frames, rows = run_site(df, params, runs)
+        return name, frames, [{"site": name, **r} for r in rows]
+    except Exception as e:
+        return name, {}, [{"site": name, "error": f"{type(e).__name__}: {e}"}]
+
+
+def aggregate_fleet(frames, summary):
+    """
+    サイト別の結果をフリート全体に集計する。
+    戻り値: (実行ごとの合計表, スロット別供出可能量[サイト列+合計], {実行: スロット別SOC%[サイト列+最小]})
+    """
+    offer = pd.DataFrame({name: f[RUN_EXPORT_OFFER]["offer_kW"] for name, f in frames.items() if RUN_EXPORT_OFFER in f})
+    if not offer.empty:
+        # 一部のサイトだけデータがあるコマも、ある分だけ合計する
+        offer["合計"] = offer.sum(axis=1, min_count=1)
+    soc = {}
+    for run in {r for f in frames.values() for r in f if r != RUN_EXPORT_OFFER}:
+        cols = {name: f[run]["SOC_%"] for name, f in frames.items() if run in f and not f[run].empty}
+        if cols:
+            soc[run] = pd.DataFrame(cols)
+            soc[run]["最小"] = soc[run].min(axis=1)
+
+    rows = []
+    ok = summary[summary["run"].notna()] if "run" in summary.columns else summary.iloc[0:0]
+    for run, g in ok.groupby("run", sort=False):
+        row = {"run": run, "sites": len(g)}
+        if run == RUN_EXPORT_OFFER:
+            total = offer["合計"] if "合計" in offer else pd.Series(dtype=float)
+            row.update({
+                "offer_kWh": float(g["offer_kWh"].sum()),
+                "fleet_offer_min_kW": float(total.min()) if total.notna().any() else np.nan,
+                "fleet_offer_min_at": str(total.idxmin()) if total.notna().any() else None,
+            })
+        else:
+            worst = g["min_soc_pct"].idxmin() if g["min_soc_pct"].notna().any() else None
+            row.update({
+                "total_charge_cost": float(g["total_charge_cost"].sum()),
+                "charge_kWh": float(g["charge_kWh"].sum()),
+                "worst_min_soc_pct": float(g.loc[worst, "min_soc_pct"]) if worst is not None else np.nan,
+                "worst_site": g.loc[worst, "site"] if worst is not None else None,
+            })
+        rows.append(row)
+    return pd.DataFrame(rows), offer, soc
+
+
+def run_portfolio(sites, params=None, site_params=None, runs=RUNS, max_workers=None):
+    """
+    sites: {サイト名: df}。params は全サイト共通、site_params={サイト名: {...}} で個別に上書き。
+    サイト数が多くても、実時間はコア数で決まる（max_workers=None で全コア、1 で逐次）。
+    戻り値: dict(summary, fleet, offer, soc, frames)
+    """
+    tasks = [(name, df, {**(params or {}), **(site_params or {}).get(name, {})}, list(runs))
+             for name, df in sites.items()]
+    workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        results = [_run_site_task(t) for t in tasks]
+    else:
+        # Streamlit のスレッドから fork しないよう spawn を使う（utils_sweep と同じ）
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+            results = list(ex.map(_run_site_task, tasks))
+    frames = {name: f for name, f, _ in results if f}
+    summary = pd.DataFrame([r for _, _, rows in results for r in rows])
+    fleet, offer, soc = aggregate_fleet(frames, summary)
+    return {"summary": summary, "fleet": fleet, "offer": offer, "soc": soc, "frames": frames}
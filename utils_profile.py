@@ -0,0 +1,224 @@
+
+"""
+任意で有効にする処理時間・メモリの計測（環境変数 TOSU_PROFILE=1 またはサイドバー）。
+無効のときはフラグを見るだけなので、計測用のラッパーを挟んだままでよい。
+
+1回の実行（画面全体の再実行、またはフラグメントだけの再実行）ごとに
+段階（関数呼び出し・図の描画・ダウンロード用データ作成）の時間を記録し、
+JSON 1行の構造化ログとしてロガー tosu.profile（既定は標準エラー）に出力する
+（TOSU_PROFILE_LOG を指定するとそのファイルへも追記）。
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+PROFILE_ENV = os.environ.get("TOSU_PROFILE", "").strip().lower()
+PROFILE_DEFAULT = PROFILE_ENV not in ("", "0", "false", "no")
+PROFILE_MEMORY_DEFAULT = PROFILE_ENV == "mem"
+PROFILE_LOG = os.environ.get("TOSU_PROFILE_LOG", "")
+
+logger = logging.getLogger("tosu.profile")
+_state = threading.local()
+_log_lock = threading.Lock()
+
+
+def _active():
+    return getattr(_state, "run", None)
+
+
+def begin_run(kind="full", tab=None, memory=False, session=None):
+    """計測を開始する（スクリプト実行の先頭、またはフラグメントの再実行時）"""
+    discard_run()
+    run = {"kind": kind, "tab": tab, "session": session, "memory": bool(memory),
+           "started": time.time(), "t0": time.perf_counter(), "stages": [], "stack": []}
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        run["own_tracemalloc"] = True
+    _state.run = run
+    return run
+
+
+def end_run():
+    """計測を終えて結果（dict）を返し、構造化ログに出す。計測中でなければ None"""
+    run = _active()
+    if run is None:
+        return None
+    _state.run = None
+    if run.pop("own_tracemalloc", False):
+        tracemalloc.stop()
+    record = {
+        "event": "rerun", "kind": run["kind"], "tab": run["tab"], "session": run["session"],
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(run["started"])),
+        "total_s": round(time.perf_counter() - run["t0"], 6),
+        "max_rss_mb": _max_rss_mb(),
+        "stages": run["stages"],
+    }
+    _emit(record)
+    return record
+
+
+def discard_run():
+    """記録を出さずに計測を終える（st.stop などで end_run まで届かなかった実行の後始末）"""
+    run = _active()
+    _state.run = None
+    if run is not None and run.pop("own_tracemalloc", False):
+        tracemalloc.stop()
+
+
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Linux は KB 単位
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _ensure_handler():
+    # 呼び出し側でロガーを設定していなければ、1行のJSONをそのまま標準エラーへ出す
+    # （未設定のままだと INFO は logging の既定のハンドラで捨てられる）
+    if logger.handlers:
+        return
+    with _log_lock:
+        if logger.handlers:
+            return
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        if logger.level == logging.NOTSET:
+            logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def _emit(record):
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    _ensure_handler()
+    logger.info(line)
+    if PROFILE_LOG:
+        with _log_lock, open(PROFILE_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def set_tab(tab):
+    run = _active()
+    if run is not None:
+        run["tab"] = tab
+
+
+@contextmanager
+def profile_stage(name):
+    """with profile_stage("名前"): の区間を記録する（計測中でなければ何もしない）"""
+    run = _active()
+    if run is None:
+        yield
+        return
+    stack = run["stack"]
+    mem = run["memory"] and tracemalloc.is_tracing()
+    frame = {"acc_peak": 0}
+    if mem:
+        cur0, peak = tracemalloc.get_traced_memory()
+        if stack:
+            # 外側の区間のピークを退避してから、この区間用にリセットする
+            stack[-1]["acc_peak"] = max(stack[-1]["acc_peak"], peak)
+        tracemalloc.reset_peak()
+    stack.append(frame)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t0
+        stack.pop()
+        rec = {"stage": name, "tab": run["tab"], "depth": len(stack), "seconds": round(seconds, 6)}
+        if mem:
+            cur1, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, frame["acc_peak"])
+            rec["mem_peak_mb"] = round((peak - cur0) / 2 ** 20, 3)
+            rec["mem_delta_mb"] = round((cur1 - cur0) / 2 ** 20, 3)
+            if stack:
+                stack[-1]["acc_peak"] = max(stack[-1]["acc_peak"], peak)
+        run["stages"].append(rec)
+
+
+def profiled(fn, name=None):
+    """関数を計測付きにする。第1引数が関数なら（cached_simulation など）その名前も付ける"""
+    label = name or fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _active() is None:
+            return fn(*args, **kwargs)
+        stage = label
+        if args and inspect.isfunction(args[0]):
+            stage = f"{label}:{args[0].__name__}"
+        with profile_stage(stage):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def instrument(namespace, modules, skip=()):
+    """namespace（モジュールの globals()）にある、modules で定義された関数を計測付きに置き換える"""
+    for key, obj in list(namespace.items()):
+        if inspect.isfunction(obj) and obj.__module__ in modules and key not in skip:
+            namespace[key] = profiled(obj)
+
+
+def configure_fragments(options):
+    """
+    フラグメントだけの再実行を計測するかを決める関数を登録する。
+    options() は計測しないとき None、計測するとき dict(memory, session, on_record) を返す。
+    """
+    global _fragment_options
+    _fragment_options = options
+
+
+def _fragment_options():
+    return None
+
+
+def profile_view(tab):
+    """
+    画面関数用のデコレータ（st.fragment の内側に付ける）。
+    画面全体の実行中ならその中の区間として、フラグメントだけの再実行なら1回の実行として記録する。
+    """
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _active() is not None:
+                set_tab(tab)
+                with profile_stage(f"view:{tab}"):
+                    return fn(*args, **kwargs)
+            opts = _fragment_options()
+            if not opts:
+                return fn(*args, **kwargs)
+            begin_run("fragment", tab=tab, memory=opts.get("memory"), session=opts.get("session"))
+            try:
+                with profile_stage(f"view:{tab}"):
+                    return fn(*args, **kwargs)
+            finally:
+                record = end_run()
+                if record is not None and opts.get("on_record"):
+                    opts["on_record"](record)
+        return wrapper
+    return deco
+
+
+def stages_frame(record):
+    """実行記録の区間を表にする（画面・区間ごとの回数と合計時間）"""
+    import pandas as pd
+    cols = ["tab", "stage", "calls", "seconds", "mem_peak_mb"]
+    stages = pd.DataFrame(record.get("stages") or [])
+    if stages.empty:
+        return pd.DataFrame(columns=cols)
+    if "mem_peak_mb" not in stages:
+        stages["mem_peak_mb"] = float("nan")
+    stages["tab"] = stages["tab"].fillna("共通")
+    out = (stages.groupby(["tab", "stage"], sort=False)
+           .agg(calls=("stage", "size"), seconds=("seconds", "sum"), mem_peak_mb=("mem_peak_mb", "max"))
+           .reset_index())
+    return out[cols]
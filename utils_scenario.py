@@ -0,0 +1,181 @@
+
+"""
+価格・需要のシナリオ分析。
+K本のシナリオ（過去の価格年を同じ月日・時刻に当てはめたもの、または需要・自家発を乱数で揺らしたもの）を
+基準期間の時刻・日レイアウト上の (K × 行) 配列に重ね、SOCと充電コスト（Tab8と同じ定義）をまとめて求める。
+"""
+import dataclasses
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from utils_timeseries import (
+    SOC_POLICIES, SocInputs, prepare_soc_inputs, day_price_order, run_soc_policy, charged_kwh_from_soc,
+    pick_load_series, pick_generation_series, time_grid
+)
+
+SCENARIO_METRICS = ["total_charge_cost", "charge_kWh", "min_soc_pct", "floor_hits", "floor_hit", "charge_slots"]
+
+
+@dataclass(frozen=True)
+class ScenarioSet:
+    """基準期間の時刻・日レイアウト（base）と、その上に重ねたシナリオの配列"""
+    names: tuple
+    base: SocInputs
+    net_load: np.ndarray     # (K × 行) max(L-G, 0) [kW]
+    price: np.ndarray        # (K × 行) [円/kWh]
+    price_order: np.ndarray  # (K × 日数 × 幅)
+
+    def __len__(self):
+        return len(self.names)
+
+    def inputs(self, k):
+        """k番目のシナリオの SocInputs（レイアウトは共通）"""
+        return dataclasses.replace(self.base, net_load=self.net_load[k], price=self.price[k],
+                                   price_order=self.price_order[k])
+
+
+def _stack(names, base, net_load, price):
+    net_load = np.ascontiguousarray(net_load, dtype=float)
+    price = np.ascontiguousarray(price, dtype=float)
+    return ScenarioSet(tuple(names), base, net_load, price, day_price_order(price, base.day_start))
+
+
+def _net_load_series(df, load_col, gen_col):
+    L = pick_load_series(df, preferred=load_col)
+    G = pick_generation_series(df, preferred=gen_col)
+    return (L - G).clip(lower=0.0)
+
+
+def scenario_years(df):
+    """データのある年（過去の価格年シナリオに使える候補）"""
+    return sorted(pd.unique(df.index.year).tolist())
+
+
+def historical_scenarios(df, start=None, end=None, years=None, vary=("price",), min_coverage=0.9,
+                         load_col=None, gen_col=None, price_col="JEPXスポットプライス"):
+    """
+    基準期間（start〜end）の各コマに、他の年の同じ月日・時刻の値を当てはめたシナリオ。先頭は基準期間そのもの。
+    vary: 入れ替える系列（"price" と "load"=L-G）。years: 使う年（None ならデータのある全ての年）。
+    当てはめた値の有効割合が min_coverage 未満の年は使わない。欠けたコマ（うるう日など）は基準の値で埋める。
+    """
+    base = prepare_soc_inputs(df, start, end, load_col=load_col, gen_col=gen_col, price_col=price_col)
+    if len(base) == 0:
+        raise ValueError("基準期間にデータがありません。")
+    sources = {}
+    if "price" in vary:
+        if price_col not in df.columns:
+            raise ValueError(f"価格列がありません: {price_col}")
+        sources["price"] = df[price_col].astype(float)
+    if "load" in vary:
+        sources["load"] = _net_load_series(df, load_col, gen_col)
+    if not sources:
+        raise ValueError("vary には 'price' か 'load' を指定してください。")
+
+    base_year = base.index[0].year
+    names, nets, prices = [f"基準（{base_year}年〜）"], [base.net_load], [base.price]
+    for year in (years if years is not None else scenario_years(df)):
+        offset = int(year) - base_year
+        if offset == 0:
+            continue
+        # 同じ月日・時刻（2/29 は 2/28 に寄る）
+        shifted = base.index + pd.DateOffset(years=offset)
+        values = {k: s.reindex(shifted).to_numpy(dtype=float) for k, s in sources.items()}
+        coverage = min(float(np.mean(~np.isnan(v))) for v in values.values())
+        if coverage < min_coverage:
+            continue
+        net = np.where(np.isnan(values["load"]), base.net_load, values["load"]) if "load" in values else base.net_load
+        price = np.where(np.isnan(values["price"]), base.price, values["price"]) if "price" in values else base.price
+        names.append(f"{year}年")
+        nets.append(net)
+        prices.append(price)
+    return _stack(names, base, np.vstack(nets), np.vstack(prices))
+
+
+def _lognormal(rng, sigma, shape):
+    # 平均1の対数正規の係数
+    if not sigma:
+        return np.ones(shape)
+    return np.exp(rng.normal(-0.5 * sigma ** 2, sigma, shape))
+
+
+def stochastic_scenarios(df, n_scenarios=50, seed=0, start=None, end=None,
+                         load_sigma=0.05, load_daily_sigma=0.05, gen_sigma=0.2, price_sigma=0.0,
+                         load_col=None, gen_col=None, price_col="JEPXスポットプライス"):
+    """
+    pick_load_series / pick_generation_series を乱数で揺らしたシナリオ（seed で再現できる）。
+    需要: 日ごとの係数（load_daily_sigma）× コマごとの係数（load_sigma）
+    自家発: 日ごとの係数（gen_sigma、天候の違い）、価格: コマごとの係数（price_sigma）。係数はいずれも平均1の対数正規。
+    """
+    base = prepare_soc_inputs(df, start, end, load_col=load_col, gen_col=gen_col, price_col=price_col)
+    if len(base) == 0:
+        raise ValueError("基準期間にデータがありません。")
+    a, b = time_grid(df).rows(start, end)
+    dfr = df.iloc[a:b]
+    L = pick_load_series(dfr, preferred=load_col).to_numpy(dtype=float)
+    G = pick_generation_series(dfr, preferred=gen_col).to_numpy(dtype=float)
+    K, n = int(n_scenarios), len(base)
+    n_days = int(base.day_num[-1]) + 1
+    rng = np.random.default_rng(seed)
+    day_L = _lognormal(rng, load_daily_sigma, (K, n_days))[:, base.day_num]
+    slot_L = _lognormal(rng, load_sigma, (K, n))
+    day_G = _lognormal(rng, gen_sigma, (K, n_days))[:, base.day_num]
+    net = np.clip(L * day_L * slot_L - G * day_G, 0.0, None)
+    price = base.price * _lognormal(rng, price_sigma, (K, n))
+    return _stack([f"乱数{k + 1}" for k in range(K)], base, net, price)
+
+
+def run_scenarios(scenarios, policy, P_pcs=1000.0, P_chg=1000.0, E_nom=2000.0,
+                  soc_init_pct=90.0, soc_floor_pct=10.0, reset_every_days=4, horizon_days=None, progress=None):
+    """
+    全シナリオのSOCと充電コスト。充電量・コスト・指標は (K × 行) でまとめて計算する。
+    SOCのカーネルはあえてシナリオごとの Python ループで回す（計算量はシナリオ数 × 1回分）。
+    SOCは時刻順の逐次計算でシナリオ方向にまとめても手数は減らず、numba なら1年分が1本数ms で済むため。
+    シナリオの区切りが進捗の報告と取り消しの単位にもなる。
+    progress: シナリオが終わるたびに済んだ割合で呼ぶ（例外を投げると止まる）
+    戻り値: dict(soc_kWh, charge_kWh, cost[K × 行], metrics[シナリオ別 DataFrame], summary[dict])
+    """
+    if policy not in SOC_POLICIES:
+        raise ValueError(f"未対応の充電ポリシーです: {policy}")
+    K, n = scenarios.net_load.shape
+    params = dict(P_pcs=P_pcs, P_chg=P_chg, E_nom=E_nom, soc_init_pct=soc_init_pct, soc_floor_pct=soc_floor_pct,
+                  reset_every_days=reset_every_days, horizon_days=horizon_days)
+    soc = np.empty((K, n))
+    charging = np.empty((K, n), dtype=bool)
+    for k in range(K):
+        res = run_soc_policy(scenarios.inputs(k), policy, **params)
+        soc[k] = res["SOC_kWh"]
+        charging[k] = res["charging"]
+        if progress is not None:
+            progress((k + 1) / K)
+
+    # derive_charge_cost_series と同じ定義（充電コマのSOC増分 × 価格、価格欠損のコマは0円）
+    charge = charged_kwh_from_soc(soc, charging)
+    cost = charge * scenarios.price
+    E_floor = float(soc_floor_pct) / 100.0 * E_nom
+    floor_hits = np.count_nonzero(soc <= E_floor + 1e-9, axis=1)
+    metrics = pd.DataFrame({
+        "scenario": scenarios.names,
+        "total_charge_cost": np.nansum(cost, axis=1),
+        "charge_kWh": charge.sum(axis=1),
+        "min_soc_pct": 100.0 * soc.min(axis=1) / E_nom,
+        "floor_hits": floor_hits,
+        "floor_hit": floor_hits > 0,
+        "charge_slots": np.count_nonzero(charging, axis=1),
+    })
+    return {"soc_kWh": soc, "charge_kWh": charge, "cost": cost, "metrics": metrics,
+            "summary": scenario_summary(metrics)}
+
+
+def scenario_summary(metrics, percentiles=(5, 50, 95)):
+    """コストの分布と下限SOC到達の確率（下限に1コマでも達したシナリオの割合）"""
+    cost = metrics["total_charge_cost"].to_numpy(dtype=float)
+    out = {"scenarios": len(metrics), "cost_mean": float(np.mean(cost)) if len(cost) else np.nan,
+           "cost_std": float(np.std(cost)) if len(cost) else np.nan}
+    for q in percentiles:
+        out[f"cost_p{q:g}"] = float(np.percentile(cost, q)) if len(cost) else np.nan
+    out["floor_hit_probability"] = float(metrics["floor_hit"].mean()) if len(metrics) else np.nan
+    out["floor_hits_mean"] = float(metrics["floor_hits"].mean()) if len(metrics) else np.nan
+    out["min_soc_pct_worst"] = float(metrics["min_soc_pct"].min()) if len(metrics) else np.nan
+    return out
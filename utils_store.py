@@ -0,0 +1,156 @@
+
+"""
+複数ワークブックの取り込み先となるローカル列指向ストア（追記のみ）。
+
+<store>/manifest.json          取り込み済みソースとパーティションの一覧
+<store>/<YYYY-MM>/part-*.parquet 月別パーティション（既存の期間は上書きしない）
+"""
+import json
+import os
+import time
+import uuid
+
+import pandas as pd
+
+from utils_timeseries import (
+    load_excel_to_df, frame_memo, time_grid, regularize_grid, compact_frame,
+    RESIDENT_COLUMNS, LOAD_COLUMN_CANDIDATES, GEN_COLUMN_CANDIDATES
+)
+from utils_cache import file_digest, cached_frame, content_hash
+
+STORE_DIR = os.environ.get("TOSU_STORE_DIR", os.path.join(os.getcwd(), "data_store"))
+MANIFEST = "manifest.json"
+STORE_VERSION = 1
+
+
+def _empty_manifest():
+    return {"version": STORE_VERSION, "sources": {}, "parts": []}
+
+
+def read_manifest(store_dir=STORE_DIR):
+    path = os.path.join(store_dir, MANIFEST)
+    if not os.path.exists(path):
+        return _empty_manifest()
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_manifest(store_dir, manifest):
+    path = os.path.join(store_dir, MANIFEST)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def _stored_index(store_dir, manifest):
+    # 既存パーティションの時刻列だけを読む（値の列は読まない）
+    idx = [pd.read_parquet(os.path.join(store_dir, p["file"]), columns=[]).index for p in manifest["parts"]]
+    return idx[0].append(idx[1:]) if idx else pd.DatetimeIndex([])
+
+
+def _iter_sheets(file, sheets):
+    if sheets == "*":
+        if hasattr(file, "seek"):
+            file.seek(0)
+        sheets = pd.ExcelFile(file).sheet_names
+    for sheet in (sheets or [None]):
+        if hasattr(file, "seek"):
+            file.seek(0)
+        yield sheet, load_excel_to_df(file, sheet)
+
+
+def ingest_workbooks(files, store_dir=STORE_DIR, sheets=None, names=None):
+    """
+    ワークブック（パス/アップロード）をストアへ追記する。
+    sheets: None=先頭シート、リスト=指定シート、"*"=全シート。
+    取り込み済み（内容ハッシュ・シートが同じ）のソースはスキップし、
+    既にストアにある開始日時の行は追加しない（先に取り込んだ値を優先）。
+    戻り値: ソースごとの追加行数の表
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = read_manifest(store_dir)
+    seen = _stored_index(store_dir, manifest)
+    frames = []
+    report = []
+    for i, file in enumerate(files):
+        name = names[i] if names else getattr(file, "name", str(file))
+        digest = file_digest(file)
+        for sheet, df in _iter_sheets(file, sheets):
+            source_id = f"{digest}:{sheet or ''}"
+            if source_id in manifest["sources"]:
+                report.append({"source": name, "sheet": sheet, "rows": len(df), "added": 0, "status": "取り込み済み"})
+                continue
+            # 補完した欠損スロットは保存しない（後から取り込むファイルで埋められるように）
+            df = df[~time_grid(df).missing]
+            new = df[~df.index.isin(seen)]
+            seen = seen.append(new.index)
+            frames.append(new)
+            manifest["sources"][source_id] = {"name": name, "sheet": sheet, "rows_added": len(new),
+                                              "ingested_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+            report.append({"source": name, "sheet": sheet, "rows": len(df), "added": len(new), "status": "追加"})
+
+    new_rows = pd.concat(frames).sort_index() if frames else pd.DataFrame()
+    if len(new_rows):
+        for month, part in new_rows.groupby(new_rows.index.strftime("%Y-%m")):
+            rel = os.path.join(month, f"part-{uuid.uuid4().hex[:12]}.parquet")
+            os.makedirs(os.path.join(store_dir, month), exist_ok=True)
+            part.to_parquet(os.path.join(store_dir, rel))
+            manifest["parts"].append({"file": rel, "start": str(part.index.min()), "end": str(part.index.max()),
+                                      "rows": len(part)})
+    # パーティションを書き終えてからマニフェストを更新する（途中で落ちても既存データは壊れない）
+    _write_manifest(store_dir, manifest)
+    return pd.DataFrame(report, columns=["source", "sheet", "rows", "added", "status"])
+
+
+def store_key(store_dir=STORE_DIR):
+    """ストアの版（パーティション一覧のハッシュ）。追記されると変わる。"""
+    return content_hash(store_dir, [p["file"] for p in read_manifest(store_dir)["parts"]])
+
+
+def open_store(store_dir=STORE_DIR, start=None, end=None, slot=None):
+    """
+    ストアを1つのDataFrameとして開く（時刻順）。start/end を指定すると該当パーティションだけ読む。
+    slot: コマの長さ（None なら開始日時の間隔から推定）
+    パーティションは取り込み時に compact_frame 済みなので、列の整理は以前の版のパーティションがあるときだけ行う。
+    Arrow から pandas へは列ごとに1回コピーし（Arrow側は変換しながら解放）、
+    取り込み時に除いた欠損スロットを補完するときは regularize_grid でもう1回コピーする。
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    parts = read_manifest(store_dir)["parts"]
+    if start is not None:
+        parts = [p for p in parts if pd.Timestamp(p["end"]) >= pd.Timestamp(start)]
+    if end is not None:
+        parts = [p for p in parts if pd.Timestamp(p["start"]) <= pd.Timestamp(end)]
+    if not parts:
+        return pd.DataFrame()
+    parts = sorted(parts, key=lambda p: p["start"])
+    tables = [pq.read_table(os.path.join(store_dir, p["file"]), memory_map=True) for p in parts]
+    # 以前の版で取り込んだパーティション（float64・kW列あり）とも混在できるよう型は広げて結合する
+    table = pa.concat_tables(tables, promote_options="permissive")
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index(kind="stable")
+    if _needs_compact(df):
+        df = compact_frame(df)
+    return regularize_grid(df, slot)
+
+
+def _needs_compact(df):
+    # 常駐しない列（kW列など）や空の需要/自家発の列があるか
+    if any(c not in RESIDENT_COLUMNS for c in df.columns):
+        return True
+    return any(df[c].isna().all() for c in df.columns if c in LOAD_COLUMN_CANDIDATES + GEN_COLUMN_CANDIDATES)
+
+
+def open_store_cached(store_dir=STORE_DIR, slot=None):
+    """open_store のキャッシュ版（ストアの版・コマの長さごと）。データセットキーも付与する。"""
+    slot_tag = "" if slot is None else f"@{int(pd.Timedelta(slot).total_seconds())}s"
+    key = ("store", store_key(store_dir), slot_tag)
+    df = cached_frame(key, lambda: open_store(store_dir, slot=slot))
+    frame_memo(df)["dataset_key"] = f"store:{key[1]}{slot_tag}"
+    # 取り込みで版が変わっても、同じストアなら SOC のチェックポイントを引き継げる
+    frame_memo(df)["dataset_lineage"] = f"store:{os.path.abspath(store_dir)}"
+    return df
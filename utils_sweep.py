@@ -0,0 +1,128 @@
+
+"""
+電池サイズのパラメータスイープ。
+入力配列（SocInputs）は1回だけ作り、各組合せをプロセスプールで並列実行する。
+"""
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from utils_timeseries import SOC_POLICIES, run_soc_policy, charged_kwh_from_soc
+
+SWEEP_PARAMS = ["E_nom", "P_chg", "P_pcs", "reset_every_days", "soc_floor_pct"]
+SWEEP_DEFAULTS = {"E_nom": 2000.0, "P_chg": 1000.0, "P_pcs": 1000.0, "reset_every_days": 4, "soc_floor_pct": 10.0}
+SWEEP_METRICS = ["total_charge_cost", "charge_kWh", "min_soc_pct", "floor_hits", "charge_slots"]
+
+
+def parse_grid_values(text, cast=float):
+    """
+    '1000, 2000, 3000' や '1000:4000:500'（開始:終了:刻み、終了を含む）を昇順の値リストにする。
+    cast=int のとき整数でない値（'7.5' や刻みで出る端数）は切り捨てずに ValueError にする。
+    """
+    vals = []
+    for part in str(text).replace("、", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if ":" in part:
+            lo, hi, step = (float(x) for x in part.split(":"))
+            if step <= 0:
+                raise ValueError(f"刻みは正の値で指定してください: {part}")
+            vals.extend(np.arange(lo, hi + step * 1e-9, step).tolist())
+        else:
+            vals.append(float(part))
+    out = set()
+    for v in vals:
+        c = cast(v)
+        if c != v:
+            raise ValueError(f"整数で指定してください: {v:g}")
+        out.add(c)
+    return sorted(out)
+
+
+def build_grid(**values):
+    """パラメータごとの値リストから全組合せ（dictのリスト）を作る"""
+    keys = [k for k in SWEEP_PARAMS if k in values]
+    return [dict(zip(keys, combo)) for combo in itertools.product(*(values[k] for k in keys))]
+
+
+def soc_metrics(inputs, res, E_nom, soc_floor_pct):
+    """1回のシミュレーション結果の要約（コストは Tab8 と同じ定義）"""
+    soc = res["SOC_kWh"]
+    if len(soc) == 0:
+        return {"total_charge_cost": 0.0, "charge_kWh": 0.0, "min_soc_pct": np.nan, "floor_hits": 0, "charge_slots": 0}
+    E_floor = float(soc_floor_pct) / 100.0 * E_nom
+    charge = charged_kwh_from_soc(soc, res["charging"])
+    return {
+        "total_charge_cost": float(np.nansum(charge * inputs.price)),
+        "charge_kWh": float(charge.sum()),
+        "min_soc_pct": float(100.0 * soc.min() / E_nom),
+        "floor_hits": int(np.count_nonzero(soc <= E_floor + 1e-9)),
+        "charge_slots": int(np.count_nonzero(res["charging"])),
+    }
+
+
+def _evaluate(inputs, policy, params, soc_init_pct):
+    res = run_soc_policy(inputs, policy, soc_init_pct=soc_init_pct, **params)
+    row = {"policy": policy, **params}
+    row.update(soc_metrics(inputs, res, params["E_nom"], params["soc_floor_pct"]))
+    return row
+
+
+# ワーカー側の入力配列（initializerで1回だけ受け取る）
+_WORKER_INPUTS = None
+
+
+def _init_worker(inputs):
+    global _WORKER_INPUTS
+    _WORKER_INPUTS = inputs
+
+
+def _run_tasks(tasks):
+    return [_evaluate(_WORKER_INPUTS, *task) for task in tasks]
+
+
+def run_battery_sweep(inputs, grid, policies=SOC_POLICIES, soc_init_pct=90.0, max_workers=None, progress=None):
+    """
+    grid の全組合せ × policies を実行し、1組合せ1行の DataFrame を返す。
+    max_workers=None で全コア、1 ならプロセスを使わず逐次実行。
+    progress: 組合せが終わるたびに済んだ割合で呼ぶ。例外を投げると残りの組合せを取り消して止まる
+    """
+    tasks = [(policy, {**SWEEP_DEFAULTS, **params}, soc_init_pct) for policy in policies for params in grid]
+    workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        rows = []
+        for t in tasks:
+            rows.append(_evaluate(inputs, *t))
+            if progress is not None:
+                progress(len(rows) / len(tasks))
+    else:
+        size = max(1, len(tasks) // (workers * 4))
+        chunks = [tasks[i:i + size] for i in range(0, len(tasks), size)]
+        # Streamlit のスレッドから fork しないよう spawn を使う
+        ctx = multiprocessing.get_context("spawn")
+        ex = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(inputs,))
+        try:
+            futures = [ex.submit(_run_tasks, c) for c in chunks]
+            finished = 0
+            for f in as_completed(futures):
+                finished += len(f.result())
+                if progress is not None:
+                    progress(finished / len(tasks))
+            rows = [row for f in futures for row in f.result()]
+        finally:
+            # 取り消し・エラーのときは待ち中の組合せを実行しない
+            ex.shutdown(wait=True, cancel_futures=True)
+    return pd.DataFrame(rows, columns=["policy"] + SWEEP_PARAMS + SWEEP_METRICS)
+
+
+def sweep_pivot(result, x, y, metric, fixed=None):
+    """ヒートマップ用に (y × x) へ整形。fixed={列: 値} で他のパラメータを固定する"""
+    sel = result
+    for k, v in (fixed or {}).items():
+        sel = sel[sel[k] == v]
+    return sel.pivot_table(index=y, columns=x, values=metric, aggfunc="mean").sort_index(ascending=False)
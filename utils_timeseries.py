@@ -1,22 +1,83 @@
 
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import rcParams
 
-try:
-    rcParams["font.family"] = "Noto Sans CJK JP"
-except Exception:
-    pass
+from utils_kernels import periodic_reset_soc, price_optimized_soc, horizon_scheduled_soc
+
+
+def setup_matplotlib():
+    """matplotlib を読み込んで日本語フォントを設定する（描画する側だけが呼ぶ。バッチ実行では読み込まない）"""
+    import matplotlib.pyplot as plt
+    from matplotlib import rcParams
+    try:
+        rcParams["font.family"] = "Noto Sans CJK JP"
+    except Exception:
+        pass
+    return plt
 
 REQUIRED_COLUMNS_MIN = ["開始日時", "使用電力量(ロス後)", "使用電力量(ロス前)"]
 OPTIONAL_COLUMNS = ["JEPXスポットプライス"]
-
-def load_excel_to_df(file, sheet_name=None):
-    if sheet_name is None or len(str(sheet_name).strip()) == 0:
-        xls = pd.ExcelFile(file)
-        sheet_name = xls.sheet_names[0]
-    df = pd.read_excel(file, sheet_name=sheet_name)
+LOAD_COLUMN_CANDIDATES = ["需要計画量(ロス前)", "需要計画量", "需要kW"]
+GEN_COLUMN_CANDIDATES = ["自家発出力", "PV出力", "太陽光出力", "発電kW"]
+# 読み込む列（これ以外の列は読まない）
+PROJECTED_COLUMNS = (REQUIRED_COLUMNS_MIN + ["終了日時"] + OPTIONAL_COLUMNS
+                     + LOAD_COLUMN_CANDIDATES + GEN_COLUMN_CANDIDATES)
+# 読み込み後に常駐させる列（終了日時は空行の判定にだけ使う）
+RESIDENT_COLUMNS = REQUIRED_COLUMNS_MIN[1:] + OPTIONAL_COLUMNS + LOAD_COLUMN_CANDIDATES + GEN_COLUMN_CANDIDATES
+# kW列は持たず、kWh列から必要な範囲だけ作る（kWh ÷ コマの時間）
+KW_COLUMNS = {"使用電力量(ロス後)_kW": "使用電力量(ロス後)", "使用電力量(ロス前)_kW": "使用電力量(ロス前)"}
+EXCEL_ENGINES = ["auto", "calamine", "openpyxl"]
+
+
+def _has_calamine():
+    try:
+        import python_calamine  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _read_calamine(file, sheet_name, columns):
+    wanted = set(columns)
+    return pd.read_excel(file, sheet_name=sheet_name if sheet_name else 0, engine="calamine",
+                         usecols=lambda c: c in wanted)
+
+
+def _read_openpyxl(file, sheet_name, columns):
+    # read-only でブックを1回だけ開き、必要な列だけ行ストリームから取り出す
+    from openpyxl import load_workbook
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name] if sheet_name else wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, ())
+        keep = [(i, h) for i, h in enumerate(header) if h in columns]
+        if not keep:
+            return pd.DataFrame()
+        pos = [i for i, _ in keep]
+        width = pos[-1] + 1
+        data = [[] for _ in keep]
+        for row in rows:
+            if len(row) < width:
+                row = tuple(row) + (None,) * (width - len(row))
+            for buf, i in zip(data, pos):
+                buf.append(row[i])
+    finally:
+        wb.close()
+    # 末尾の空行は落とす（read_excel と同じ）
+    n = len(data[0])
+    while n and all(buf[n - 1] is None for buf in data):
+        n -= 1
+    return pd.DataFrame({h: buf[:n] for (_, h), buf in zip(keep, data)})
+
+
+def _finalize_frame(df, slot=None):
     if "終了日時" in df.columns:
         df = df[df["終了日時"].notna()].copy()
     for c in REQUIRED_COLUMNS_MIN:
@@ -26,42 +87,216 @@ def load_excel_to_df(file, sheet_name=None):
         if c not in df.columns:
             df[c] = pd.NA
     df["開始日時"] = pd.to_datetime(df["開始日時"], errors="coerce")
-    df = df.dropna(subset=["開始日時"]).copy()
-    df = df.set_index("開始日時").sort_index()
-    # kW列
-    df["使用電力量(ロス後)_kW"] = df["使用電力量(ロス後)"] / 0.5
-    df["使用電力量(ロス前)_kW"] = df["使用電力量(ロス前)"] / 0.5
+    if "終了日時" in df.columns:
+        df["終了日時"] = pd.to_datetime(df["終了日時"], errors="coerce")
+    df = df.dropna(subset=["開始日時"])
+    df = df.set_index("開始日時").sort_index(kind="stable")
+    return regularize_grid(compact_frame(df), slot)
+
+
+def _compact_values(values):
+    # float32 に戻しても全ての値が完全に一致する列だけ float32（丸め誤差を結果や書き出しに持ち込まない）
+    v32 = values.astype(np.float32)
+    same = (v32.astype(np.float64) == values) | np.isnan(values)
+    if same.all():
+        return v32
+    return values
+
+
+def compact_frame(df):
+    """
+    常駐用に小さくしたdf（同じインデックス）。RESIDENT_COLUMNS 以外の列と、
+    全て空の需要/自家発の候補列は持たない。数値列は float32 で値が変わらないときだけ float32。
+    """
+    data = {}
+    for c in RESIDENT_COLUMNS:
+        if c not in df.columns:
+            continue
+        values = pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+        if c in LOAD_COLUMN_CANDIDATES + GEN_COLUMN_CANDIDATES and np.isnan(values).all():
+            continue
+        data[c] = _compact_values(values)
+    out = pd.DataFrame(data, index=df.index)
+    out.attrs = dict(df.attrs)
+    return out
+
+
+def kw_series(df, col):
+    """kWh列（またはそのkW列名）の平均出力[kW]。float64で、必要な行だけ計算する"""
+    base = KW_COLUMNS.get(col, col)
+    return pd.Series(df[base].to_numpy(dtype=np.float64, na_value=np.nan) / slot_hours(df), index=df.index, name=col)
+
+
+SLOT = pd.Timedelta(minutes=30)   # 精算コマ（時刻から推定できないときの既定）
+SLOTS_PER_DAY = 48
+SLOT_MINUTES = [1, 5, 15, 30]     # 画面で選べるコマの長さ（分）
+VALUE_COLUMNS = ["使用電力量(ロス後)", "使用電力量(ロス前)"]
+
+
+def infer_slot(index, default=SLOT):
+    """
+    インデックスの時刻間隔（間隔の中央値。欠損・重複があっても大半のコマが同じ長さなら求まる）。
+    1日を割り切れない間隔や行が足りないときは default。
+    """
+    if len(index) < 2:
+        return pd.Timedelta(default)
+    d = np.diff(index.asi8)
+    d = d[d > 0]
+    if not len(d):
+        return pd.Timedelta(default)
+    step = pd.Timedelta(int(np.median(d)), unit="ns")
+    if step > pd.Timedelta(days=1) or pd.Timedelta(days=1) % step:
+        return pd.Timedelta(default)
+    return step
+
+
+def slot_of(df):
+    """dfのコマの長さ。読み込み時に attrs["slot_seconds"] に記録したもの、無ければ時刻から推定（dfごとに1回）"""
+    sec = df.attrs.get("slot_seconds")
+    if sec:
+        return pd.Timedelta(seconds=sec)
+    memo = frame_memo(df)
+    if "slot" not in memo:
+        memo["slot"] = infer_slot(df.index)
+    return memo["slot"]
+
+
+def slot_hours(df):
+    """コマの時間 [h]（kWh と kW の換算に使う）"""
+    return slot_of(df) / pd.Timedelta(hours=1)
+
+
+def slots_per_day(df):
+    return int(pd.Timedelta(days=1) // slot_of(df))
+
+
+def regularize_grid(df, slot=None):
+    """
+    時刻順のdfをコマ（slot、None なら時刻から推定）刻みの連続した格子にそろえる。
+    重複した開始日時は先頭行を残し、欠けたスロットは値がNaNの行で補う。
+    コマの境界に乗らない時刻があるときは補完しない（格子にできないため）。
+    結果は df.attrs["grid_report"]、コマの長さは df.attrs["slot_seconds"] に残す。
+    """
+    n_rows = len(df)
+    dup = df.index.duplicated(keep="first")
+    if dup.any():
+        df = df[~dup]
+    idx = df.index
+    slot = infer_slot(idx) if slot is None else pd.Timedelta(slot)
+    off_grid = int(np.count_nonzero((idx - idx.normalize()) % slot != pd.Timedelta(0))) if len(idx) else 0
+    n_missing = 0
+    if len(idx) and not off_grid:
+        full = pd.date_range(idx[0], idx[-1], freq=slot)
+        n_missing = len(full) - len(idx)
+        if n_missing:
+            df = df.reindex(full)
+            df.index.name = idx.name
+    df.attrs["grid_report"] = {
+        "rows": n_rows,
+        "duplicates": int(dup.sum()),
+        "missing_slots": int(n_missing),
+        "off_grid": off_grid,
+        "slot_minutes": slot / pd.Timedelta(minutes=1),
+    }
+    # Parquetのキャッシュに attrs ごと保存されるよう、JSONにできる値で持つ
+    df.attrs["slot_seconds"] = int(slot.total_seconds())
     return df
 
+
+# 集計のしかた：kWh（コマごとの量）は合計、それ以外（kW・価格）は平均
+_SUM_COLUMNS = set(VALUE_COLUMNS)
+
+
+def resample_to_slot(df, slot=SLOT, min_coverage=1.0):
+    """
+    細かいコマ（1分・5分・15分など）のdfを slot（既定は30分の精算コマ、0:00起点）に集計する。
+    使用電力量(kWh)は合計、需要・自家発(kW)と価格は平均。コマ内の有効な値が min_coverage 未満のコマは NaN
+    （欠けたままの合計を量として扱わないため。1未満にすると有効な値の平均 × コマ数で補う）。
+    時刻順のdfを行の位置で区切って集計するので、1分値でも groupby より速い。
+    """
+    src = slot_of(df)
+    slot = pd.Timedelta(slot)
+    if slot == src:
+        return df
+    if slot < src or slot % src:
+        raise ValueError(f"{src} のデータを {slot} のコマに集計できません（コマの長さの整数倍を指定してください）。")
+    if not df.index.is_monotonic_increasing:
+        raise ValueError("インデックスが時刻順ではありません。")
+    per = int(slot // src)
+    need = max(int(np.ceil(float(min_coverage) * per - 1e-9)), 1)
+    bucket = df.index.floor(slot)
+    keys = bucket.asi8
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+    data = {}
+    for c in df.columns:
+        v = df[c].to_numpy(dtype=np.float64, na_value=np.nan)
+        if not len(starts):
+            data[c] = v
+            continue
+        ok = ~np.isnan(v)
+        cnt = np.add.reduceat(ok.astype(np.int64), starts)
+        tot = np.add.reduceat(np.where(ok, v, 0.0), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = tot / cnt
+        data[c] = np.where(cnt >= need, mean * per if c in _SUM_COLUMNS else mean, np.nan)
+    out = pd.DataFrame(data, index=bucket[starts])
+    out.index.name = df.index.name
+    return regularize_grid(compact_frame(out), slot)
+
+
+def grid_report(df):
+    """読み込み時の格子チェック結果（regularize_grid を通っていないdfは空dict）"""
+    return dict(df.attrs.get("grid_report", {}))
+
+
+def load_excel_to_df(file, sheet_name=None, engine="auto", slot=None):
+    """
+    Excelを読み込み、開始日時をインデックスにしたDataFrameを返す（PROJECTED_COLUMNS の列のみ）。
+    engine: "calamine"（python-calamine が必要）/ "openpyxl"（read-onlyのストリーム読み）/ "auto"
+    slot: コマの長さ（None なら開始日時の間隔から推定）
+    """
+    if engine not in EXCEL_ENGINES:
+        raise ValueError(f"engine には {EXCEL_ENGINES} のいずれかを指定してください。")
+    if engine == "auto":
+        engine = "calamine" if _has_calamine() else "openpyxl"
+    sheet_name = str(sheet_name).strip() if sheet_name is not None else ""
+    reader = _read_calamine if engine == "calamine" else _read_openpyxl
+    return _finalize_frame(reader(file, sheet_name, PROJECTED_COLUMNS), slot)
+
+def _as_index_time(index, t):
+    t = pd.Timestamp(t)
+    if index.tz is not None and t.tzinfo is None:
+        t = t.tz_localize(index.tz)
+    return t
+
+def row_bounds(index, start=None, end=None, end_inclusive=True):
+    """[start, end] に入る行の位置範囲 (a, b)。時刻順のインデックスなら二分探索。"""
+    if not index.is_monotonic_increasing:
+        raise ValueError("インデックスが時刻順ではありません。")
+    a = index.searchsorted(_as_index_time(index, start), side="left") if start is not None else 0
+    b = (index.searchsorted(_as_index_time(index, end), side="right" if end_inclusive else "left")
+         if end is not None else len(index))
+    return int(a), int(max(a, b))
+
 def select_range(df, start=None, end=None):
-    tz = df.index.tz
     s = pd.to_datetime(start) if start else None
     e = pd.to_datetime(end) if end else None
-    if tz is not None:
-        if s is not None and s.tzinfo is None:
-            s = s.tz_localize(tz)
-        if e is not None and e.tzinfo is None:
-            e = e.tz_localize(tz)
-    if s is not None:
-        df = df.loc[df.index >= s]
-    if e is not None:
-        df = df.loc[df.index <= e]
-    return df
+    if not df.index.is_monotonic_increasing:
+        # 時刻順でないdf（外部から渡されたもの）は従来どおりマスクで絞る
+        if s is not None:
+            df = df.loc[df.index >= _as_index_time(df.index, s)]
+        if e is not None:
+            df = df.loc[df.index <= _as_index_time(df.index, e)]
+        return df
+    a, b = row_bounds(df.index, s, e)
+    return df.iloc[a:b]
 
 def series_picker(df, series="both", use_kw=True):
+    cols = {"ロス後": "使用電力量(ロス後)", "ロス前": "使用電力量(ロス前)"}
+    names = [series] if series in cols else ["ロス後", "ロス前"]
     if use_kw:
-        cols = {"ロス後": "使用電力量(ロス後)_kW", "ロス前": "使用電力量(ロス前)_kW"}
-    else:
-        cols = {"ロス後": "使用電力量(ロス後)", "ロス前": "使用電力量(ロス前)"}
-    if series == "ロス後":
-        out = df[[cols["ロス後"]]].rename(columns={cols["ロス後"]: "ロス後"})
-    elif series == "ロス前":
-        out = df[[cols["ロス前"]]].rename(columns={cols["ロス前"]: "ロス前"})
-    else:
-        out = df[[cols["ロス後"], cols["ロス前"]]].rename(
-            columns={cols["ロス後"]: "ロス後", cols["ロス前"]: "ロス前"}
-        )
-    return out
+        return pd.DataFrame({n: kw_series(df, cols[n]) for n in names}, index=df.index)
+    return df[[cols[n] for n in names]].rename(columns={cols[n]: n for n in names})
 
 def aggregate_df(df, aggregate=None, how="mean"):
     if aggregate is None:
@@ -82,69 +317,188 @@ def list_dates(df):
     return catalog.sort_values("date")
 
 def get_day_slice(df, date_val):
-    tz = df.index.tz
-    start = pd.Timestamp(date_val)
-    if tz is not None and start.tzinfo is None:
-        start = start.tz_localize(tz)
-    end = start + pd.Timedelta(days=1)
-    return df.loc[(df.index >= start) & (df.index < end)].copy()
+    grid = time_grid(df)
+    a, b = grid.day_rows(date_val)
+    return df.iloc[a:b].copy()
+
+def _minmax_positions(y, n_buckets):
+    # 等分割した各バケツの最小・最大位置（全NaNのバケツは先頭のNaNを残して線を切る）
+    n = len(y)
+    width = -(-n // n_buckets)
+    pad = np.full(n_buckets * width, np.nan)
+    pad[:n] = y
+    pad = pad.reshape(n_buckets, width)
+    base = np.arange(n_buckets) * width
+    lo = base + np.argmin(np.where(np.isnan(pad), np.inf, pad), axis=1)
+    hi = base + np.argmax(np.where(np.isnan(pad), -np.inf, pad), axis=1)
+    pos = np.unique(np.concatenate([[0, n - 1], lo, hi]))
+    return pos[pos < n]
+
+def _lttb_positions(x, y, n_out):
+    # Largest-Triangle-Three-Buckets（NaNは除外）
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= n_out:
+        return valid
+    x, y = x[valid], y[valid]
+    n = len(y)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        s, e = edges[i], max(edges[i + 1], edges[i] + 1)
+        ns, ne = e, (edges[i + 2] if i + 2 < len(edges) else n)
+        cx, cy = x[ns:max(ne, ns + 1)].mean(), y[ns:max(ne, ns + 1)].mean()
+        area = np.abs((x[a] - cx) * (y[s:e] - y[a]) - (x[a] - x[s:e]) * (cy - y[a]))
+        a = s + int(np.argmax(area))
+        out[i + 1] = a
+    return valid[out]
+
+def downsample_for_plot(data, n_px=1200, method="minmax"):
+    """
+    プロット用の間引き（列ごと）。戻り値: {列名: Series}
+    n_px は描画幅[px]。点数が 2×n_px 以下、または method=None なら間引かない。
+    minmax: 画素ごとの最小・最大を残す（ピークを落とさない）／lttb: 形状優先
+    """
+    frame = data.to_frame() if isinstance(data, pd.Series) else data
+    out = {}
+    for col in frame.columns:
+        ser = frame[col]
+        if method is None or len(ser) <= 2 * n_px:
+            out[col] = ser
+            continue
+        y = ser.to_numpy(dtype=float, na_value=np.nan)
+        if method == "minmax":
+            pos = _minmax_positions(y, int(n_px))
+        elif method == "lttb":
+            pos = _lttb_positions(ser.index.asi8.astype(float), y, 2 * int(n_px))
+        else:
+            raise ValueError("method には None / 'minmax' / 'lttb' を指定してください。")
+        out[col] = ser.iloc[pos]
+    return out
+
+# DataFrame単位のメモ（id -> dict）。dfが破棄されたら自動で消える。
+# 読み込み後のdfは読み取り専用として扱う前提。
+_FRAME_MEMO = {}
+
+def frame_memo(df):
+    key = id(df)
+    memo = _FRAME_MEMO.get(key)
+    if memo is None:
+        memo = {}
+        _FRAME_MEMO[key] = memo
+        weakref.finalize(df, _FRAME_MEMO.pop, key, None)
+    return memo
+
+@dataclass(frozen=True)
+class TimeGrid:
+    """時刻順dfの日単位レイアウト。範囲・日の検索を行オフセットで行う（dfごとに1回だけ作る）。"""
+    index: pd.DatetimeIndex
+    days: pd.DatetimeIndex   # データのある日（インデックスのタイムゾーンの0:00）
+    day_offsets: np.ndarray  # 各日の先頭行（末尾に総行数）
+    day_code: np.ndarray     # 各行が days の何番目か
+    midnight: np.ndarray     # 0:00 の行か
+    missing: np.ndarray      # 値の無い行（補完したスロットを含む）
+
+    def rows(self, start=None, end=None):
+        return row_bounds(self.index, start, end)
+
+    def day_rows(self, date_val):
+        """date_val の日の行範囲 (a, b)。データの無い日は空範囲。"""
+        day = _as_index_time(self.index, date_val).normalize()
+        i = self.days.searchsorted(day)
+        if i < len(self.days) and self.days[i] == day:
+            return int(self.day_offsets[i]), int(self.day_offsets[i + 1])
+        a = int(self.day_offsets[i])
+        return a, a
+
+def time_grid(df):
+    memo = frame_memo(df)
+    grid = memo.get("time_grid")
+    if grid is None:
+        idx = df.index
+        if not idx.is_monotonic_increasing:
+            raise ValueError("インデックスが時刻順ではありません。")
+        norm = idx.normalize()
+        codes, days = pd.factorize(norm, sort=True)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(days)))]).astype(np.int64)
+        cols = [c for c in VALUE_COLUMNS if c in df.columns]
+        missing = df[cols].isna().all(axis=1).to_numpy() if cols else np.zeros(len(df), dtype=bool)
+        grid = memo["time_grid"] = TimeGrid(
+            idx, pd.DatetimeIndex(days), offsets, codes.astype(np.int64), np.asarray(idx == norm), missing
+        )
+    return grid
+
+def day_slot_matrix(df, col):
+    """
+    列colを (日数 × 1日のコマ数) の行列に並べ替える（dfごとにキャッシュ。30分なら48列）。
+    戻り値: (日付 DatetimeIndex, ndarray[float64])。欠損スロットはNaN。
+    """
+    memo = frame_memo(df)
+    key = ("day_slot_matrix", col)
+    if key in memo:
+        return memo[key]
+    if col in KW_COLUMNS and col not in df.columns:
+        # kW列は持っていないので、kWh列の行列から作る
+        days, mat = day_slot_matrix(df, KW_COLUMNS[col])
+        mat = mat / slot_hours(df)
+        mat.flags.writeable = False
+        memo[key] = (days, mat)
+        return memo[key]
+    idx = df.index.tz_convert("Asia/Tokyo") if df.index.tz is not None else df.index
+    day_norm = idx.normalize()
+    codes, days = pd.factorize(day_norm, sort=True)
+    width = slots_per_day(df)
+    slots = np.asarray((idx - day_norm) // slot_of(df), dtype=np.int64)
+    mat = np.full((len(days), width), np.nan)
+    if col in df.columns and len(days) > 0:
+        vals = df[col].to_numpy(dtype=float, na_value=np.nan)
+        ok = (slots >= 0) & (slots < width)
+        mat[codes[ok], slots[ok]] = vals[ok]
+    mat.flags.writeable = False
+    memo[key] = (pd.DatetimeIndex(days), mat)
+    return memo[key]
+
+def _overlay_from_matrix(df, col, dates=None):
+    days, mat = day_slot_matrix(df, col)
+    if dates is None:
+        rows = np.arange(len(days))
+    else:
+        want = pd.DatetimeIndex(pd.to_datetime(pd.Series(list(dates), dtype=object), errors="coerce").dropna().unique())
+        want = want.normalize()
+        if days.tz is not None and want.tz is None:
+            want = want.tz_localize(days.tz)
+        rows = days.get_indexer(want)
+        rows = rows[rows >= 0]
+    labels = days[rows].strftime("%Y-%m-%d")
+    return pd.DataFrame(mat[rows].T.copy(), index=range(mat.shape[1]), columns=labels)
 
 def overlay_by_dates(df, dates, which="ロス後"):
-    mat = pd.DataFrame(index=range(48))
-    for d in dates:
-        day = get_day_slice(df, d)
-        if day.empty:
-            continue
-        idx_local = day.index.tz_convert("Asia/Tokyo") if day.index.tz is not None else day.index
-        slots = ((idx_local - idx_local.normalize()) / pd.Timedelta(minutes=30)).astype(int)
-        ser = day[f"使用電力量({which})_kW"]
-        ser = pd.Series(ser.values, index=slots).reindex(range(48))
-        mat[str(pd.to_datetime(d).date())] = ser.values
-    return mat
+    return _overlay_from_matrix(df, f"使用電力量({which})_kW", dates)
 
 def overlay_by_dates_price(df, dates):
-    mat = pd.DataFrame(index=range(48))
-    for d in dates:
-        day = get_day_slice(df, d)
-        if day.empty or "JEPXスポットプライス" not in day.columns:
-            continue
-        idx_local = day.index.tz_convert("Asia/Tokyo") if day.index.tz is not None else day.index
-        slots = ((idx_local - idx_local.normalize()) / pd.Timedelta(minutes=30)).astype(int)
-        ser = day["JEPXスポットプライス"]
-        ser = pd.Series(ser.values, index=slots).reindex(range(48))
-        mat[str(pd.to_datetime(d).date())] = ser.values
-    return mat
+    if "JEPXスポットプライス" not in df.columns:
+        return pd.DataFrame(index=range(slots_per_day(df)))
+    return _overlay_from_matrix(df, "JEPXスポットプライス", dates)
 
 def overlay_price_full_year(df):
-    """1年分の各日（JEPX価格）を0..47スロットに並べた行列"""
-    mat = pd.DataFrame(index=range(48))
-    if df.index.tz is not None:
-        uniq_days = pd.to_datetime(df.index.tz_convert("Asia/Tokyo").date).unique()
-    else:
-        uniq_days = pd.to_datetime(df.index.date).unique()
-    for d in uniq_days:
-        day = get_day_slice(df, d)
-        if day.empty or "JEPXスポットプライス" not in day.columns:
-            continue
-        idx_local = day.index.tz_convert("Asia/Tokyo") if day.index.tz is not None else day.index
-        slots = ((idx_local - idx_local.normalize()) / pd.Timedelta(minutes=30)).astype(int)
-        ser = day["JEPXスポットプライス"]
-        ser = pd.Series(ser.values, index=slots).reindex(range(48))
-        mat[str(pd.to_datetime(d).date())] = ser.values
-    return mat
+    """1年分の各日（JEPX価格）を 0..(1日のコマ数-1) のスロットに並べた行列"""
+    if "JEPXスポットプライス" not in df.columns:
+        return pd.DataFrame(index=range(slots_per_day(df)))
+    return _overlay_from_matrix(df, "JEPXスポットプライス")
 
 def pick_load_series(df, preferred=None):
     if preferred and preferred in df.columns:
         return df[preferred].astype(float)
-    for c in ["需要計画量(ロス前)", "需要計画量", "需要kW"]:
+    for c in LOAD_COLUMN_CANDIDATES:
         if c in df.columns and df[c].notna().any():
             return df[c].astype(float)
-    return (df["使用電力量(ロス後)"].astype(float) / 0.5)
+    return kw_series(df, "使用電力量(ロス後)")
 
 def pick_generation_series(df, preferred=None):
     if preferred and preferred in df.columns:
         return df[preferred].astype(float)
-    for c in ["自家発出力", "PV出力", "太陽光出力", "発電kW"]:
+    for c in GEN_COLUMN_CANDIDATES:
         if c in df.columns and df[c].notna().any():
             return df[c].astype(float)
     return pd.Series(0.0, index=df.index)
@@ -157,70 +511,314 @@ def compute_export_offer_def1(df, P_pcs=1000.0, P_exp_max=None, load_col=None, g
         offer = offer.clip(upper=float(P_exp_max))
     return offer, L, G
 
-def simulate_soc_with_charge_periodic_reset(
-    df, P_pcs=1000.0, P_chg=1000.0, E_nom=2000.0,
-    start=None, end=None,
-    soc_init_pct=90.0, soc_floor_pct=10.0, reset_every_days=4,
-    load_col=None, gen_col=None
-):
-    # 期間トリム
-    if start is not None:
-        start = pd.Timestamp(start)
-        if df.index.tz is not None and start.tzinfo is None:
-            start = start.tz_localize(df.index.tz)
-        df = df.loc[df.index >= start]
-    if end is not None:
-        end = pd.Timestamp(end)
-        if df.index.tz is not None and end.tzinfo is None:
-            end = end.tz_localize(df.index.tz)
-        df = df.loc[df.index <= end]
-
+POLICY_PERIODIC = "periodic_reset"      # 0:00から連続充電（従来）
+POLICY_PRICE_OPT = "price_optimized"    # 当日最安コマ優先（同時供出）
+POLICY_HORIZON = "horizon"              # 計画区間（複数日）内の最安コマ優先
+SOC_POLICIES = (POLICY_PERIODIC, POLICY_PRICE_OPT, POLICY_HORIZON)
+
+@dataclass(frozen=True)
+class SocInputs:
+    """SOCシミュレーションの入力（期間トリム・列選択済み）。電池パラメータに依存しない部分のみ。"""
+    index: pd.DatetimeIndex
+    net_load: np.ndarray     # max(L-G, 0) [kW]
+    price: np.ndarray        # [円/kWh]（価格列が無ければ0）
+    day_num: np.ndarray      # 先頭日からの経過日数（行ごと）
+    midnight: np.ndarray     # 0:00 のスロットか（行ごと）
+    day_start: np.ndarray    # データのある各日の先頭行（末尾に総行数）
+    price_order: np.ndarray  # (日数 × 幅) 日内の価格昇順位置（安定ソート、NaNは最後）
+    first_day: int = 0       # 先頭の日が元の期間の何日目か（from_day で切り出したとき）
+    slot_h: float = 0.5      # コマの時間 [h]
+
+    def __len__(self):
+        return len(self.index)
+
+    def from_day(self, d):
+        """d日目（day_start の位置）以降の入力。日数・充電日の数え方は元の期間のまま"""
+        return self.day_range(d)
+
+    def day_range(self, d0, d1=None):
+        """d0日目から d1日目の前までの入力（d1=None なら最後まで）"""
+        d1 = len(self.day_start) - 1 if d1 is None else d1
+        r0, r1 = int(self.day_start[d0]), int(self.day_start[d1])
+        return SocInputs(self.index[r0:r1], self.net_load[r0:r1], self.price[r0:r1], self.day_num[r0:r1],
+                         self.midnight[r0:r1], self.day_start[d0:d1 + 1] - r0, self.price_order[d0:d1],
+                         self.first_day + d0, self.slot_h)
+
+def prepare_soc_inputs(df, start=None, end=None, load_col=None, gen_col=None, price_col="JEPXスポットプライス"):
+    """列の選択・期間トリム・日単位レイアウトを1回だけ行う（スイープ等で使い回す）"""
+    grid = time_grid(df)
+    slot_h = slot_hours(df)
+    a, b = grid.rows(start, end)
+    df = df.iloc[a:b]
+    idx = df.index
     L = pick_load_series(df, preferred=load_col)
     G = pick_generation_series(df, preferred=gen_col)
-    net_load = (L - G).clip(lower=0.0)
-    supply_kW = net_load.clip(upper=P_pcs)
-    use_kWh = (supply_kW * 0.5).fillna(0.0)
-
+    net_load = (L - G).clip(lower=0.0).to_numpy(dtype=float)
+    if price_col in df.columns:
+        price = df[price_col].to_numpy(dtype=float, na_value=np.nan)
+    else:
+        price = np.zeros(len(df))
+    if len(df) == 0:
+        empty_i = np.zeros(0, dtype=np.int64)
+        return SocInputs(idx, net_load, price, empty_i, np.zeros(0, dtype=bool),
+                         np.zeros(1, dtype=np.int64), np.zeros((0, 0), dtype=np.int64), slot_h=slot_h)
+
+    # 日ごとの行範囲は格子のオフセットを期間で切り出すだけ
+    codes = grid.day_code[a:b] - grid.day_code[a]
+    d0, d1 = grid.day_code[a], grid.day_code[b - 1] + 1
+    day_start = np.clip(grid.day_offsets[d0:d1 + 1], a, b) - a
+    days = grid.days[d0:d1]
+    day_num = np.asarray((days - days[0]).days, dtype=np.int64)[codes]
+    midnight = grid.midnight[a:b]
+
+    return SocInputs(idx, net_load, price, day_num, midnight, day_start, day_price_order(price, day_start),
+                     slot_h=slot_h)
+
+def day_price_order(price, day_start):
+    """
+    日内の価格昇順位置（安定ソート、NaNは最後）。(日数 × 幅) に並べ、幅に満たない日は末尾をパディング。
+    price は (…, 行) の配列でよい（シナリオを重ねた2次元など）。戻り値: (…, 日数, 幅)
+    """
+    price = np.asarray(price, dtype=float)
+    counts = np.diff(day_start)
+    codes = np.repeat(np.arange(len(counts)), counts)
+    pos = np.arange(price.shape[-1]) - day_start[codes]
+    price2d = np.full(price.shape[:-1] + (len(counts), int(counts.max())), np.inf)
+    price2d[..., codes, pos] = price
+    return np.argsort(price2d, axis=-1, kind="stable")
+
+def charged_kwh_from_soc(soc_kWh, charging, E_prev=None):
+    """
+    derive_charge_cost_series と同じ定義の充電量（充電スロットのSOC増分、先頭スロットは0）。
+    E_prev: 先頭スロットの直前のSOC（途中から再開した計算のとき）
+    """
+    soc_kWh = np.asarray(soc_kWh)
+    # (シナリオ × 行) の2次元でも行方向に差分を取る
+    first = soc_kWh[..., :1] if E_prev is None else np.full(soc_kWh.shape[:-1] + (1,), E_prev)
+    delta = np.diff(soc_kWh, axis=-1, prepend=first)
+    return np.where(charging, np.clip(delta, 0.0, None), 0.0)
+
+def run_soc_policy(
+    inputs, policy=POLICY_PERIODIC, P_pcs=1000.0, P_chg=1000.0, E_nom=2000.0,
+    soc_init_pct=90.0, soc_floor_pct=10.0, reset_every_days=4, horizon_days=None, state=None
+):
+    """
+    SocInputs に対して充電ポリシーを実行する。
+    horizon_days: POLICY_HORIZON の計画区間（日）。None なら reset_every_days。
+    state: 開始時の (E_curr, charging_mode, 残り不足量)。None なら初期SOCから（途中再開用）
+    戻り値: dict（SOC_kWh, charging, charge_kWh, supply_kW の ndarray と、
+                 日の先頭ごとの状態 day_E / day_charging / day_deficit [日数+1、末尾は終了時]）
+    """
     E_init = float(soc_init_pct) / 100.0 * E_nom
     E_floor = float(soc_floor_pct) / 100.0 * E_nom
+    E_start = E_init if state is None else float(state[0])
+    slot_h = inputs.slot_h
+    # まず負荷に供出（PCS上限）。負荷が欠損のコマは供出0として扱う
+    supply_kW = np.minimum(inputs.net_load, float(P_pcs))
+    sup = np.where(np.isnan(supply_kW), 0.0, supply_kW)
+    day_state = None
+
+    if policy == POLICY_PERIODIC:
+        use_kWh = sup * slot_h
+        reset_flag = inputs.midnight & (inputs.day_num % int(reset_every_days) == 0)
+        soc_kWh, charging, day_state = periodic_reset_soc(use_kWh, reset_flag, E_init, E_floor, float(P_chg) * slot_h,
+                                                          inputs.day_start, state)
+        charge_kWh = charged_kwh_from_soc(soc_kWh, charging, None if state is None else E_start)
+    elif policy == POLICY_PRICE_OPT:
+        # 充電可能容量（各コマ）：min(P_chg, P_pcs - supply_kW) * slot_h
+        chg_cap = np.minimum(np.clip(float(P_pcs) - sup, 0.0, None), float(P_chg)) * slot_h
+        n_days = len(inputs.day_start) - 1
+        is_charge_day = ((np.arange(n_days) + inputs.first_day) % int(reset_every_days) == 0)
+        soc_kWh, charge_kWh = price_optimized_soc(
+            sup, chg_cap, inputs.day_start, is_charge_day, inputs.price_order, slot_h, E_init, E_floor, E_start
+        )
+        charging = charge_kWh > 1e-12
+    elif policy == POLICY_HORIZON:
+        chg_cap = np.minimum(np.clip(float(P_pcs) - sup, 0.0, None), float(P_chg)) * slot_h
+        # 先頭日から horizon_days 日ごとの区間に分け、区間内で最安コマから割当
+        window = inputs.day_num // int(horizon_days or reset_every_days)
+        win_start = np.concatenate([[0], np.flatnonzero(np.diff(window)) + 1, [len(window)]])
+        soc_kWh, charge_kWh = horizon_scheduled_soc(sup * slot_h, chg_cap, inputs.price, win_start, E_init, E_floor,
+                                                    E_start)
+        charging = charge_kWh > 1e-12
+    else:
+        raise ValueError(f"未対応の充電ポリシーです: {policy}")
+    if day_state is None:
+        # 日をまたいで持ち越す状態は SOC だけ（各日の先頭 = 前日の最終スロットのSOC）
+        k = len(inputs.day_start)
+        day_E = np.concatenate([[E_start], soc_kWh[inputs.day_start[1:] - 1]]) if len(soc_kWh) else np.full(k, E_start)
+        day_state = (day_E, np.zeros(k, dtype=bool), np.zeros(k))
+    return {"SOC_kWh": soc_kWh, "charging": charging, "charge_kWh": charge_kWh, "supply_kW": supply_kW,
+            "day_E": day_state[0], "day_charging": day_state[1], "day_deficit": day_state[2]}
 
-    times = use_kWh.index
-    if len(times) == 0:
-        return pd.DataFrame(columns=["SOC_kWh", "SOC_%", "charging"])
 
-    start_day = times[0].normalize()
-
-    E = E_init
-    charging_mode = False
-    charge_deficit = 0.0
-
-    soc_kWh = []
-    soc_pct = []
-    charging_flags = []
-
-    for t, e_use in use_kWh.items():
-        day_num = int((t.normalize() - start_day) / pd.Timedelta(days=1))
-        if (t.hour == 0 and t.minute == 0) and (day_num % int(reset_every_days) == 0):
-            charge_deficit = max(0.0, E_init - E)
-            charging_mode = charge_deficit > 0.0
-
-        if charging_mode:
-            add_kWh = min(float(P_chg) * 0.5, charge_deficit)
-            E = min(E_init, E + add_kWh)
-            charge_deficit -= add_kWh
-            if charge_deficit <= 1e-9 or E >= E_init - 1e-9:
-                charging_mode = False
-            charging_flags.append(True)
-        else:
-            E = max(E_floor, E - float(e_use))
-            charging_flags.append(False)
+# --- チェックポイント（期間の延長・データの追記で、変わっていない日を再計算しない） ---
+
+# 入力と結果の配列を丸ごと持つので、件数ではなくバイト数で上限を決める（utils_cache のLRUと同じ考え方）
+SOC_CHECKPOINT_MAX_MB = float(os.environ.get("TOSU_CHECKPOINT_MAX_MB", "256"))
+_SOC_CHECKPOINTS = OrderedDict()   # key -> (SocCheckpoint, バイト数)
+_SOC_CHECKPOINT_BYTES = 0
+_SOC_CHECKPOINT_LOCK = threading.Lock()
+_RESULT_ARRAYS = ("SOC_kWh", "charging", "charge_kWh", "supply_kW")
+_STATE_ARRAYS = ("day_E", "day_charging", "day_deficit")
+
+
+@dataclass(frozen=True)
+class SocCheckpoint:
+    """前回の計算の入力と結果（日の先頭ごとの状態を含む）"""
+    inputs: SocInputs
+    res: dict
+
+
+def _checkpoint_nbytes(inputs, res):
+    arrays = [inputs.index.asi8, inputs.net_load, inputs.price, inputs.day_num, inputs.midnight, inputs.day_start,
+              inputs.price_order]
+    return sum(np.asarray(a).nbytes for a in arrays) + sum(np.asarray(v).nbytes for v in res.values())
+
 
-        soc_kWh.append(E)
-        soc_pct.append(100.0 * E / E_nom)
+def _put_checkpoint(key, checkpoint):
+    global _SOC_CHECKPOINT_BYTES
+    nbytes = _checkpoint_nbytes(checkpoint.inputs, checkpoint.res)
+    with _SOC_CHECKPOINT_LOCK:
+        old = _SOC_CHECKPOINTS.pop(key, None)
+        if old is not None:
+            _SOC_CHECKPOINT_BYTES -= old[1]
+        if nbytes > SOC_CHECKPOINT_MAX_MB * 1024 ** 2:
+            return
+        _SOC_CHECKPOINTS[key] = (checkpoint, nbytes)
+        _SOC_CHECKPOINT_BYTES += nbytes
+        while _SOC_CHECKPOINT_BYTES > SOC_CHECKPOINT_MAX_MB * 1024 ** 2 and _SOC_CHECKPOINTS:
+            _, (_, n) = _SOC_CHECKPOINTS.popitem(last=False)
+            _SOC_CHECKPOINT_BYTES -= n
 
-    return pd.DataFrame({"SOC_kWh": soc_kWh, "SOC_%": soc_pct, "charging": charging_flags}, index=times)
+
+def _same_values(a, b):
+    return (a == b) | (np.isnan(a) & np.isnan(b))
+
+
+def _resume_day(old, new, policy, horizon_days, reset_every_days):
+    """
+    old の結果を new に使い回せる日数（この日の先頭から再計算する）。
+    入力が最初に食い違う行を含む日から。前回の最終日は途中までかもしれないので再計算し、
+    計画区間のポリシーは区間全体を見て割り当てるので区間の先頭まで戻す。
+    """
+    a, b = old.inputs, new
+    if len(a) == 0 or len(b) == 0 or a.index[0] != b.index[0] or a.slot_h != b.slot_h:
+        return 0
+    n = min(len(a), len(b))
+    same = ((a.index[:n] == b.index[:n]) & _same_values(a.net_load[:n], b.net_load[:n])
+            & _same_values(a.price[:n], b.price[:n]))
+    r = n if same.all() else int(np.argmin(same))
+    n_days = len(b.day_start) - 1
+    if r == len(b) and len(b) == len(a):
+        return n_days
+    d = min(int(np.searchsorted(b.day_start, r, side="right")) - 1, n_days - 1)
+    if policy == POLICY_HORIZON:
+        H = int(horizon_days or reset_every_days)
+        day_num = b.day_num[b.day_start[:-1]]
+        d = int(np.searchsorted(day_num, day_num[d] // H * H))
+    return d
+
+
+SOC_PROGRESS_DAYS = 30
+
+
+def _chunk_bounds(inputs, policy, horizon_days, reset_every_days, chunk_days):
+    # 区切る日の位置。計画区間のポリシーは区間の先頭でだけ区切る（区間の途中で分けると割当が変わる）
+    step = max(int(chunk_days), 1)
+    if policy == POLICY_HORIZON:
+        H = int(horizon_days or reset_every_days)
+        step = max(step // H, 1) * H
+    marks = inputs.day_num[inputs.day_start[:-1]] // step
+    return np.concatenate([[0], np.flatnonzero(np.diff(marks)) + 1, [len(marks)]])
+
+
+def run_soc_policy_chunked(inputs, policy, progress=None, chunk_days=SOC_PROGRESS_DAYS, state=None, **params):
+    """
+    run_soc_policy を chunk_days 日ごとに分けて実行し、区切るたびに progress(済んだ行の割合) を呼ぶ。
+    日の先頭の状態を引き継ぐので、結果は一括で計算したものとビット単位で一致する。
+    progress が例外を投げるとそこで止まる（バックグラウンドのジョブの取り消し）。progress=None なら一括で実行。
+    """
+    if progress is None or len(inputs) == 0:
+        return run_soc_policy(inputs, policy, state=state, **params)
+    bounds = _chunk_bounds(inputs, policy, params.get("horizon_days"), params.get("reset_every_days", 4), chunk_days)
+    parts = []
+    for d0, d1 in zip(bounds[:-1], bounds[1:]):
+        part = run_soc_policy(inputs.day_range(d0, d1), policy, state=state, **params)
+        parts.append(part)
+        state = tuple(part[k][-1] for k in _STATE_ARRAYS)
+        progress(int(inputs.day_start[d1]) / len(inputs))
+    res = {k: np.concatenate([p[k] for p in parts]) for k in _RESULT_ARRAYS}
+    for k in _STATE_ARRAYS:
+        # 各区切りの末尾（終了時の状態）は次の区切りの先頭と同じ
+        res[k] = np.concatenate([p[k][:-1] for p in parts] + [parts[-1][k][-1:]])
+    return res
+
+
+def run_soc_policy_resumable(inputs, policy, checkpoint_key, progress=None, **params):
+    """
+    run_soc_policy のチェックポイント付き版。checkpoint_key（データの系列・列選択など）と
+    パラメータが同じ前回の計算があれば、入力が変わっていない日までを再利用し、以降の日だけ計算する。
+    結果は最初から計算したものとビット単位で一致する。戻り値の resumed_rows は再利用した行数。
+    progress: 計算する部分の進捗の報告先（run_soc_policy_chunked）
+    """
+    key = (checkpoint_key, policy, tuple(sorted((k, None if v is None else float(v)) for k, v in params.items())),
+           inputs.index[0] if len(inputs) else None)
+    with _SOC_CHECKPOINT_LOCK:
+        item = _SOC_CHECKPOINTS.get(key)
+        if item is not None:
+            _SOC_CHECKPOINTS.move_to_end(key)
+    old = item[0] if item is not None else None
+    d = 0
+    if old is not None:
+        d = _resume_day(old, inputs, policy, params.get("horizon_days"), params.get("reset_every_days", 4))
+    if d == 0:
+        res = run_soc_policy_chunked(inputs, policy, progress, **params)
+    else:
+        r = int(inputs.day_start[d])
+        state = tuple(old.res[k][d] for k in _STATE_ARRAYS)
+        tail = (run_soc_policy_chunked(inputs.from_day(d), policy, progress, state=state, **params)
+                if r < len(inputs) else None)
+        res = {}
+        for k in _RESULT_ARRAYS:
+            res[k] = old.res[k][:r] if tail is None else np.concatenate([old.res[k][:r], tail[k]])
+        for k in _STATE_ARRAYS:
+            res[k] = old.res[k][:d + 1] if tail is None else np.concatenate([old.res[k][:d], tail[k]])
+    _put_checkpoint(key, SocCheckpoint(inputs, res))
+    return {**res, "resumed_rows": int(inputs.day_start[d]) if d else 0}
+
+
+def _soc_checkpoint_key(df, load_col, gen_col, price_col):
+    # データの系列（同じファイル/ストア）と列の選び方。内容の一致は再開時に入力を比べて確かめる
+    return (frame_memo(df).get("dataset_lineage"), load_col, gen_col, price_col)
+
+
+def simulate_soc_with_charge_periodic_reset(
+    df, P_pcs=1000.0, P_chg=1000.0, E_nom=2000.0,
+    start=None, end=None,
+    soc_init_pct=90.0, soc_floor_pct=10.0, reset_every_days=4,
+    load_col=None, gen_col=None, resume=True, progress=None
+):
+    """
+    充電間隔ごとの0:00から、初期SOCに戻るまで連続で充電する（充電中は供出しない）。
+    resume: 同じ条件の前回の計算があれば、変わっていない日を再計算しない（run_soc_policy_resumable）
+    progress: 進捗の報告先。指定すると30日ごとに区切って計算し、区切るたびに呼ぶ（run_soc_policy_chunked）
+    """
+    inputs = prepare_soc_inputs(df, start, end, load_col=load_col, gen_col=gen_col)
+    if len(inputs) == 0:
+        return pd.DataFrame(columns=["SOC_kWh", "SOC_%", "charging"])
+    params = dict(P_pcs=P_pcs, P_chg=P_chg, E_nom=E_nom, soc_init_pct=soc_init_pct, soc_floor_pct=soc_floor_pct,
+                  reset_every_days=reset_every_days)
+    if resume:
+        key = _soc_checkpoint_key(df, load_col, gen_col, "JEPXスポットプライス")
+        res = run_soc_policy_resumable(inputs, POLICY_PERIODIC, key, progress, **params)
+    else:
+        res = run_soc_policy_chunked(inputs, POLICY_PERIODIC, progress, **params)
+    soc_kWh = res["SOC_kWh"]
+    return pd.DataFrame({"SOC_kWh": soc_kWh, "SOC_%": 100.0 * soc_kWh / E_nom, "charging": res["charging"]}, index=inputs.index)
 
 def plot_lines(x, y_dict, xlabel, ylabel, title):
+    plt = setup_matplotlib()
     plt.figure(figsize=(12, 6))
     for label, series in y_dict.items():
         plt.plot(x, series, label=label)
@@ -231,6 +829,36 @@ def plot_lines(x, y_dict, xlabel, ylabel, title):
     plt.grid(True)
     return plt.gcf()
 
+def add_day_overlay(ax, mat, alpha=0.2, linewidth=0.7):
+    """
+    (日数 × スロット) 行列の各日を1つの LineCollection で重ね描きする。
+    日ごとに Line2D を作らないので、日数が増えても描画が重くならない。NaNは線の切れ目になる。
+    """
+    from matplotlib import rcParams
+    from matplotlib.collections import LineCollection
+    mat = np.asarray(mat, dtype=float)
+    x = np.broadcast_to(np.arange(mat.shape[1], dtype=float), mat.shape)
+    colors = [c["color"] for c in rcParams["axes.prop_cycle"]]
+    lc = LineCollection(np.stack([x, mat], axis=-1), colors=colors, alpha=alpha, linewidths=linewidth)
+    ax.add_collection(lc)
+    ax.autoscale_view()
+    return lc
+
+def slot_value_density(mat, vmin, vmax, bins=100):
+    """
+    (日数 × スロット) 行列の (値ビン × スロット) 出現回数。ヒートマップ用。
+    戻り値: (counts[bins, スロット数], ビン境界)
+    """
+    mat = np.asarray(mat, dtype=float)
+    slots = np.broadcast_to(np.arange(mat.shape[1]), mat.shape).ravel()
+    vals = mat.ravel()
+    ok = ~np.isnan(vals)
+    counts, _, edges = np.histogram2d(
+        slots[ok], vals[ok], bins=[mat.shape[1], bins],
+        range=[[-0.5, mat.shape[1] - 0.5], [vmin, vmax]]
+    )
+    return counts.T, edges
+
 def derive_charge_cost_series(soc_df, df_price, price_col="JEPXスポットプライス"):
     if price_col not in df_price.columns:
         price_series = pd.Series(0.0, index=soc_df.index)
@@ -250,118 +878,66 @@ def simulate_soc_concurrent_price_optimized(
     start=None, end=None,
     soc_init_pct=90.0, soc_floor_pct=10.0, reset_every_days=4,
     price_col="JEPXスポットプライス",
-    load_col=None, gen_col=None
+    load_col=None, gen_col=None, resume=True, progress=None
 ):
     """
     充電日には「その日の最安コマから」充電量を割当。
     充電中も負荷対応を継続し、(供出kW + 充電kW) <= PCS定格 を満たす。
     充電は初期SOC(=目標)まで。到達不能な場合はその日最大限充電して翌日に繰越。
+    resume: 同じ条件の前回の計算があれば、変わっていない日を再計算しない
+    progress: 進捗の報告先（run_soc_policy_chunked）
     """
-    # 期間トリム
-    if start is not None:
-        start = pd.Timestamp(start)
-        if df.index.tz is not None and start.tzinfo is None:
-            start = start.tz_localize(df.index.tz)
-        df = df.loc[df.index >= start]
-    if end is not None:
-        end = pd.Timestamp(end)
-        if df.index.tz is not None and end.tzinfo is None:
-            end = end.tz_localize(df.index.tz)
-        df = df.loc[df.index <= end]
-    if df.empty:
+    inputs = prepare_soc_inputs(df, start, end, load_col=load_col, gen_col=gen_col, price_col=price_col)
+    if len(inputs) == 0:
         return pd.DataFrame(columns=["SOC_kWh", "SOC_%", "charging", "charge_kWh", "supply_kW"])
-
-    # 需要・自家発
-    L = pick_load_series(df, preferred=load_col)
-    G = pick_generation_series(df, preferred=gen_col)
-    net_load = (L - G).clip(lower=0.0)  # kW
-    # まず負荷に供出（PCS上限）
-    supply_kW = net_load.clip(upper=float(P_pcs))
-
-    # 価格
-    if price_col in df.columns:
-        price = df[price_col].astype(float)
+    params = dict(P_pcs=P_pcs, P_chg=P_chg, E_nom=E_nom, soc_init_pct=soc_init_pct, soc_floor_pct=soc_floor_pct,
+                  reset_every_days=reset_every_days)
+    if resume:
+        key = _soc_checkpoint_key(df, load_col, gen_col, price_col)
+        res = run_soc_policy_resumable(inputs, POLICY_PRICE_OPT, key, progress, **params)
     else:
-        price = pd.Series(0.0, index=df.index)
-
-    # 初期/下限
-    E_init = float(soc_init_pct) / 100.0 * E_nom
-    E_floor = float(soc_floor_pct) / 100.0 * E_nom
-
-    # スロット長
-    slot_h = 0.5
-
-    # 出力用ベクトル
-    E = []
-    E_curr = E_init
-    charging_flag = []
-    charge_kWh_vec = []
-
-    times = df.index
-    start_day = times[0].normalize()
-
-    # 日単位でスケジューリング
-    day_groups = df.groupby(df.index.normalize())
-
-    day_counter = 0
-    for day, d in day_groups:
-        # その日が充電日か？
-        is_charge_day = (day_counter % int(reset_every_days) == 0)
-        prices = price.loc[d.index]
-        sup_kW = supply_kW.loc[d.index]
-
-        # まず「充電ゼロ」で当日終端までSOCを推定
-        E_tmp = E_curr
-        soc_floor_clip = []
-        E_path_nochg = []
-        for kW in sup_kW:
-            E_tmp = max(E_floor, E_tmp - kW * slot_h)  # 放電のみ
-            E_path_nochg.append(E_tmp)
-            soc_floor_clip.append(E_tmp <= E_floor + 1e-9)
-
-        # 目標SOC（初期SOC）まで戻すための必要量R
-        R = max(0.0, E_init - E_path_nochg[-1]) if is_charge_day else 0.0
-
-        # 充電可能容量（各コマ）：min(P_chg, P_pcs - supply_kW) * slot_h
-        chg_cap = (pd.Series(float(P_pcs), index=d.index) - sup_kW).clip(lower=0.0)
-        chg_cap = pd.concat([chg_cap, pd.Series(float(P_chg), index=d.index)], axis=1).min(axis=1) * slot_h  # kWh/slot
-
-        # 価格最小から割当（is_charge_day のときだけ）
-        alloc = pd.Series(0.0, index=d.index)
-        if is_charge_day and R > 0:
-            order = prices.sort_values(kind="mergesort").index  # 安定ソート
-            remaining = R
-            for t in order:
-                cap = chg_cap.loc[t]
-                if cap <= 0 or remaining <= 0:
-                    continue
-                add = min(cap, remaining)
-                alloc.loc[t] = add
-                remaining -= add
-            # 残があれば翌日に繰越（ここでは警告せず、残量はE_currに反映されるだけ）
-
-        # 当日の時間軸でSOCを更新（同時供出を考慮）
-        for t in d.index:
-            # 放電
-            E_curr = max(E_floor, E_curr - sup_kW.loc[t] * slot_h)
-            # 充電（割当分+容量制約+SOC上限）
-            add = alloc.loc[t] if is_charge_day else 0.0
-            # 容量上限
-            add = min(add, max(0.0, E_init - E_curr))
-            E_curr += add
-
-            E.append(E_curr)
-            charging_flag.append(add > 1e-12)
-            charge_kWh_vec.append(add)
-
-        day_counter += 1
-
+        res = run_soc_policy_chunked(inputs, POLICY_PRICE_OPT, progress, **params)
+    E = res["SOC_kWh"]
     out = pd.DataFrame({
         "SOC_kWh": E,
-        "SOC_%": [100.0 * e / E_nom for e in E],
-        "charging": charging_flag,
-        "charge_kWh": charge_kWh_vec,
-        "supply_kW": supply_kW.values
-    }, index=df.index)
+        "SOC_%": 100.0 * E / E_nom,
+        "charging": res["charging"],
+        "charge_kWh": res["charge_kWh"],
+        "supply_kW": res["supply_kW"]
+    }, index=inputs.index)
 
     return out
+
+
+def simulate_soc_horizon_scheduled(
+    df, P_pcs=1000.0, P_chg=1000.0, E_nom=2000.0,
+    start=None, end=None,
+    soc_init_pct=90.0, soc_floor_pct=10.0, reset_every_days=4, horizon_days=None,
+    price_col="JEPXスポットプライス",
+    load_col=None, gen_col=None, resume=True, progress=None
+):
+    """
+    先頭日から horizon_days 日（未指定なら充電間隔）ごとの計画区間で、区間内の最安コマから充電を割当。
+    下限SOCを割らず、区間末に初期SOCへ戻る範囲で (供出kW + 充電kW) <= PCS定格 を満たす。
+    割り当てきれない場合は下限SOCで頭打ち・区間末の不足は次の区間へ繰越。
+    resume: 同じ条件の前回の計算があれば、変わっていない計画区間を再計算しない
+    progress: 進捗の報告先（run_soc_policy_chunked）
+    """
+    inputs = prepare_soc_inputs(df, start, end, load_col=load_col, gen_col=gen_col, price_col=price_col)
+    if len(inputs) == 0:
+        return pd.DataFrame(columns=["SOC_kWh", "SOC_%", "charging", "charge_kWh", "supply_kW"])
+    params = dict(P_pcs=P_pcs, P_chg=P_chg, E_nom=E_nom, soc_init_pct=soc_init_pct, soc_floor_pct=soc_floor_pct,
+                  reset_every_days=reset_every_days, horizon_days=horizon_days)
+    if resume:
+        key = _soc_checkpoint_key(df, load_col, gen_col, price_col)
+        res = run_soc_policy_resumable(inputs, POLICY_HORIZON, key, progress, **params)
+    else:
+        res = run_soc_policy_chunked(inputs, POLICY_HORIZON, progress, **params)
+    E = res["SOC_kWh"]
+    return pd.DataFrame({
+        "SOC_kWh": E,
+        "SOC_%": 100.0 * E / E_nom,
+        "charging": res["charging"],
+        "charge_kWh": res["charge_kWh"],
+        "supply_kW": res["supply_kW"]
+    }, index=inputs.index)